@@ -15,6 +15,14 @@ AUTH_CONFIG = {
     # 认证相关URL
     'login_url': 'https://sso.buaa.edu.cn/login',
     'redirect_url': 'https://chat.buaa.edu.cn/',
+    # 快速登录：先通过requests完成CAS认证，再把cookies注入浏览器；需要验证码或无法解析登录页时回退到浏览器表单
+    'fast_login': True,
+    'http_pool_size': 10,  # 认证会话的HTTP连接池大小
+    # 会话保活：后台定期用requests访问助手页面，会话失效或cookie即将过期时提前重新登录
+    'keepalive': True,
+    'keepalive_interval': 300,  # 保活检查间隔（秒）
+    'keepalive_margin': 120,  # cookie过期前多少秒提前重新登录
+    'login_check_ttl': 60,  # is_login_required检查结果的缓存时间（秒）
 }
 
 # AI助手配置
@@ -44,6 +52,148 @@ ASSISTANT_CONFIG = {
     'timeout': 60,  # 请求超时时间（秒）
     'max_retries': 3,  # 最大重试次数
     'retry_delay': 2,  # 重试间隔（秒）
+    'max_retry_after': 30,  # 服务端Retry-After的上限（秒），更长的等待按此截断
+    
+    # 同一类型助手的相同问题同时到达时，只进行一轮浏览器对话，其余调用方等待并复用回复
+    'coalesce_requests': True,
+    
+    # 对话失败时按故障类别的恢复策略，覆盖src/utils/recovery.py中的默认值
+    # 例如 {'unknown': {'max_attempts': 2, 'delay': 2}}
+    'recovery_policy': {},
+}
+
+# 熔断配置：站点故障或限流时快速失败，避免批量任务逐个耗尽等待时间
+CIRCUIT_BREAKER_CONFIG = {
+    'failure_threshold': 3,  # 连续失败多少次后打开熔断
+    'reset_timeout': 60,  # 打开后多久进入半开状态并发送探测问题（秒）
+    'on_open': 'park',  # 熔断打开时批量任务的处理方式：'park' 暂停队列等待恢复，'fail_fast' 直接标记失败
+    'probe_question': '你好',  # 半开状态下用于探测站点是否恢复的问题
+    'probe_deadline': 60,  # 探测问题的截止时间（秒）
+    'max_park_time': 1800,  # 暂停队列等待恢复的最长时间（秒），超过后剩余问题快速失败
+    'turn_deadline': None,  # 批量任务中每个问题的截止时间（秒），None表示不限制
+}
+
+# 自适应并发控制（AIMD）：根据延迟、错误率和空回复率调整同时进行的对话数和发送间隔
+CONCURRENCY_CONFIG = {
+    'enabled': False,  # 是否启用，多个浏览器并行处理时建议开启
+    'state_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'concurrency_state.json'),  # 多进程共享的状态文件
+    'initial_limit': 1,  # 初始并发对话数
+    'min_limit': 1,  # 最小并发对话数
+    'max_limit': 4,  # 最大并发对话数
+    'increase_step': 1,  # 每个窗口的加性增量
+    'decrease_factor': 0.5,  # 拥塞时的乘性减系数
+    'min_interval': 0.5,  # 最小发送间隔（秒）
+    'max_interval': 30,  # 最大发送间隔（秒）
+    'latency_threshold': 90,  # 单次对话超过该耗时视为拥塞（秒）
+    'lease_timeout': 600,  # 在途记录的租期（秒），超过后视为进程已退出
+}
+
+# 相似问题复用：用字符n-gram TF-IDF在历史问答中查找改写过的相同问题，直接复用其回答
+SIMILARITY_CONFIG = {
+    'enabled': False,  # 是否启用
+    'threshold': 0.85,  # 复用回答所需的最低余弦相似度
+    'top_k': 5,  # 批量检索时每个问题返回的候选数
+    'ngram_range': (1, 3),  # 字符n-gram长度范围
+    'n_features': 2 ** 20,  # n-gram哈希后的特征维度
+    'merge_min_docs': 1000,  # 增量段至少达到多少条问答才合并进主段
+    'merge_ratio': 0.05,  # 增量段超过主段的该比例时合并进主段
+}
+
+# 批内近似重复问题检测：每组近似重复的问题只发送一次，回答复制给组内所有行
+DEDUP_CONFIG = {
+    'enabled': False,  # 是否默认启用（也可通过命令行 --dedup 启用）
+    'threshold': 0.85,  # 判定为重复的最低Jaccard相似度（字符shingle集合）
+    'num_perm': 64,  # MinHash签名长度
+    'bands': 16,  # LSH分段数，需整除num_perm
+    'shingle_size': 3,  # 字符shingle长度
+}
+
+# 多问题打包：批量处理时把多个简短问题合并到一轮对话中回答
+PACKING_CONFIG = {
+    'enabled': False,  # 是否默认启用（也可通过命令行 --pack 启用）
+    'max_items': 5,  # 每轮对话最多打包的问题数
+    'max_question_length': 80,  # 可打包问题的最大长度，更长的问题单独提问
+}
+
+# 批量任务调度：预测回答耗时，按最长处理时间优先(LPT)分配给多个浏览器并允许任务窃取
+SCHEDULING_CONFIG = {
+    'default_seconds': 20,  # 没有历史数据时，约20字问题的预测耗时（秒）
+    'long_keywords': ['详细', '具体', '解释', '分析', '比较', '对比', '举例', '代码', '步骤', '列出', '总结', '论述', '介绍', '为什么', '如何', '写一'],  # 通常回答较长的关键词
+    'short_keywords': ['是否', '是不是', '多少', '几点', '哪里', '在哪', '几个', '谁', '简述', '一句话'],  # 通常回答较短的关键词
+    'neighbors': 5,  # 参考的历史相似问题数
+    'min_similarity': 0.3,  # 参考历史相似问题的最低相似度
+    'min_samples': 20,  # 历史样本达到该数量才重新拟合特征系数
+    'max_history_seconds': 600,  # 历史中超过该耗时的轮次视为异常，不参与训练（秒）
+}
+
+# 请求调度：多个调用方共用一组已登录的浏览器时，按优先级和租户公平排队
+SCHEDULER_CONFIG = {
+    'priorities': {'interactive': 0, 'batch': 10},  # 优先级名称 -> 级别，数值越小越优先
+    'tenant_weights': {},  # 租户 -> 权重，同一优先级内权重越大分到的对话轮次越多，默认为1
+    'reserved_interactive': 0,  # 只处理最高优先级请求的浏览器数量，至少保留一个处理其他请求
+    'wait_window': 1000,  # 统计排队等待时间分位数时保留的最近请求数
+}
+
+# 多账号：批量任务中每个工作线程独占一个账号，使用独立的cookies和浏览器配置目录
+CREDENTIAL_CONFIG = {
+    # 账号来源：环境变量文件中的 BUAA_ACCOUNTS=学号1:密码1,学号2:密码2 或 BUAA_ACCOUNT_<n>=学号:密码，
+    # 以及本地凭据库（JSON，设置 BUAA_CREDENTIAL_KEY 时按Fernet密钥加密）
+    'env_file': os.getenv('BUAA_ACCOUNTS_FILE', '.env'),
+    'store_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'credentials.json'),
+    'profile_root': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'profiles'),  # 每个账号的浏览器配置目录位于其下以学号命名的子目录
+    'stats_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'account_stats.json'),  # 各账号的历史吞吐量，用于按速度分配问题
+    'throughput_alpha': 0.3,  # 吞吐量指数滑动平均的权重
+    'max_consecutive_failures': 3,  # 连续失败达到该次数的账号暂停使用
+    'cooldown': 1800,  # 需要验证码或被锁定的账号的冷却时间（秒）
+}
+
+# 本地服务：main.py --serve 提供OpenAI兼容的 /v1/chat/completions 接口
+SERVER_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8000,
+    'assistants': 2,  # 预先登录的AI助手（浏览器）数量
+    'api_key': os.getenv('BUAA_SERVER_API_KEY', ''),  # 设置后要求请求携带 Authorization: Bearer <api_key>
+    'max_queue': 32,  # 排队中的请求数上限，超过时返回429
+    'request_timeout': 300,  # 每个请求的截止时间（秒），包含排队时间
+    'heartbeat': 15,  # 流式输出等待期间发送SSE心跳注释的间隔（秒）
+    'idle_timeout': 60,  # keep-alive空闲连接的超时时间（秒）
+    'initial_turn_seconds': 20,  # 估计Retry-After时使用的初始平均对话耗时（秒）
+    'drain_timeout': 120,  # 关闭时等待已排队请求完成的最长时间（秒）
+}
+
+# 对话历史持久化配置
+PERSISTENCE_CONFIG = {
+    'background_writes': True,  # 是否在后台线程中合并写入对话历史，关闭时每轮对话同步写入
+    'flush_interval': 2.0,  # 第一项更新入队后最多等待多少秒写入
+    'max_pending': 20,  # 积压的更新达到多少次时立即写入
+}
+
+# 延迟直方图配置
+LATENCY_CONFIG = {
+    'enabled': True,  # 是否记录每轮对话的延迟、首字延迟和回答长度
+    'histogram_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'latency_histograms.json'),
+    'relative_accuracy': 0.01,  # 分位数的相对误差上界，修改后与已有记录无法合并
+    'slo': {  # 各指标分位数的目标值，报告中标出超出目标的分位数
+        'turn.latency': {'p90': 60, 'p99': 120},
+        'turn.first_char': {'p90': 15},
+    },
+}
+
+# 基准测试配置
+BENCHMARK_CONFIG = {
+    'db_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'benchmarks.sqlite'),
+    'turns': 3,  # 真实对话的轮数
+    'history_repeats': 20,  # 对话历史读写的重复次数
+    'history_turns': 20,  # 基准测试中每个已有对话的轮数
+    'alpha': 0.05,  # 判定回退的显著性水平（单侧Mann-Whitney U检验）
+    'min_slowdown': 0.05,  # 中位数至少变慢该比例才判定为回退，忽略显著但微小的变化
+}
+
+# 采样分析配置
+PROFILER_CONFIG = {
+    'enabled': False,  # 是否在每轮对话期间采样调用栈（main.py --profile 会开启）
+    'output_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'profiler'),
+    'interval': 0.01,  # 采样间隔(秒)
 }
 
 # 日志配置
@@ -66,6 +216,12 @@ WEBDRIVER_CONFIG = {
     'use_browser_first': True,  # API方式已禁用，强制使用浏览器模拟模式
     'wait_for_answer': 60,  # 等待AI回答的最大时间（秒）
     'keep_browser_open': False,  # 是否在程序结束时保持浏览器开启状态
+    # 显式等待配置（替代固定时长的sleep）
+    'wait_poll_interval': 0.1,  # 就绪条件轮询间隔（秒）
+    'login_redirect_timeout': 20,  # 提交登录表单后等待跳转的最长时间（秒）
+    'captcha_timeout': 120,  # 等待用户手动填写验证码的最长时间（秒）
+    'captcha_min_length': 4,  # 验证码最少字符数，填满后自动提交
+    'welcome_message_timeout': 5,  # 等待欢迎消息节点出现的最长时间（秒）
     'element_selectors': {
         'input_selectors': [
             "#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea",  # 更新：更精确的输入框选择器
@@ -115,4 +271,7 @@ LOG_CONFIG = {
 MESSAGE_CONFIG = {
     'max_message_length': 2000,  # 单条消息最大长度
     'history_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history.json'),
+    'history_shards': True,  # 每个进程写入自己的历史分片，读取时与主历史文件合并
+    'history_shard_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history_shards'),
+    'compact_threshold': 16,  # 分片数量达到该值时自动合并到主历史文件，0表示只手动合并
 } 
\ No newline at end of file
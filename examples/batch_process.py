@@ -11,8 +11,9 @@ import argparse
 import csv
 import json
 import time
+import threading
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 from tqdm import tqdm
 
@@ -20,6 +21,13 @@ from tqdm import tqdm
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.assistant import AIAssistant
+from src.auth import AuthError, CaptchaRequiredError
+from src.credentials import Account, CredentialPool, CredentialError, is_account_failure
+from src.utils.concurrency import get_controller
+from src.utils.dedup import cluster_near_duplicates, fan_out
+from src.utils.packing import plan_packs, answer_pack
+from src.utils.scheduling import DurationPredictor, WorkStealingScheduler, makespan_report
+from src.utils.histogram import run_report
 import config
 
 def read_questions(file_path: str) -> List[str]:
@@ -132,13 +140,18 @@ def save_results(results: List[Dict[str, Any]], output_path: str, format_type: s
         elif format_type == 'csv':
             with open(output_path, 'w', encoding='utf-8', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(['问题', '回答', '时间'])
+                # 有近似重复问题复用回答时，增加一列标明复用的是第几个问题的回答
+                has_duplicates = any('duplicate_of' in item for item in results)
+                writer.writerow(['问题', '回答', '时间'] + (['复用自'] if has_duplicates else []))
                 for item in results:
-                    writer.writerow([
+                    row = [
                         item['question'], 
                         item['answer'], 
                         item['timestamp']
-                    ])
+                    ]
+                    if has_duplicates:
+                        row.append(item.get('duplicate_of', ''))
+                    writer.writerow(row)
         
         else:  # txt
             with open(output_path, 'w', encoding='utf-8') as f:
@@ -146,6 +159,8 @@ def save_results(results: List[Dict[str, Any]], output_path: str, format_type: s
                     f.write(f"问题 {i+1}: {item['question']}\n")
                     f.write(f"回答: {item['answer']}\n")
                     f.write(f"时间: {item['timestamp']}\n")
+                    if 'duplicate_of' in item:
+                        f.write(f"复用自: 问题 {item['duplicate_of']} 的回答\n")
                     f.write("-" * 80 + "\n\n")
         
         print(f"结果已保存到 {output_path}")
@@ -155,6 +170,217 @@ def save_results(results: List[Dict[str, Any]], output_path: str, format_type: s
         print(f"保存结果出错: {str(e)}")
         return False
 
+def make_result(question: str, response: str) -> Dict[str, Any]:
+    """
+    生成成功的结果记录
+    
+    Args:
+        question (str): 问题
+        response (str): 回答
+        
+    Returns:
+        dict: 结果记录
+    """
+    return {
+        'question': question,
+        'answer': response,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'success': True
+    }
+
+def answer_question(assistant: AIAssistant, question: str,
+                    errors: Optional[List[BaseException]] = None) -> Dict[str, Any]:
+    """
+    发送一个问题并生成结果记录
+    
+    Args:
+        assistant (AIAssistant): AI助手实例
+        question (str): 问题
+        errors (list, optional): 失败时把异常追加到此列表，用于判断失败是否归因于账号
+        
+    Returns:
+        dict: 结果记录
+    """
+    try:
+        response = assistant.chat(question)
+        return make_result(question, response)
+    except Exception as e:
+        print(f"处理问题 '{question[:50]}...' 时出错: {str(e)}")
+        if errors is not None:
+            errors.append(e)
+        return {
+            'question': question,
+            'answer': f"错误: {str(e)}",
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'success': False
+        }
+
+def answer_questions(assistant: AIAssistant, questions: List[str],
+                     errors: Optional[List[BaseException]] = None) -> List[Dict[str, Any]]:
+    """
+    回答一组问题，多个问题时打包在一轮对话中回答
+    
+    Args:
+        assistant (AIAssistant): AI助手实例
+        questions (list): 一组问题
+        errors (list, optional): 收集失败问题的异常
+        
+    Returns:
+        list: 与问题一一对应的结果记录
+    """
+    return answer_pack(assistant, questions,
+                       lambda question: answer_question(assistant, question, errors),
+                       make_result)
+
+def start_account_assistant(pool: CredentialPool, account: Account,
+                            assistant_type: str) -> Tuple[Optional[AIAssistant], Optional[Account]]:
+    """
+    使用账号池中的账号初始化AI助手；账号需要验证码或登录失败时暂停该账号并换用池中的空闲账号
+    
+    Args:
+        pool (CredentialPool): 账号池
+        account (Account): 首选账号（已占用）
+        assistant_type (str): AI助手类型
+        
+    Returns:
+        tuple: (AI助手, 使用的账号)，池中没有可用账号时为(None, None)
+    """
+    while account is not None:
+        try:
+            assistant = AIAssistant(username=account.username, password=account.password,
+                                    assistant_type=assistant_type, profile_dir=account.profile_dir,
+                                    interactive_captcha=False)
+            return assistant, account
+        except CaptchaRequiredError as e:
+            print(f"账号 {account.username} 需要验证码，暂停使用: {str(e)}")
+            pool.mark_unavailable(account, Account.CAPTCHA)
+        except AuthError as e:
+            print(f"账号 {account.username} 登录失败，暂停使用: {str(e)}")
+            pool.mark_unavailable(account, Account.LOCKED)
+        except Exception as e:
+            print(f"账号 {account.username} 初始化AI助手失败: {str(e)}")
+        pool.release(account)
+        account = pool.acquire()
+    return None, None
+
+def run_workers(questions: List[str], workers: int, username: str, password: str,
+                assistant_type: str, packs: List[List[int]] = None, lpt: bool = False,
+                pool: CredentialPool = None) -> List[Dict[str, Any]]:
+    """
+    使用多个浏览器并行处理问题，结果按输入顺序返回
+    
+    Args:
+        questions (list): 问题列表
+        workers (int): 工作线程数，每个线程使用独立的浏览器
+        username (str): 用户名
+        password (str): 密码
+        assistant_type (str): AI助手类型
+        packs (list, optional): 问题分组（问题序号列表），每组在一轮对话中回答，默认每个问题单独一组
+        lpt (bool): 是否按预测耗时从长到短调度，并输出预测与实际完工时间的对比
+        pool (CredentialPool, optional): 账号池，提供时每个工作线程独占一个账号，
+            并按各账号观测到的吞吐量分配问题
+        
+    Returns:
+        list: 结果列表
+    """
+    results: List[Dict[str, Any]] = [None] * len(questions)
+    packs = packs or [[index] for index in range(len(questions))]
+    
+    accounts: List[Optional[Account]] = [None] * workers
+    speeds = None
+    if pool is not None:
+        accounts = [account for account in (pool.acquire() for _ in range(workers)) if account is not None]
+        if not accounts:
+            raise CredentialError("账号池中没有可用的账号")
+        workers = len(accounts)
+        speeds = pool.speeds(accounts)
+    
+    if lpt:
+        predicted = DurationPredictor.from_history().predict(questions)
+        costs = [sum(predicted[index] for index in pack) for pack in packs]
+    else:
+        costs = [1.0] * len(packs)
+    scheduler = WorkStealingScheduler(costs, workers, speeds)
+    actual: Dict[int, float] = {}
+    busy = [0.0] * workers
+    
+    progress = tqdm(total=len(questions), desc="处理进度")
+    progress_lock = threading.Lock()
+    controller = get_controller()
+    
+    def worker(worker_id: int):
+        account = accounts[worker_id]
+        if pool is not None:
+            assistant, account = start_account_assistant(pool, account, assistant_type)
+            if assistant is None:
+                return
+        else:
+            try:
+                assistant = AIAssistant(username=username, password=password, assistant_type=assistant_type)
+            except Exception as e:
+                print(f"工作线程初始化AI助手失败: {str(e)}")
+                return
+        try:
+            while True:
+                task = scheduler.next_task(worker_id)
+                if task is None:
+                    break
+                pack = packs[task]
+                started = time.monotonic()
+                errors: List[BaseException] = []
+                pack_results = answer_questions(assistant, [questions[index] for index in pack], errors)
+                actual[task] = time.monotonic() - started
+                busy[worker_id] += actual[task]
+                for index, result in zip(pack, pack_results):
+                    results[index] = result
+                with progress_lock:
+                    progress.update(len(pack))
+                    if controller:
+                        progress.set_postfix(limit=f"{controller.get_metrics()['limit']:.2f}")
+                
+                if account is not None:
+                    # 熔断拒绝或截止时间耗尽不计入账号的连续失败
+                    pool.record(account, actual[task], len(pack),
+                                success=all(result['success'] for result in pack_results),
+                                account_failure=any(is_account_failure(error) for error in errors))
+                    # 账号连续失败（如被限流或锁定）时停止使用，剩余问题由其他账号的工作线程窃取
+                    if account.status != Account.ACTIVE:
+                        print(f"账号 {account.username} 连续失败，停止分配问题")
+                        break
+        finally:
+            assistant.close()
+            if account is not None:
+                pool.release(account)
+    
+    threads = [threading.Thread(target=worker, args=(worker_id,), daemon=True) for worker_id in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    progress.close()
+    
+    if pool is not None:
+        for account in pool.accounts:
+            if account.completed or account.status != Account.ACTIVE:
+                rate = f"{account.throughput * 60:.1f} 个/分钟" if account.throughput else "无"
+                print(f"账号 {account.username}: 完成 {account.completed} 个问题，吞吐量 {rate}，状态 {account.status}")
+    
+    if lpt:
+        # 实际完工时间取各工作线程处理任务的累计时间的最大值，不含浏览器启动和登录
+        print(makespan_report(scheduler.predicted_makespan, max(busy), costs, actual)
+              + f"，任务窃取 {scheduler.steals} 次")
+    
+    # 所有工作线程都初始化失败时，未处理的问题标记为失败
+    for index, question in enumerate(questions):
+        if results[index] is None:
+            results[index] = {
+                'question': question,
+                'answer': "错误: 没有可用的工作线程",
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'success': False
+            }
+    return results
+
 def main():
     """主函数"""
     # 加载环境变量
@@ -172,14 +398,39 @@ def main():
     parser.add_argument('-f', '--format', choices=['txt', 'csv', 'json'], default='csv',
                        help='输出格式，默认为csv')
     parser.add_argument('--delay', type=int, default=2, help='每个问题之间的延迟时间（秒），默认为2秒')
+    parser.add_argument('--workers', type=int, default=1, help='并行的浏览器数量，默认为1')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='启用自适应并发控制(AIMD)，根据延迟和错误率自动调整并发数和发送间隔，替代固定的--delay')
+    parser.add_argument('--dedup', action='store_true',
+                        help='近似重复的问题只发送一次，回答复制给所有重复的行')
+    parser.add_argument('--pack', type=int, metavar='K',
+                        help='打包模式：每轮对话最多合并K个简短问题一起回答')
+    parser.add_argument('--lpt', action='store_true',
+                        help='多浏览器并行时，按预测回答耗时从长到短调度，并报告预测与实际完工时间')
+    parser.add_argument('--accounts', action='store_true',
+                        help='多账号模式：从账号池加载多个账号，每个浏览器使用独立账号，按各账号吞吐量分配问题')
     args = parser.parse_args()
     
+    if args.adaptive:
+        config.CONCURRENCY_CONFIG['enabled'] = True
+    
     # 获取凭据
     username = args.username or config.AUTH_CONFIG.get('username', '')
     password = args.password or config.AUTH_CONFIG.get('password', '')
     
+    pool = None
+    if args.accounts:
+        try:
+            pool = CredentialPool.load()
+        except CredentialError as e:
+            print(f"错误：{str(e)}")
+            sys.exit(1)
+        # 未指定并行数时每个账号一个浏览器
+        args.workers = min(args.workers if args.workers > 1 else len(pool), len(pool))
+        print(f"多账号模式: 账号池共 {len(pool)} 个账号，使用 {args.workers} 个")
+    
     # 检查凭据
-    if not username or not password:
+    if pool is None and (not username or not password):
         print("错误：缺少用户名或密码。请通过命令行参数提供，或在config.py或环境变量中设置。")
         sys.exit(1)
     
@@ -198,48 +449,66 @@ def main():
     
     print(f"共读取 {len(questions)} 个问题")
     
+    # 近似重复的问题只发送代表问题
+    if args.dedup or config.DEDUP_CONFIG.get('enabled', False):
+        representatives = cluster_near_duplicates(questions)
+    else:
+        representatives = list(range(len(questions)))
+    pending = [i for i, rep in enumerate(representatives) if rep == i]
+    unique_questions = [questions[i] for i in pending]
+    if len(pending) < len(questions):
+        print(f"近似重复检测: {len(questions)} 个问题归并为 {len(pending)} 组")
+    
+    # 打包模式下多个简短问题合并在一轮对话中回答
+    pack_size = args.pack or (config.PACKING_CONFIG.get('max_items', 5)
+                              if config.PACKING_CONFIG.get('enabled', False) else 1)
+    if pack_size > 1:
+        packs = plan_packs(unique_questions, max_items=pack_size)
+        print(f"打包模式: {len(unique_questions)} 个问题合并为 {len(packs)} 轮对话")
+    else:
+        packs = [[index] for index in range(len(unique_questions))]
+    
     # 处理问题
     results = []
     
     try:
-        # 初始化AI助手
-        print(f"正在初始化AI助手 (类型: {args.type})...")
-        assistant = AIAssistant(username=username, password=password, assistant_type=args.type)
-        print("初始化成功！")
-        
-        # 处理每个问题
-        print("\n开始处理问题：")
-        for i, question in enumerate(tqdm(questions, desc="处理进度")):
-            try:
-                print(f"\n[{i+1}/{len(questions)}] 问题: {question[:100]}{'...' if len(question) > 100 else ''}")
-                
-                # 发送问题并获取回复
-                response = assistant.chat(question)
-                
-                # 记录结果
-                results.append({
-                    'question': question,
-                    'answer': response,
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'success': True
-                })
+        if args.workers > 1 or pool is not None:
+            print(f"使用 {args.workers} 个浏览器并行处理 (类型: {args.type})...")
+            results = run_workers(unique_questions, args.workers, username, password, args.type, packs,
+                                  lpt=args.lpt, pool=pool)
+        else:
+            # 初始化AI助手
+            print(f"正在初始化AI助手 (类型: {args.type})...")
+            assistant = AIAssistant(username=username, password=password, assistant_type=args.type)
+            print("初始化成功！")
+            
+            # 处理每个问题
+            print("\n开始处理问题：")
+            results = [None] * len(unique_questions)
+            for i, pack in enumerate(tqdm(packs, desc="处理进度")):
+                pack_questions = [unique_questions[index] for index in pack]
+                for index, question in zip(pack, pack_questions):
+                    print(f"\n[{index+1}/{len(unique_questions)}] 问题: {question[:100]}{'...' if len(question) > 100 else ''}")
                 
-                # 输出回答的前200个字符
-                answer_preview = response[:200] + ('...' if len(response) > 200 else '')
-                print(f"回答: {answer_preview}")
+                # 发送问题并获取回复（打包时组内问题不一定连续，按序号存放结果）
+                for index, result in zip(pack, answer_questions(assistant, pack_questions)):
+                    results[index] = result
+                    
+                    if result['success']:
+                        # 输出回答的前200个字符
+                        response = result['answer']
+                        answer_preview = response[:200] + ('...' if len(response) > 200 else '')
+                        print(f"回答: {answer_preview}")
                 
-                # 延迟一段时间，避免请求过快
-                if i < len(questions) - 1 and args.delay > 0:
+                # 延迟一段时间，避免请求过快（自适应模式下由控制器决定发送间隔）
+                if not args.adaptive and i < len(packs) - 1 and args.delay > 0:
                     time.sleep(args.delay)
-                
-            except Exception as e:
-                print(f"处理问题 '{question[:50]}...' 时出错: {str(e)}")
-                results.append({
-                    'question': question,
-                    'answer': f"错误: {str(e)}",
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'success': False
-                })
+            
+            # 关闭AI助手
+            assistant.close()
+        
+        # 代表问题的回答复制给同组的每一行
+        results = fan_out(questions, representatives, dict(zip(pending, results)))
         
         # 保存结果
         if results:
@@ -250,12 +519,18 @@ def main():
             
             save_results(results, output_path, args.format)
         
-        # 关闭AI助手
-        assistant.close()
-        
         # 输出统计信息
         success_count = sum(1 for r in results if r.get('success', False))
         print(f"\n处理完成: 共 {len(results)} 个问题，成功 {success_count} 个，失败 {len(results) - success_count} 个")
+        if len(pending) < len(questions):
+            print(f"近似重复问题复用回答 {len(questions) - len(pending)} 个，节省 {len(questions) - len(pending)} 次浏览器对话")
+        print(f"\n本次运行的延迟统计:\n{run_report()}")
+        
+        controller = get_controller()
+        if controller:
+            controller_metrics = controller.get_metrics()
+            print(f"自适应并发控制: 当前并发上限 {controller_metrics['limit']:.2f}，"
+                  f"发送间隔 {controller_metrics['interval']:.1f} 秒")
         
     except Exception as e:
         print(f"程序出错: {str(e)}")
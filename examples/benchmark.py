@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+北航AI助手基准测试
+run: 测量浏览器启动登录耗时、每轮对话延迟、每轮WebDriver命令数和对话历史写入耗时，按当前提交存入结果库
+compare: 比较两个提交的结果，存在统计显著的性能回退时以非零状态退出
+list: 列出最近的运行
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+from typing import Dict, List
+from dotenv import load_dotenv
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.message import Conversation
+from src.utils.benchmark import BenchmarkDB, current_commit, compare, format_comparison
+import config
+
+# 未指定问题文件时使用的简短问题
+DEFAULT_QUESTIONS = [
+    "北航的校训是什么？",
+    "请用一句话介绍北京航空航天大学。",
+    "北航有哪些校区？",
+]
+
+
+def bench_history(repeats: int, turns: int) -> Dict[str, List[float]]:
+    """
+    测量对话历史的写入和单个对话的读取耗时（在临时目录中进行，不影响真实历史）
+
+    Args:
+        repeats (int): 重复次数
+        turns (int): 每个对话的轮数
+
+    Returns:
+        dict: history.write 和 history.load 的样本(秒)
+    """
+    samples: Dict[str, List[float]] = {'history.write': [], 'history.load': []}
+    tmp_dir = tempfile.mkdtemp(prefix='buaa_bench_')
+    try:
+        history_file = os.path.join(tmp_dir, 'history.json')
+        # 已有一批其他对话，写入和查找时都需要处理
+        for index in range(20):
+            other = Conversation(conversation_id=f"other_{index}")
+            for turn in range(turns):
+                other.add_user_message(f"问题 {turn} " * 10)
+                other.add_assistant_message(f"回答 {turn} " * 100)
+            other.save(history_file)
+
+        conversation = Conversation(conversation_id='bench')
+        for repeat in range(repeats):
+            conversation.add_user_message(f"问题 {repeat} " * 10)
+            conversation.add_assistant_message(f"回答 {repeat} " * 100)
+            start = time.perf_counter()
+            conversation.save(history_file)
+            samples['history.write'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            Conversation.load('bench', history_file)
+            samples['history.load'].append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return samples
+
+
+def bench_live(username: str, password: str, assistant_type: str, questions: List[str]) -> Dict[str, List[float]]:
+    """
+    测量真实站点上的启动耗时、每轮对话延迟和WebDriver命令数
+
+    Args:
+        username (str): 用户名
+        password (str): 密码
+        assistant_type (str): 助手类型
+        questions (list): 依次发送的问题
+
+    Returns:
+        dict: startup.seconds、turn.latency、turn.webdriver_commands 的样本
+    """
+    from src.assistant import AIAssistant
+    from src.utils.driver_stats import instrument
+
+    # 每个问题都要真正发起对话
+    config.SIMILARITY_CONFIG['enabled'] = False
+
+    samples: Dict[str, List[float]] = {'startup.seconds': [], 'turn.latency': [], 'turn.webdriver_commands': []}
+    start = time.perf_counter()
+    assistant = AIAssistant(username=username, password=password, assistant_type=assistant_type)
+    samples['startup.seconds'].append(time.perf_counter() - start)
+    try:
+        for index, question in enumerate(questions):
+            # 恢复过程中浏览器可能被重建，每轮重新确认已启用统计
+            stats = instrument(assistant.driver)
+            before = stats.snapshot()['count'] if stats else 0
+            start = time.perf_counter()
+            # 在问题后附加序号，避免与之前的轮次合并或复用
+            assistant.chat(f"{question}（{index + 1}）")
+            samples['turn.latency'].append(time.perf_counter() - start)
+            stats = instrument(assistant.driver)
+            if stats is not None:
+                samples['turn.webdriver_commands'].append(stats.snapshot()['count'] - before)
+            print(f"第 {index + 1}/{len(questions)} 轮: {samples['turn.latency'][-1]:.2f} 秒")
+    finally:
+        assistant.close()
+    return samples
+
+
+def run(args) -> int:
+    """执行基准测试并保存结果"""
+    benchmark_config = config.BENCHMARK_CONFIG
+    commit = current_commit()
+    print(f"提交 {commit['commit'][:12]}{' (有未提交的修改)' if commit['dirty'] else ''}")
+
+    samples = bench_history(args.repeats or benchmark_config.get('history_repeats', 20),
+                            benchmark_config.get('history_turns', 20))
+    print(f"对话历史写入中位数: {sorted(samples['history.write'])[len(samples['history.write']) // 2] * 1000:.2f} 毫秒")
+
+    if not args.offline:
+        username = args.username or config.AUTH_CONFIG.get('username', '')
+        password = args.password or config.AUTH_CONFIG.get('password', '')
+        if not username or not password:
+            print("错误：缺少用户名或密码，无法测量真实对话；只测量离线指标请使用 --offline")
+            return 1
+        questions = DEFAULT_QUESTIONS
+        if args.questions:
+            with open(args.questions, 'r', encoding='utf-8') as f:
+                questions = [line.strip() for line in f if line.strip()]
+        turns = args.turns or benchmark_config.get('turns', 3)
+        questions = (questions * (turns // len(questions) + 1))[:turns]
+        samples.update(bench_live(username, password, args.type, questions))
+
+    db = BenchmarkDB(args.db)
+    try:
+        run_id = db.record_run(samples, commit, label=args.label)
+    finally:
+        db.close()
+    print(f"结果已保存为第 {run_id} 次运行")
+    return 0
+
+
+def compare_commits(args) -> int:
+    """比较两个提交，存在性能回退时返回1"""
+    db = BenchmarkDB(args.db)
+    try:
+        commits = db.latest_commits()
+        if args.candidate:
+            candidate = db.find_commit(args.candidate)
+        else:
+            head = current_commit()['commit']
+            candidate = head if head in commits else (commits[0] if commits else None)
+        if candidate is None:
+            print("错误：结果库中没有待比较提交的运行记录")
+            return 2
+
+        if args.baseline:
+            baseline = db.find_commit(args.baseline)
+        else:
+            # 默认与最近一次测试过的其他提交比较
+            baseline = next((commit for commit in commits if commit != candidate), None)
+        if baseline is None:
+            print("错误：结果库中没有基线提交的运行记录")
+            return 2
+
+        print(f"基线 {baseline[:12]} -> 当前 {candidate[:12]}")
+        results = compare(db.samples(baseline), db.samples(candidate), args.alpha, args.min_slowdown)
+    finally:
+        db.close()
+
+    print(format_comparison(results))
+    regressions = [item['metric'] for item in results if item['regression']]
+    if regressions:
+        print(f"\n性能回退: {', '.join(regressions)}")
+        return 1
+    print("\n未发现统计显著的性能回退")
+    return 0
+
+
+def list_runs(args) -> int:
+    """列出最近的运行"""
+    db = BenchmarkDB(args.db)
+    try:
+        runs = db.runs(args.limit)
+    finally:
+        db.close()
+    for item in runs:
+        started = datetime.fromtimestamp(item['started_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"#{item['id']}  {item['commit'][:12]}{'*' if item['dirty'] else ' '}  {started}  "
+              f"{item['samples']} 个样本  {item['label'] or ''}")
+    return 0
+
+
+def main():
+    """主函数"""
+    # 加载环境变量
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='北航AI助手基准测试')
+    parser.add_argument('--db', help='结果库路径，默认 data/benchmarks.sqlite')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='执行基准测试并按当前提交保存结果')
+    run_parser.add_argument('-u', '--username', help='北航统一认证用户名（学号）')
+    run_parser.add_argument('-p', '--password', help='北航统一认证密码')
+    run_parser.add_argument('-t', '--type', choices=['xiaohang', 'tongyi'],
+                            default=config.ASSISTANT_CONFIG['default_assistant'],
+                            help='AI助手类型：xiaohang(小航AI助手) 或 tongyi(北航通义千问)')
+    run_parser.add_argument('--offline', action='store_true', help='只测量不需要登录的指标（对话历史读写）')
+    run_parser.add_argument('--turns', type=int, help='真实对话的轮数')
+    run_parser.add_argument('--questions', help='问题文件（每行一个），默认使用内置的简短问题')
+    run_parser.add_argument('--repeats', type=int, help='对话历史读写的重复次数')
+    run_parser.add_argument('--label', help='本次运行的备注')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subparsers.add_parser('compare', help='比较两个提交，存在性能回退时以状态1退出')
+    compare_parser.add_argument('--baseline', help='基线提交（哈希、前缀或git引用），默认为最近测试过的其他提交')
+    compare_parser.add_argument('--candidate', help='待比较的提交，默认为当前提交（未测试时取最近一次运行）')
+    compare_parser.add_argument('--alpha', type=float, help='显著性水平，默认 0.05')
+    compare_parser.add_argument('--min-slowdown', type=float, help='判定为回退所需的最小中位数变慢比例，默认 0.05')
+    compare_parser.set_defaults(handler=compare_commits)
+
+    list_parser = subparsers.add_parser('list', help='列出最近的运行')
+    list_parser.add_argument('--limit', type=int, default=20, help='最多列出的数量')
+    list_parser.set_defaults(handler=list_runs)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
+
+if __name__ == "__main__":
+    main()
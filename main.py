@@ -10,6 +10,7 @@ import sys
 import argparse
 import logging
 import json
+import threading
 from datetime import datetime
 
 # 确保可以导入src模块
@@ -17,6 +18,13 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # 导入项目模块
 from src.assistant import AIAssistant
+from src.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from src.utils.dedup import cluster_near_duplicates, fan_out
+from src.utils.packing import plan_packs, answer_pack
+from src.models.history import get_history_store
+from src.models.legacy_history import migrate_to_jsonl
+from src.utils.histogram import load_histograms, format_report, run_report
+from src.utils.profiler import close_profiler
 from src.utils.logger import setup_logger, get_logger
 import config
 
@@ -49,10 +57,19 @@ def parse_arguments():
     mode_group.add_argument('-i', '--interactive', action='store_true', help='交互模式',default=True)
     mode_group.add_argument('-q', '--question', help='单次提问模式，直接提供问题')
     mode_group.add_argument('-f', '--file', help='批量处理模式，提供问题列表文件路径 (CSV或TXT)')
+    mode_group.add_argument('--serve', action='store_true', help='服务模式：提供OpenAI兼容的本地HTTP接口')
+    mode_group.add_argument('--compact-history', action='store_true', help='把各进程的对话历史分片合并到主历史文件后退出')
+    mode_group.add_argument('--migrate-history', metavar='DEST',
+                            help='把主历史文件逐个对话迁移为JSON Lines文件DEST后退出（内存占用与单个对话相当）')
+    mode_group.add_argument('--export-history', metavar='DEST',
+                            help='把对话历史按轮次导出为DEST（.parquet/.feather/.csv.gz）并打印统计后退出')
+    mode_group.add_argument('--latency-report', action='store_true',
+                            help='打印历次运行累积的延迟、首字延迟和回答长度的p50/p90/p99后退出')
     
     # 输出设置
     parser.add_argument('-o', '--output', help='输出文件路径')
-    parser.add_argument('--format', choices=['txt', 'csv', 'json'], default='txt', help='输出格式')
+    parser.add_argument('--format', choices=['txt', 'csv', 'json', 'parquet', 'feather'], default='txt',
+                        help='输出格式（parquet/feather需要pyarrow，未安装时写出压缩CSV）')
     
     # 浏览器设置
     parser.add_argument('--headless', action='store_true', help='无头模式（不显示浏览器窗口）')
@@ -70,6 +87,25 @@ def parse_arguments():
                          default=config.WEBDRIVER_CONFIG.get('wait_for_answer', 60),
                          help='等待AI回复的最长时间(秒)')
     
+    # 批量处理设置
+    parser.add_argument('--deadline', type=float, help='批量处理中每个问题的截止时间(秒)，包含所有重试')
+    parser.add_argument('--on-circuit-open', choices=['park', 'fail-fast'],
+                        help='站点持续故障触发熔断时的处理方式：park(暂停队列等待恢复) 或 fail-fast(剩余问题直接失败)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='近似重复的问题只发送一次，回答复制给所有重复的行')
+    parser.add_argument('--pack', type=int, metavar='K',
+                        help='打包模式：每轮对话最多合并K个简短问题一起回答')
+    
+    # 服务模式设置
+    parser.add_argument('--report-by', default='assistant,day,version',
+                        help='延迟报告的分组维度，assistant、day、version的逗号分隔组合')
+    parser.add_argument('--profile', nargs='?', const='', metavar='DIR',
+                        help='采样分析每轮对话的调用栈，输出到DIR（默认 data/profiler）下以启动时间命名的子目录')
+    parser.add_argument('--host', default=config.SERVER_CONFIG.get('host', '127.0.0.1'), help='服务监听地址')
+    parser.add_argument('--port', type=int, default=config.SERVER_CONFIG.get('port', 8000), help='服务监听端口')
+    parser.add_argument('--serve-workers', type=int, default=config.SERVER_CONFIG.get('assistants', 2),
+                        help='服务模式下预先登录的AI助手（浏览器）数量')
+    
     return parser.parse_args()
 
 def interactive_mode(assistant):
@@ -144,32 +180,126 @@ def batch_mode(assistant, file_path):
         # 处理问题
         print(f"共加载 {len(questions)} 个问题，开始处理...\n")
         
-        for i, question in enumerate(questions):
-            print(f"[{i+1}/{len(questions)}] 处理问题: {question[:50]}{'...' if len(question) > 50 else ''}")
+        # 近似重复的问题只发送代表问题
+        if config.DEDUP_CONFIG.get('enabled', False):
+            representatives = cluster_near_duplicates(questions)
+        else:
+            representatives = list(range(len(questions)))
+        pending = [i for i, rep in enumerate(representatives) if rep == i]
+        if len(pending) < len(questions):
+            print(f"近似重复检测: {len(questions)} 个问题归并为 {len(pending)} 组\n")
+        
+        breaker_config = config.CIRCUIT_BREAKER_CONFIG
+        turn_deadline = breaker_config.get('turn_deadline')
+        state = {'service_down': False}  # 暂停等待后站点仍未恢复，剩余问题快速失败
+        answered = {}
+        
+        def wait_if_circuit_open():
+            # 站点熔断时，按配置暂停队列等待恢复或直接失败
+            if not state['service_down'] and assistant.breaker.state != CircuitBreaker.CLOSED \
+                    and breaker_config.get('on_open', 'park') == 'park':
+                print("站点熔断中，暂停队列等待恢复...")
+                state['service_down'] = not assistant.wait_for_service()
+                if state['service_down']:
+                    print("站点长时间未恢复，剩余问题将直接标记失败")
+        
+        def make_result(question, response):
+            print(f"√ 已获取回答 ({len(response)} 字符)\n")
+            return {
+                'question': question,
+                'answer': response,
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+        
+        def ask_single(question):
+            wait_if_circuit_open()
             try:
-                response = assistant.chat(question)
-                results.append({
-                    'question': question,
-                    'answer': response,
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
-                print(f"√ 已获取回答 ({len(response)} 字符)\n")
+                if state['service_down']:
+                    raise CircuitOpenError("站点长时间未恢复")
+                response = assistant.chat(question, deadline=turn_deadline)
+                return make_result(question, response)
             except Exception as e:
                 print(f"× 处理失败: {str(e)}\n")
-                results.append({
+                return {
                     'question': question,
                     'answer': f"错误: {str(e)}",
                     'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                     'error': True
-                })
+                }
+        
+        # 打包模式下多个简短问题合并在一轮对话中回答
+        if config.PACKING_CONFIG.get('enabled', False):
+            packs = [[pending[j] for j in pack] for pack in plan_packs([questions[i] for i in pending])]
+            if len(packs) < len(pending):
+                print(f"打包模式: {len(pending)} 个问题合并为 {len(packs)} 轮对话\n")
+        else:
+            packs = [[i] for i in pending]
         
+        done = 0
+        for pack in packs:
+            pack_questions = [questions[i] for i in pack]
+            for n, question in enumerate(pack_questions, done + 1):
+                print(f"[{n}/{len(pending)}] 处理问题: {question[:50]}{'...' if len(question) > 50 else ''}")
+            
+            wait_if_circuit_open()
+            pack_results = answer_pack(assistant, pack_questions, ask_single, make_result, deadline=turn_deadline)
+            answered.update(zip(pack, pack_results))
+            done += len(pack)
+        
+        results = fan_out(questions, representatives, answered)
         print(f"批量处理完成，共处理 {len(questions)} 个问题，成功 {sum(1 for r in results if 'error' not in r)} 个")
+        if len(pending) < len(questions):
+            print(f"近似重复问题复用回答 {len(questions) - len(pending)} 个，节省 {len(questions) - len(pending)} 次浏览器对话")
+        print(f"\n本次运行的延迟统计:\n{run_report()}")
         return results
     
     except Exception as e:
         print(f"批量处理出错: {str(e)}")
         return results
 
+def serve_mode(username, password, assistant_type, workers, host, port):
+    """
+    服务模式：预先登录一组AI助手，提供OpenAI兼容的本地HTTP接口
+    
+    Args:
+        username (str): 用户名
+        password (str): 密码
+        assistant_type (str): AI助手类型
+        workers (int): AI助手（浏览器）数量
+        host (str): 监听地址
+        port (int): 监听端口
+    """
+    from src.server import ChatCompletionServer
+    logger = get_logger()
+    
+    # 并行登录，每个AI助手使用独立的浏览器，同一时间只处理一轮对话
+    assistants = [None] * workers
+    
+    def start(index):
+        try:
+            assistants[index] = AIAssistant(username=username, password=password, assistant_type=assistant_type)
+        except Exception as e:
+            logger.error(f"第 {index + 1} 个AI助手初始化失败: {str(e)}")
+    
+    print(f"正在初始化 {workers} 个AI助手 (类型: {assistant_type})...")
+    threads = [threading.Thread(target=start, args=(index,)) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assistants = [assistant for assistant in assistants if assistant is not None]
+    if not assistants:
+        print("错误: 没有可用的AI助手，无法启动服务")
+        sys.exit(1)
+    print(f"{len(assistants)} 个AI助手初始化成功")
+    
+    try:
+        ChatCompletionServer(assistants, host=host, port=port, model=assistant_type).serve_forever()
+    finally:
+        keep_browser_open = config.WEBDRIVER_CONFIG.get('keep_browser_open', False)
+        for assistant in assistants:
+            assistant.close(keep_browser_open=keep_browser_open)
+
 def save_results(results, output_path, format_type):
     """保存结果到文件"""
     if not results:
@@ -196,9 +326,18 @@ def save_results(results, output_path, format_type):
             import csv
             with open(output_path, 'w', encoding='utf-8', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(['问题', '回答', '时间'])
+                # 有近似重复问题复用回答时，增加一列标明复用的是第几个问题的回答
+                has_duplicates = any('duplicate_of' in item for item in results)
+                writer.writerow(['问题', '回答', '时间'] + (['复用自'] if has_duplicates else []))
                 for item in results:
-                    writer.writerow([item['question'], item['answer'], item['timestamp']])
+                    row = [item['question'], item['answer'], item['timestamp']]
+                    if has_duplicates:
+                        row.append(item.get('duplicate_of', ''))
+                    writer.writerow(row)
+        
+        elif format_type in ('parquet', 'feather'):
+            from src.utils.analytics import results_frame, export_frame
+            output_path = export_frame(results_frame(results), output_path, format_type)
         
         else:  # txt
             with open(output_path, 'w', encoding='utf-8') as f:
@@ -206,6 +345,8 @@ def save_results(results, output_path, format_type):
                     f.write(f"问题: {item['question']}\n")
                     f.write(f"回答: {item['answer']}\n")
                     f.write(f"时间: {item['timestamp']}\n")
+                    if 'duplicate_of' in item:
+                        f.write(f"复用自: 第 {item['duplicate_of']} 个问题的回答\n")
                     f.write("-" * 50 + "\n\n")
         
         print(f"结果已保存到 {output_path}")
@@ -215,6 +356,26 @@ def save_results(results, output_path, format_type):
         print(f"保存结果出错: {str(e)}")
         return False
 
+def export_history(output_path):
+    """导出对话历史并打印统计"""
+    try:
+        from src.utils.analytics import turns_frame, export_frame, summarize
+        
+        turns = turns_frame()
+        output_path = export_frame(turns, output_path)
+    except ImportError as e:
+        print(f"错误: 导出对话历史需要安装pandas ({str(e)})")
+        sys.exit(1)
+    except Exception as e:
+        get_logger().error(f"导出对话历史失败: {str(e)}", exc_info=True)
+        print(f"导出对话历史失败: {str(e)}")
+        sys.exit(1)
+    print(f"已导出 {len(turns)} 轮对话到 {output_path}")
+    titles = {'answer_length': '回答长度分布', 'hourly_latency': '每小时延迟(秒)', 'error_rate': '各助手错误率'}
+    for name, table in summarize(turns).items():
+        print(f"\n{titles[name]}:")
+        print(table.to_string() if not table.empty else "无数据")
+
 def main():
     """主函数"""
     # 创建必要的目录
@@ -223,31 +384,18 @@ def main():
     # 解析命令行参数
     args = parse_arguments()
     
-<<<<<<< HEAD
     # 设置日志终端输出开关
     if args.no_console_log:
         config.LOG_CONFIG['console_output'] = False
         print("日志将不会在终端显示，但仍会记录到日志文件中")
     
-    # 设置日志
-    log_level = logging.DEBUG if args.debug else logging.INFO
-    logger = setup_logger(log_level)
-=======
-    # 设置调试模式
-    if args.debug:
-        config.LOGGING_CONFIG['level'] = 'DEBUG'
-    
     # 设置控制台日志输出
     if args.console_log:
         config.LOGGING_CONFIG['console_output_enabled'] = True
-        
-    # 初始化日志
-    setup_logger()
-    logger = get_logger()
     
-    # 设置浏览器类型
-    if args.browser_type:
-        config.WEBDRIVER_CONFIG['browser'] = args.browser_type
+    # 设置日志
+    log_level = logging.DEBUG if args.debug else logging.INFO
+    logger = setup_logger(log_level)
     
     # 设置浏览器无头模式
     if args.headless:
@@ -267,7 +415,45 @@ def main():
         logger.warning("API模式已被禁用，将使用浏览器模拟模式")
     if args.browser:
         config.WEBDRIVER_CONFIG['use_browser_first'] = True
->>>>>>> 15b5a8fb69555306eec8862a5848b2fdd7db4c66
+    
+    # 设置熔断和截止时间
+    if args.deadline:
+        config.CIRCUIT_BREAKER_CONFIG['turn_deadline'] = args.deadline
+    if args.on_circuit_open:
+        config.CIRCUIT_BREAKER_CONFIG['on_open'] = args.on_circuit_open.replace('-', '_')
+    if args.dedup:
+        config.DEDUP_CONFIG['enabled'] = True
+    if args.pack and args.pack > 1:
+        config.PACKING_CONFIG['enabled'] = True
+        config.PACKING_CONFIG['max_items'] = args.pack
+    if args.profile is not None:
+        config.PROFILER_CONFIG['enabled'] = True
+        if args.profile:
+            config.PROFILER_CONFIG['output_dir'] = args.profile
+    
+    # 合并对话历史分片，不需要登录
+    if args.compact_history:
+        store = get_history_store()
+        if store is None:
+            print("未启用对话历史分片，无需合并")
+        else:
+            print(f"已合并 {store.compact()} 个对话历史分片到 {store.base_file}")
+        return
+    if args.migrate_history:
+        source = config.MESSAGE_CONFIG.get('history_file')
+        print(f"已迁移 {migrate_to_jsonl(source, args.migrate_history)} 个对话到 {args.migrate_history}")
+        return
+    if args.export_history:
+        export_history(args.export_history)
+        return
+    if args.latency_report:
+        group_by = [name.strip() for name in args.report_by.split(',') if name.strip()]
+        unknown = set(group_by) - {'assistant', 'day', 'version'}
+        if unknown:
+            print(f"错误: 未知的分组维度 {', '.join(sorted(unknown))}，可选 assistant、day、version")
+            sys.exit(1)
+        print(format_report(load_histograms(), group_by=group_by))
+        return
     
     # 如果禁用了控制台日志，但启用了调试模式，提醒用户
     if args.no_console_log and args.debug:
@@ -285,6 +471,12 @@ def main():
     # 配置使用浏览器模拟模式
     config.WEBDRIVER_CONFIG['use_browser_first'] = True
     
+    # 服务模式下每个AI助手使用自己的浏览器，不创建全局共享实例
+    if args.serve:
+        serve_mode(username, password, args.type, max(1, args.serve_workers), args.host, args.port)
+        print("程序已完成")
+        return
+    
     # 提示用户当前使用的模式
     print("使用浏览器模拟模式 - 会话将持续保持直到程序结束")
     print("提示: 系统将自动维护浏览器会话，避免重复登录")
@@ -389,10 +581,8 @@ def main():
         
         results = []
         
-        # 根据模式处理
-        if args.interactive:
-            results = interactive_mode(assistant)
-        elif args.question:
+        # 根据模式处理（-i默认开启，因此先判断单次提问和批量模式）
+        if args.question:
             print(f"问题: {args.question}")
             print("正在获取回答...\n")
             response = assistant.chat(args.question)
@@ -404,6 +594,8 @@ def main():
             }]
         elif args.file:
             results = batch_mode(assistant, args.file)
+        else:
+            results = interactive_mode(assistant)
         
         # 保存结果
         if results and (args.output or args.file):
@@ -420,6 +612,10 @@ def main():
             logger.info("关闭助手实例，浏览器实例保持" + ("开启" if keep_browser_open else "关闭") + "状态")
             assistant.close(keep_browser_open=keep_browser_open)
         
+        profile_summary = close_profiler()
+        if profile_summary:
+            print(f"\n本次运行的采样分析:\n{profile_summary}")
+        
         # 如果keep_browser_open为False且全局浏览器实例仍然存在，则关闭它
         # 这是一个安全措施，确保在助手关闭失败的情况下也能关闭浏览器
         if not config.WEBDRIVER_CONFIG.get('keep_browser_open', False) and 'shared_driver' in locals() and shared_driver:
@@ -6,13 +6,16 @@ AI助手交互模块
 处理与北航AI助手的交互
 """
 
+import os
 import time
 import json
 import re
 import logging
-from typing import Dict, List, Optional, Any, Union, Tuple
+from typing import Callable, Dict, List, Optional, Any, Union, Tuple
 import uuid
-from urllib.parse import urljoin
+import hashlib
+import threading
+from urllib.parse import urljoin, urlparse
 
 import requests
 from selenium import webdriver
@@ -21,26 +24,53 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 from bs4 import BeautifulSoup
-from retry import retry
 from selenium.webdriver.common.keys import Keys
 
 from src.auth import BUAAAuth, AuthError
 from src.utils.logger import get_logger
 from src.utils.http import HTTPClient
+from src.utils.wait import wait_until, document_ready, md_editor_present, mark_document
+from src.utils.recovery import RecoveryEngine, FailureKind, classify_webdriver_error, iter_causes
+from src.utils.deadline import Deadline, DeadlineExceeded
+from src.utils.circuit_breaker import get_breaker, CircuitOpenError, CircuitBreaker
+from src.utils.concurrency import get_controller
+from src.utils.singleflight import SingleFlight, normalize_question
+from src.utils.similarity import get_answer_index
+from src.utils.packing import is_packed_prompt
+from src.utils.keepalive import SessionKeepalive
+from src.utils.tabs import get_tabs, forget_tabs
+from src.utils.incremental_text import IncrementalTextReader
+from src.utils.markdown import extract_markdown, html_to_markdown
+from src.utils.persistence import save_conversation, flush_history
+from src.utils.histogram import record_turn, flush_histograms
+from src.utils.profiler import get_profiler, profile_turn
+from src.utils.driver_stats import instrument
 from src.models.message import Message, Conversation
 import config
 
 # 获取日志记录器
 logger = get_logger()
 
+# 进程内所有助手实例共享，同一类型助手的相同问题同时只进行一轮浏览器对话
+_chat_flight = SingleFlight('chat.singleflight')
+
 class AssistantError(Exception):
     """AI助手错误"""
     pass
 
+class LoginRequiredError(AssistantError):
+    """会话失效，需要重新登录"""
+    pass
+
+class GenerationTimeoutError(AssistantError):
+    """等待AI助手回复超时"""
+    pass
+
 class AIAssistant:
     """北航AI助手交互类"""
     
-    def __init__(self, username: str = None, password: str = None, assistant_type: str = None, shared_driver=None):
+    def __init__(self, username: str = None, password: str = None, assistant_type: str = None, shared_driver=None,
+                 profile_dir: str = None, interactive_captcha: bool = True):
         """
         初始化AI助手
         
@@ -49,9 +79,12 @@ class AIAssistant:
             password: 北航统一认证密码
             assistant_type: AI助手类型，'xiaohang' 或 'tongyi'
             shared_driver: 共享的WebDriver实例
+            profile_dir: 浏览器配置目录，多账号时每个账号使用独立目录以隔离cookies和本地存储
+            interactive_captcha: 登录需要验证码时是否等待人工输入，为False时抛出CaptchaRequiredError
         """
         self.username = username or config.AUTH_CONFIG.get('username')
         self.password = password or config.AUTH_CONFIG.get('password')
+        self.profile_dir = profile_dir
         self.assistant_type = assistant_type or config.ASSISTANT_CONFIG.get('default_assistant', 'xiaohang')
         self.shared_driver = shared_driver
         self.driver = None
@@ -83,11 +116,13 @@ class AIAssistant:
 
         
         # 认证
-        self.auth = BUAAAuth(username, password, shared_driver=shared_driver)
+        self.auth = BUAAAuth(self.username, self.password, shared_driver=shared_driver,
+                             interactive_captcha=interactive_captcha)
         self.http_client = HTTPClient(base_url=self.base_url, headers=config.ASSISTANT_CONFIG.get('headers', {}))
         
         # 会话状态
         self.conversation = Conversation()
+        self.conversation.metadata['assistant_type'] = self.assistant_type
         self.conversation_id = None
         self.driver = shared_driver  # 使用共享的浏览器实例
         if shared_driver:
@@ -99,6 +134,23 @@ class AIAssistant:
         self.browser_logged_in = False  # 记录浏览器是否已登录
         self.last_md_editor_id = None  # 用于跟踪最后一次对话的md-editor ID
         self.has_captured_initial_message = False  # 是否已捕获初始消息
+        self.browser_cookies_injected = False  # 是否已将requests登录的cookies注入浏览器
+        self._turn_state = {'sent': False, 'deadline': Deadline()}  # 当前对话轮次的状态，用于恢复时判断是否需要重新发送
+        self._implicit_wait_reduced = False  # 是否因截止时间临近缩短了隐式等待
+        self.keepalive = None  # 后台会话保活线程
+        self._session_refreshed = threading.Event()  # 保活线程重新登录后置位，下一轮对话前同步cookies到浏览器
+        
+        # 同一站点、同一账号的助手实例共享熔断器，某个账号被限流或锁定不会拒绝其他账号的对话
+        self.breaker = get_breaker(f"{urlparse(self.base_url).netloc}:{self.username}")
+        
+        # 按故障类别恢复的引擎，替代整轮重试
+        self.recovery = RecoveryEngine(self._classify_failure, {
+            FailureKind.STALE_ELEMENT: self._recover_stale_element,
+            FailureKind.LOGIN_REQUIRED: self._recover_login,
+            FailureKind.DRIVER_DEAD: self._recover_driver,
+            FailureKind.GENERATION_TIMEOUT: self._recover_resend,
+            FailureKind.UNKNOWN: self._recover_resend,
+        })
         
         # 初始化
         self._initialize()
@@ -119,6 +171,11 @@ class AIAssistant:
         # 初始化会话
         self._initialize_conversation()
         
+        # 后台保持统一认证会话活跃，避免在对话过程中才发现会话过期
+        if config.AUTH_CONFIG.get('keepalive', True) and self.keepalive is None:
+            self.keepalive = SessionKeepalive(self.auth, self.assistant_url,
+                                              on_refresh=self._session_refreshed.set).start()
+        
         # 如果配置为优先使用浏览器，则初始化浏览器
         if use_browser_first:
             try:
@@ -143,39 +200,10 @@ class AIAssistant:
         Returns:
             bool: 是否成功初始化
         """
-        # 如果已有共享的浏览器实例，直接使用
+        # 如果已有共享的浏览器实例，直接使用；每种助手在共享浏览器中使用自己的标签页
         if self.driver:
-            logger.info(f"使用已存在的共享浏览器实例，ID: {id(self.driver)}")
-            
-            # 如果使用共享的浏览器，需要检查页面状态
-            try:
-                current_url = self.driver.current_url
-                logger.info(f"共享浏览器当前URL: {current_url}")
-                
-                # 如果当前不在助手页面，跳转到助手页面
-                if self.assistant_url not in current_url and 'sso.buaa.edu.cn' not in current_url:
-                    logger.info(f"浏览器当前不在助手页面，跳转到: {self.assistant_url}")
-                    self.driver.get(self.assistant_url)
-                    
-                # 判断是否需要登录
-                if 'sso.buaa.edu.cn' in self.driver.current_url:
-                    logger.info("检测到需要登录")
-                    self._browser_login()
-                else:
-                    logger.info("浏览器会话已处于登录状态")
-                    self.browser_logged_in = True
-                    
-                # 尝试捕获初始消息
-                self._capture_initial_message()
-                
-                # 暂时禁用模型选择功能
-                # self._handle_model_selection()
-                logger.info("模型选择功能已暂时禁用")
-                
-            except Exception as e:
-                logger.warning(f"检查共享浏览器状态时出错: {str(e)}")
-            
-            return True
+            with get_tabs(self.driver).use(self.assistant_type):
+                return self._attach_shared_browser()
         
         # 只有在没有共享实例时才创建新实例
         logger.warning("没有共享浏览器实例，创建新的浏览器实例可能导致会话问题！")
@@ -199,6 +227,9 @@ class AIAssistant:
                 options.add_argument('--disable-gpu')
                 options.add_experimental_option('excludeSwitches', ['enable-logging'])
                 options.add_argument('--log-level=3')  # 禁用日志输出
+                if self.profile_dir:
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    options.add_argument(f'--user-data-dir={os.path.abspath(self.profile_dir)}')
                 service = Service(ChromeDriverManager().install())
                 
                 # 记录日志，标明正在创建新实例
@@ -214,6 +245,10 @@ class AIAssistant:
                 options = Options()
                 if headless:
                     options.add_argument('--headless')
+                if self.profile_dir:
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    options.add_argument('-profile')
+                    options.add_argument(os.path.abspath(self.profile_dir))
                 
                 service = Service(GeckoDriverManager().install())
                 logger.warning("创建新的Firefox浏览器实例（注意：应该使用全局共享实例）")
@@ -228,6 +263,9 @@ class AIAssistant:
                 options = Options()
                 if headless:
                     options.add_argument('--headless')
+                if self.profile_dir:
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    options.add_argument(f'--user-data-dir={os.path.abspath(self.profile_dir)}')
                 
                 service = Service(EdgeChromiumDriverManager().install())
                 logger.warning("创建新的Edge浏览器实例（注意：应该使用全局共享实例）")
@@ -243,6 +281,9 @@ class AIAssistant:
             self.driver.implicitly_wait(config.WEBDRIVER_CONFIG.get('implicit_wait', 10))
             self.driver.set_page_load_timeout(config.WEBDRIVER_CONFIG.get('page_load_timeout', 30))
             
+            # 首次访问前注入requests登录得到的cookies，避免再走浏览器登录表单
+            self._inject_auth_cookies()
+            
             # 访问目标页面
             logger.info(f"访问AI助手页面: {self.assistant_url}")
             self.driver.get(self.assistant_url)
@@ -274,6 +315,97 @@ class AIAssistant:
                 self.owns_driver = False
             return False
     
+    def _attach_shared_browser(self) -> bool:
+        """
+        在共享浏览器中当前助手的标签页内打开助手页面并确认登录状态（调用方需已切换到该标签页）
+        
+        Returns:
+            bool: 是否成功
+        """
+        logger.info(f"使用已存在的共享浏览器实例，ID: {id(self.driver)}")
+        
+        # 如果使用共享的浏览器，需要检查页面状态
+        try:
+            current_url = self.driver.current_url
+            logger.info(f"共享浏览器当前URL: {current_url}")
+            
+            # 如果当前不在助手页面，跳转到助手页面
+            if self.assistant_url not in current_url and 'sso.buaa.edu.cn' not in current_url:
+                # 首次访问前注入requests登录得到的cookies，避免再走浏览器登录表单
+                self._inject_auth_cookies()
+                logger.info(f"浏览器当前不在助手页面，跳转到: {self.assistant_url}")
+                self.driver.get(self.assistant_url)
+                
+            # 判断是否需要登录
+            if 'sso.buaa.edu.cn' in self.driver.current_url:
+                logger.info("检测到需要登录")
+                self._browser_login()
+            else:
+                logger.info("浏览器会话已处于登录状态")
+                self.browser_logged_in = True
+                
+            # 尝试捕获初始消息
+            self._capture_initial_message()
+            
+            # 暂时禁用模型选择功能
+            # self._handle_model_selection()
+            logger.info("模型选择功能已暂时禁用")
+            
+        except Exception as e:
+            logger.warning(f"检查共享浏览器状态时出错: {str(e)}")
+        
+        return True
+    
+    def _inject_auth_cookies(self, force: bool = False) -> bool:
+        """
+        将requests登录得到的cookies注入浏览器
+        
+        Args:
+            force (bool): 是否忽略已注入标记重新注入
+            
+        Returns:
+            bool: 是否注入了cookies
+        """
+        if not self.driver or not self.auth.is_authenticated:
+            return False
+        if self.browser_cookies_injected and not force:
+            return False
+        
+        try:
+            injected = self.auth.inject_cookies_into_driver(self.driver, self.assistant_url)
+        except Exception as e:
+            logger.warning(f"注入认证cookies失败: {str(e)}")
+            return False
+        
+        self.browser_cookies_injected = injected > 0
+        return self.browser_cookies_injected
+    
+    def _fast_browser_login(self) -> Optional[bool]:
+        """
+        快速登录：通过requests完成CAS认证后把cookies注入浏览器
+        
+        Returns:
+            Optional[bool]: True表示登录成功；False表示登录失败且浏览器表单也无法解决；
+                            None表示需要回退到浏览器表单登录（检测到验证码或cookies未被接受）
+        """
+        if not self.auth.login_with_requests():
+            if self.auth.captcha_required:
+                logger.info("快速登录检测到验证码，回退到浏览器表单登录")
+                return None
+            return False
+        
+        if not self._inject_auth_cookies(force=True):
+            return None
+        
+        self.driver.get(self.assistant_url)
+        if self.auth.is_sso_url(self.driver.current_url):
+            logger.info("注入cookies后仍被重定向到登录页面，回退到浏览器表单登录")
+            return None
+        
+        self.browser_logged_in = True
+        logger.info("快速登录成功，已跳过浏览器登录表单")
+        return True
+    
     def _browser_login(self) -> bool:
         """
         使用浏览器登录统一身份认证
@@ -288,6 +420,16 @@ class AIAssistant:
             logger.error("浏览器实例不存在，无法执行登录")
             return False
         
+        # 优先使用快速登录，只有在需要验证码等情况下才填写浏览器表单
+        if config.AUTH_CONFIG.get('fast_login', True):
+            try:
+                fast_result = self._fast_browser_login()
+            except Exception as e:
+                logger.warning(f"快速登录出错: {str(e)}，回退到浏览器表单登录")
+                fast_result = None
+            if fast_result is not None:
+                return fast_result
+        
         try:
             # 确保在登录页面
             current_url = self.driver.current_url
@@ -296,12 +438,9 @@ class AIAssistant:
                 self.driver.get(self.auth.login_url)
             
             # 等待重定向到登录页面
-            try:
-                WebDriverWait(self.driver, 10).until(
-                    lambda d: 'sso.buaa.edu.cn' in d.current_url
-                )
-            except Exception as e:
-                logger.warning(f"等待重定向到登录页面超时: {str(e)}")
+            if not self.auth.is_sso_url(self.driver.current_url):
+                wait_until(self.driver, lambda d: self.auth.is_sso_url(d.current_url), 10,
+                           name='sso_login_page', raise_on_timeout=False)
             
             # 等待登录表单加载
             username_input = WebDriverWait(self.driver, 10).until(
@@ -321,22 +460,12 @@ class AIAssistant:
             login_button = WebDriverWait(self.driver, 10).until(
                 EC.element_to_be_clickable((By.NAME, "submit"))
             )
+            mark_document(self.driver)
             login_button.click()
             
-            # 等待登录完成并重定向到目标页面
-            # 定义一个函数，检查是否已重定向到目标页面
-            def check_redirect():
-                current_url = self.driver.current_url
-                if 'sso.buaa.edu.cn' not in current_url:
-                    logger.info(f"登录成功，已重定向到: {current_url}")
-                    return True
-                return False
-            
-            # 等待重定向，最长等待20秒
-            try:
-                WebDriverWait(self.driver, 20).until(lambda d: check_redirect())
-            except Exception as e:
-                logger.warning(f"等待重定向超时: {str(e)}")
+            # 等待登录完成并重定向到目标页面（通过导航事件判断）
+            if not self.auth.wait_for_login_redirect(self.driver):
+                logger.warning("等待重定向超时")
                 # 检查是否仍在登录页面，可能是密码错误
                 if 'sso.buaa.edu.cn' in self.driver.current_url:
                     error_messages = self.driver.find_elements(By.CLASS_NAME, "auth_error")
@@ -354,17 +483,13 @@ class AIAssistant:
                 logger.info("浏览器登录成功")
                 
                 # 登录成功后等待页面完全加载
-                WebDriverWait(self.driver, 20).until(
-                    lambda d: d.execute_script("return document.readyState") == "complete"
-                )
+                wait_until(self.driver, document_ready(), 20, name='page_ready')
                 
                 # 如果没有重定向到目标助手页面，手动导航
                 if self.assistant_url not in self.driver.current_url:
                     logger.info(f"重定向到其他页面，手动导航到助手页面: {self.assistant_url}")
                     self.driver.get(self.assistant_url)
-                    WebDriverWait(self.driver, 20).until(
-                        lambda d: d.execute_script("return document.readyState") == "complete"
-                    )
+                    wait_until(self.driver, document_ready(), 20, name='page_ready')
                 
                 return True
             else:
@@ -397,6 +522,7 @@ class AIAssistant:
                 conversation_id=self.conversation_id,
                 title=f"对话 {time.strftime('%Y-%m-%d %H:%M:%S')}"
             )
+            self.conversation.metadata['assistant_type'] = self.assistant_type
             
         except Exception as e:
             logger.error(f"初始化会话失败: {str(e)}")
@@ -434,19 +560,17 @@ class AIAssistant:
         
         try:
             # 等待页面完全加载
-            WebDriverWait(self.driver, 10).until(
-                lambda d: d.execute_script("return document.readyState") == "complete"
+            wait_until(self.driver, document_ready(), 10, name='page_ready')
+            
+            # 等待欢迎消息节点出现，出现即返回，不再固定等待
+            md_editor_elements = wait_until(
+                self.driver,
+                md_editor_present(),
+                config.WEBDRIVER_CONFIG.get('welcome_message_timeout', 5),
+                name='welcome_message',
+                raise_on_timeout=False
             )
             
-            # 等待一段时间，确保初始消息有机会显示出来
-            time.sleep(2)
-            
-            # 尝试查找所有md-editor元素
-            md_editor_elements = self.driver.execute_script("""
-                return Array.from(document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]'))
-                    .filter(el => el.offsetParent !== null && el.textContent.trim().length > 0);
-            """)
-            
             if md_editor_elements and len(md_editor_elements) > 0:
                 # 找到包含最多文本的元素（可能是欢迎消息）
                 max_text_length = 0
@@ -488,20 +612,227 @@ class AIAssistant:
         # 即使没有找到初始消息，也标记为已尝试捕获，避免重复检查
         self.has_captured_initial_message = True
     
-    @retry(tries=3, delay=2, backoff=2, logger=logger)
-    def chat(self, message: str) -> str:
+    @property
+    def next_dialog_end_marker(self) -> str:
+        """下一轮对话的结束标记，提示中要求AI输出该标记时，检测到即可提前结束等待"""
+        return f"[DIALOG_{self.dialog_count + 1}_END]"
+    
+    def chat(self, message: str, deadline: Union[Deadline, float, None] = None,
+             on_progress: Optional[Callable[[str], None]] = None) -> str:
         """
         发送消息并获取回复
         
+        失败时按故障类别恢复：元素失效只重新探测，被重定向到登录页则重新登录，
+        浏览器失效则重建浏览器，等待回复超时则重新发送。用户消息在每轮对话中只记录一次。
+        同一类型助手的相同问题（规范化后）正在处理时，直接等待并复用其回复；
+        启用相似问题复用时，历史中足够相似的问题直接返回其回答，不再发起对话。
+        
+        Args:
+            message (str): 消息内容
+            deadline (Deadline or float, optional): 截止时间或从现在起的秒数，
+                对输入框探测、点击发送、等待回复以及恢复重试等所有阶段生效
+            on_progress (callable, optional): 回复生成过程中以当前已生成的文本调用，用于流式输出；
+                复用或合并的回复不会触发
+            
+        Returns:
+            str: AI助手的回复
+            
+        Raises:
+            CircuitOpenError: 站点熔断中，请求被快速拒绝
+            AssistantError: 对话失败
+        """
+        deadline = Deadline.coerce(deadline)
+        reused = self._reuse_similar_answer(message)
+        if reused is not None:
+            return reused
+        
+        if not config.ASSISTANT_CONFIG.get('coalesce_requests', True):
+            return self._guarded_chat(message, deadline, on_progress)
+        
+        response, coalesced = _chat_flight.do(
+            self._coalesce_key(message),
+            lambda: self._guarded_chat(message, deadline, on_progress),
+            timeout=None if deadline.unlimited else deadline.remaining()
+        )
+        if coalesced:
+            # 复用其他调用方的回复，同样记入本实例的会话历史
+            self.conversation.add_user_message(message, metadata={'coalesced': True})
+            self.conversation.add_assistant_message(response, metadata={'coalesced': True})
+            save_conversation(self.conversation)
+        return response
+    
+    def _coalesce_key(self, message: str) -> str:
+        """
+        生成合并相同问题的键：助手类型、之前的对话内容和规范化后的问题都相同才合并，
+        多轮对话中的追问（如"再详细说说"）不会与其他会话合并
+        
         Args:
             message (str): 消息内容
             
+        Returns:
+            str: 合并键
+        """
+        context = hashlib.sha1()
+        for previous in self.conversation.messages:
+            context.update(f"{previous.role}\0{previous.content}\0".encode('utf-8'))
+        return f"{self.assistant_type}:{context.hexdigest()[:16]}:{normalize_question(message)}"
+    
+    def _reuse_similar_answer(self, message: str) -> Optional[str]:
+        """
+        在历史问答中查找足够相似的问题并复用其回答
+        
+        Args:
+            message (str): 消息内容
+            
+        Returns:
+            str or None: 复用的回答，未启用或没有足够相似的问题时返回None
+        """
+        if is_packed_prompt(message):
+            return None
+        index = get_answer_index(self.assistant_type)
+        if index is None:
+            return None
+        
+        match = index.lookup(message)
+        if match is None:
+            return None
+        
+        source_question, answer, score = match
+        logger.info(f"复用相似问题的回答 (相似度 {score:.3f}): {source_question[:50]}")
+        self.conversation.add_user_message(message)
+        self.conversation.add_assistant_message(answer, metadata={
+            'reused': True,
+            'similarity': round(score, 4),
+            'source_question': source_question,
+        })
+        save_conversation(self.conversation)
+        return answer
+    
+    def _guarded_chat(self, message: str, deadline: Deadline,
+                      on_progress: Optional[Callable[[str], None]] = None) -> str:
+        """
+        在熔断器和自适应并发控制的保护下执行一轮对话
+        
+        Args:
+            message (str): 消息内容
+            deadline (Deadline): 截止时间
+            on_progress (callable, optional): 回复生成进度回调
+            
+        Returns:
+            str: AI助手的回复
+        """
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(
+                f"站点熔断中，{self.breaker.time_until_half_open():.0f} 秒后探测恢复"
+            )
+        
+        controller = get_controller()
+        recorded = False
+        try:
+            # 启用采样分析时，等待并发名额的时间也计入本轮
+            with profile_turn(self.assistant_type, self.driver):
+                if controller is None:
+                    response = self._chat_turn(message, deadline, on_progress)
+                else:
+                    # 多个工作线程/进程共同遵守自适应并发上限和发送间隔
+                    slot_timeout = None if deadline.unlimited else deadline.remaining()
+                    with controller.slot(slot_timeout) as outcome:
+                        response = self._chat_turn(message, deadline, on_progress)
+                        outcome['empty'] = not response.strip()
+        except Exception as e:
+            # 只有说明站点不健康的失败计入熔断，调用方截止时间过短、登录失败等不计入
+            if self._is_site_failure(e):
+                self.breaker.record_failure()
+                recorded = True
+            raise
+        else:
+            if response.strip():
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            recorded = True
+        finally:
+            # 未计入成功或失败（含KeyboardInterrupt等）时释放半开状态的探测名额
+            if not recorded:
+                self.breaker.release()
+        return response
+    
+    def _is_site_failure(self, error: BaseException) -> bool:
+        """
+        判断对话失败是否说明站点不健康（回复超时或为空、页面加载超时、服务端5xx），只有这些失败计入熔断
+        
+        Args:
+            error (BaseException): 对话过程中的异常
+            
+        Returns:
+            bool: 是否计入熔断
+        """
+        causes = list(iter_causes(error))
+        if any(isinstance(cause, (DeadlineExceeded, CircuitOpenError)) for cause in causes):
+            return False
+        for cause in causes:
+            if isinstance(cause, (GenerationTimeoutError, TimeoutException, requests.exceptions.Timeout)):
+                return True
+            if isinstance(cause, requests.exceptions.HTTPError):
+                response = cause.response
+                if response is not None and response.status_code >= 500:
+                    return True
+        return False
+    
+    def _chat_turn(self, message: str, deadline: Deadline,
+                   on_progress: Optional[Callable[[str], None]] = None) -> str:
+        """
+        执行一轮对话；使用共享浏览器时整轮对话都在本助手的标签页内独占进行
+        
+        Args:
+            message (str): 消息内容
+            deadline (Deadline): 截止时间
+            on_progress (callable, optional): 回复生成进度回调
+            
+        Returns:
+            str: AI助手的回复
+        """
+        if not self.driver or self.owns_driver:
+            return self._chat_turn_in_tab(message, deadline, on_progress)
+        
+        with get_tabs(self.driver).use(self.assistant_type) as new_tab:
+            # 标签页已加载过助手页面时直接切换，不重新加载
+            if new_tab:
+                try:
+                    self._load_tab()
+                except Exception as e:
+                    logger.warning(f"在新标签页中打开助手页面失败: {str(e)}")
+            return self._chat_turn_in_tab(message, deadline, on_progress)
+    
+    def _load_tab(self) -> None:
+        """在当前标签页中打开助手页面，并重置与页面相关的状态"""
+        logger.info(f"在 {self.assistant_type} 的标签页中打开助手页面: {self.assistant_url}")
+        self._inject_auth_cookies()
+        self.driver.get(self.assistant_url)
+        wait_until(self.driver, document_ready(), 20, name='page_ready')
+        self.last_md_editor_id = None
+        self.has_captured_initial_message = False
+        self.browser_logged_in = not self.auth.is_sso_url(self.driver.current_url)
+    
+    def _chat_turn_in_tab(self, message: str, deadline: Deadline,
+                          on_progress: Optional[Callable[[str], None]] = None) -> str:
+        """
+        执行一轮对话
+        
+        Args:
+            message (str): 消息内容
+            deadline (Deadline): 截止时间
+            on_progress (callable, optional): 回复生成进度回调
+            
         Returns:
             str: AI助手的回复
         """
         if not self.is_ready:
             self._initialize()
         
+        # 保活线程重新登录过时，先把新cookies同步到浏览器，本轮对话不再触发登录
+        self._apply_session_refresh()
+        
         # 在第一次对话前尝试捕获初始消息
         if not self.has_captured_initial_message and self.driver:
             self._capture_initial_message()
@@ -516,9 +847,11 @@ class AIAssistant:
         self.dialog_count += 1
         logger.info(f"正在进行第 {self.dialog_count} 次对话")
         
-        # 添加用户消息到会话历史
+        # 添加用户消息到会话历史（恢复重试时不会重复添加）
         user_message = self.conversation.add_user_message(message)
         logger.info(f"发送消息: {message[:50]}{'...' if len(message) > 50 else ''}")
+        self._turn_state = {'sent': False, 'deadline': deadline, 'on_progress': on_progress,
+                            'started': time.monotonic(), 'first_char_at': None}
         
         try:
             # 暂时禁用API调用方式，强制使用浏览器模拟方式
@@ -531,14 +864,29 @@ class AIAssistant:
             else:
                 logger.info("使用现有的浏览器实例")
             
-            response = self._browser_chat(message)
+            response = self.recovery.run(
+                lambda: self._browser_chat(message),
+                name=f"第 {self.dialog_count} 次对话",
+                deadline=deadline
+            )
             logger.info("浏览器模拟方式成功获取回复")
             
+            # 记录本轮的端到端延迟、首字延迟和回答长度
+            started = self._turn_state['started']
+            first_char_at = self._turn_state['first_char_at']
+            record_turn(self.assistant_type, time.monotonic() - started,
+                        None if first_char_at is None else first_char_at - started, len(response))
+            
             # 添加助手回复到会话历史
             self.conversation.add_assistant_message(response)
             
-            # 保存会话历史
-            self.conversation.save()
+            # 保存会话历史（后台合并写入，不阻塞返回）
+            save_conversation(self.conversation)
+            
+            # 新的问答加入相似问题索引
+            index = get_answer_index(self.assistant_type)
+            if index is not None and response.strip() and not is_packed_prompt(message):
+                index.add([message], [response])
             
             return response
             
@@ -549,14 +897,163 @@ class AIAssistant:
             # 添加错误消息到会话历史
             self.conversation.add_assistant_message(f"错误: {error_msg}")
             
-            # 尝试使用Selenium重新初始化
-            if not self.is_ready:
-                logger.info("尝试使用Selenium重新初始化")
-                if self._initialize_browser():
-                    logger.info("重新初始化成功，重试发送消息")
-                    return self.chat(message)
+            raise AssistantError(error_msg) from e
+        
+        finally:
+            self._restore_implicit_wait()
+    
+    def _apply_session_refresh(self) -> None:
+        """把保活线程重新登录得到的cookies注入浏览器并重新打开助手页面"""
+        if not self._session_refreshed.is_set() or not self.driver:
+            return
+        self._session_refreshed.clear()
+        
+        self.http_client.session.headers.update(self.auth.get_headers())
+        if not self._inject_auth_cookies(force=True):
+            return
+        try:
+            self.driver.get(self.assistant_url)
+            wait_until(self.driver, document_ready(), 20, name='page_ready')
+        except Exception as e:
+            logger.warning(f"同步会话后打开助手页面失败: {str(e)}")
+            return
+        # 页面已重新加载，回复元素的编号从头开始
+        self.last_md_editor_id = None
+        self.has_captured_initial_message = False
+        self.browser_logged_in = not self.auth.is_sso_url(self.driver.current_url)
+        logger.info("已将后台刷新的会话同步到浏览器")
+    
+    def _bound_implicit_wait(self, phase: str) -> None:
+        """
+        检查截止时间，并在剩余时间不足时缩短隐式等待，避免单次元素查找超出截止时间
+        
+        Args:
+            phase (str): 当前阶段名称
+        """
+        deadline = self._turn_state['deadline']
+        deadline.check(phase)
+        if deadline.unlimited or not self.driver:
+            return
+        
+        implicit_wait = config.WEBDRIVER_CONFIG.get('implicit_wait', 10)
+        remaining = deadline.remaining()
+        if remaining < implicit_wait:
+            self.driver.implicitly_wait(remaining)
+            self._implicit_wait_reduced = True
+    
+    def _restore_implicit_wait(self) -> None:
+        """恢复配置中的隐式等待时间"""
+        if self._implicit_wait_reduced and self.driver:
+            try:
+                self.driver.implicitly_wait(config.WEBDRIVER_CONFIG.get('implicit_wait', 10))
+            except Exception as e:
+                logger.debug(f"恢复隐式等待时间失败: {e}")
+        self._implicit_wait_reduced = False
+    
+    def wait_for_service(self, max_park_time: Optional[float] = None) -> bool:
+        """
+        熔断打开时暂停，等到半开状态后发送探测问题，直到站点恢复或超过最长等待时间
+        
+        Args:
+            max_park_time (float, optional): 最长等待时间(秒)，默认使用配置中的max_park_time
+            
+        Returns:
+            bool: 站点是否已恢复（熔断器已关闭）
+        """
+        breaker_config = config.CIRCUIT_BREAKER_CONFIG
+        if max_park_time is None:
+            max_park_time = breaker_config.get('max_park_time', 1800)
+        park_deadline = Deadline(max_park_time)
+        
+        while self.breaker.state != CircuitBreaker.CLOSED:
+            wait = self.breaker.time_until_half_open()
+            if wait > park_deadline.remaining():
+                logger.warning("等待站点恢复超时")
+                return False
+            if wait > 0:
+                logger.info(f"站点熔断中，暂停 {wait:.0f} 秒后探测")
+                time.sleep(wait)
             
-            raise AssistantError(error_msg)
+            try:
+                self.chat(breaker_config.get('probe_question', '你好'),
+                          deadline=park_deadline.cap(breaker_config.get('probe_deadline', 60)))
+            except CircuitOpenError:
+                # 其他调用方正在探测
+                time.sleep(min(1.0, park_deadline.remaining()))
+            except Exception as e:
+                logger.warning(f"探测问题失败: {str(e)}")
+        
+        return True
+    
+    def _classify_failure(self, error: BaseException) -> str:
+        """
+        对对话失败进行分类，决定需要重做的范围
+        
+        Args:
+            error (BaseException): 对话过程中的异常
+            
+        Returns:
+            str: FailureKind中的故障类别
+        """
+        for cause in iter_causes(error):
+            if isinstance(cause, LoginRequiredError):
+                return FailureKind.LOGIN_REQUIRED
+            if isinstance(cause, GenerationTimeoutError):
+                return FailureKind.GENERATION_TIMEOUT
+        
+        kind = classify_webdriver_error(error)
+        if kind in (FailureKind.STALE_ELEMENT, FailureKind.UNKNOWN) and self.driver:
+            # 元素失效或未知错误可能是页面被重定向到了登录页
+            try:
+                if self.auth.is_sso_url(self.driver.current_url):
+                    return FailureKind.LOGIN_REQUIRED
+            except Exception as e:
+                if classify_webdriver_error(e) == FailureKind.DRIVER_DEAD:
+                    return FailureKind.DRIVER_DEAD
+        return kind
+    
+    def _recover_stale_element(self, error: BaseException) -> None:
+        """元素失效：无需额外动作，重试时会重新探测输入框或回复元素"""
+        logger.info("页面元素已失效，重新探测元素")
+    
+    def _recover_login(self, error: BaseException) -> None:
+        """被重定向到登录页：重新登录后重新发送消息"""
+        logger.info("会话已失效，重新登录")
+        self.browser_logged_in = False
+        self.auth.invalidate_login_cache()
+        if not self._browser_login():
+            raise LoginRequiredError("重新登录失败")
+        self._turn_state['sent'] = False
+    
+    def _recover_driver(self, error: BaseException) -> None:
+        """浏览器失效：重建浏览器实例后重新发送消息"""
+        logger.warning("浏览器会话已失效，重新创建浏览器实例")
+        if self.driver:
+            forget_tabs(self.driver)
+        if self.driver and self.owns_driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = None
+        self.owns_driver = False
+        self.browser_logged_in = False
+        self.browser_cookies_injected = False
+        self.has_captured_initial_message = False
+        self.last_md_editor_id = None
+        self._turn_state['sent'] = False
+        
+        if not self._initialize_browser():
+            raise AssistantError("重建浏览器实例失败")
+        self.auth.driver = self.driver
+        if get_profiler() is not None:
+            # 重建的浏览器同样统计WebDriver命令，本轮剩余的等待时间不会漏记
+            instrument(self.driver)
+    
+    def _recover_resend(self, error: BaseException) -> None:
+        """等待回复超时或未知错误：重新发送消息"""
+        logger.info("重新发送消息")
+        self._turn_state['sent'] = False
     
     def _browser_chat(self, message: str) -> str:
         """
@@ -579,6 +1076,7 @@ class AIAssistant:
             logger.info(f"使用已初始化的浏览器实例，ID: {id(self.driver)}")
         
         # 检查会话状态并修复如果需要
+        page_reloaded = False
         try:
             current_url = self.driver.current_url
             logger.info(f"当前URL: {current_url}")
@@ -588,574 +1086,675 @@ class AIAssistant:
                 logger.info("检测到登录页面，需要重新登录")
                 self.browser_logged_in = False
                 self._browser_login()
+                page_reloaded = True
                 # 登录后可能需要处理模型选择
                 # self._handle_model_selection()
             elif self.assistant_url not in current_url and "chat.buaa.edu.cn" in current_url:
                 logger.info(f"不在正确的页面，导航到: {self.assistant_url}")
                 self.driver.get(self.assistant_url)
                 # 等待页面加载完成
-                WebDriverWait(self.driver, 20).until(
-                    lambda d: d.execute_script("return document.readyState") == "complete"
-                )
+                wait_until(self.driver, document_ready(), 20, name='page_ready')
+                page_reloaded = True
                 # 可能需要处理模型选择
                 # self._handle_model_selection()
         except Exception as e:
             logger.warning(f"检查会话状态时出错: {str(e)}")
         
+        
+        # 页面重新加载后，已发送但尚未取回的回复会丢失，需要重新发送
+        if page_reloaded:
+            self._turn_state['sent'] = False
+        
         try:
-            # 使用全局配置参数，不重新获取config.WEBDRIVER_CONFIG
-            # 获取选择器配置
-            element_selectors = config.WEBDRIVER_CONFIG.get('element_selectors', {})
-            input_selectors = element_selectors.get('input_selectors', [
-                "textarea.n-input__textarea-el", 
-                ".chat-input", 
-                "[placeholder]", 
-                "textarea"
-            ])
-            send_button_selectors = element_selectors.get('send_button_selectors', [
-                "button[type='submit']",
-                ".send-button",
-                "button.n-button",
-                "button"
-            ])
-            response_selectors = element_selectors.get('response_selectors', [
-                ".chat-assistant .text",
-                ".chat-message-text",
-                ".assistant-message",
-                ".reply .text"
-            ])
-            
-            # 设置等待时间
-            max_wait_time = config.WEBDRIVER_CONFIG.get('wait_for_answer', 60)
-            
-            # 查看当前是否已有对话框
-            try:
-                # 检查是否有输入框
-                textareas = self.driver.find_elements(By.TAG_NAME, "textarea")
-                if not any(textarea.is_displayed() for textarea in textareas):
-                    logger.info("未找到可见的输入框，可能需要选择模型")
-                    # self._handle_model_selection()
-                else:
-                    logger.info("找到可见的输入框")
-            except Exception as e:
-                logger.warning(f"检查输入框时出错: {str(e)}")
+            if not self._turn_state.get('sent'):
+                self._send_message(message)
+                self._turn_state['sent'] = True
+            else:
+                logger.info("消息已发送，重新探测回复元素")
             
-            # 查找输入框
-            input_area = None
+            return self._receive_reply()
             
-            # 1. 首先使用精确的JavaScript路径
+        except Exception as e:
+            raise AssistantError(f"浏览器模拟交互失败: {str(e)}") from e
+    
+    def _send_message(self, message: str) -> None:
+        """
+        查找输入框，输入消息并点击发送
+        
+        Args:
+            message (str): 消息内容
+        """
+        self._bound_implicit_wait('输入框探测')
+        
+        # 使用全局配置参数，不重新获取config.WEBDRIVER_CONFIG
+        # 获取选择器配置
+        element_selectors = config.WEBDRIVER_CONFIG.get('element_selectors', {})
+        input_selectors = element_selectors.get('input_selectors', [
+            "textarea.n-input__textarea-el", 
+            ".chat-input", 
+            "[placeholder]", 
+            "textarea"
+        ])
+        send_button_selectors = element_selectors.get('send_button_selectors', [
+            "button[type='submit']",
+            ".send-button",
+            "button.n-button",
+            "button"
+        ])
+        
+        # 查看当前是否已有对话框
+        try:
+            # 检查是否有输入框
+            textareas = self.driver.find_elements(By.TAG_NAME, "textarea")
+            if not any(textarea.is_displayed() for textarea in textareas):
+                logger.info("未找到可见的输入框，可能需要选择模型")
+                # self._handle_model_selection()
+            else:
+                logger.info("找到可见的输入框")
+        except Exception as e:
+            logger.warning(f"检查输入框时出错: {str(e)}")
+        
+        # 查找输入框
+        input_area = None
+        
+        # 1. 首先使用精确的JavaScript路径
+        try:
+            specific_input = self.driver.execute_script("""
+                // 尝试使用精确的选择器路径
+                const input = document.querySelector("#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea");
+                if (input && input.offsetParent !== null) {
+                    return input;
+                }
+                
+                // 如果没找到，尝试查找容器并获取其中的textarea
+                const container = document.querySelector("#send_body_id > div.bottom > div.left > div.input_box");
+                if (container) {
+                    const textarea = container.querySelector("textarea");
+                    if (textarea && textarea.offsetParent !== null) {
+                        return textarea;
+                    }
+                }
+                
+                return null;
+            """)
+            if specific_input:
+                input_area = specific_input
+                logger.info("使用精确的JavaScript路径找到输入框")
+        except Exception as e:
+            logger.debug(f"使用精确的JavaScript路径查找输入框时出错: {e}")
+        
+        # 2. 如果没找到，尝试其他选择器
+        if not input_area:
+            for selector in input_selectors:
+                try:
+                    input_areas = self.driver.find_elements(By.CSS_SELECTOR, selector)
+                    for element in input_areas:
+                        if element.is_displayed() and element.is_enabled():
+                            input_area = element
+                            logger.info(f"找到输入框，选择器: {selector}")
+                            break
+                    if input_area:
+                        break
+                except Exception as e:
+                    logger.debug(f"使用选择器 {selector} 查找输入框时出错: {e}")
+        
+        # 3. 如果还是没找到，尝试使用更广泛的JavaScript查询
+        if not input_area:
             try:
-                specific_input = self.driver.execute_script("""
-                    // 尝试使用精确的选择器路径
-                    const input = document.querySelector("#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea");
-                    if (input && input.offsetParent !== null) {
-                        return input;
+                input_area = self.driver.execute_script("""
+                    // 尝试查找所有可能的输入元素
+                    const selectors = [
+                        "#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea",
+                        "#send_body_id > div.bottom > div.left > div.input_box",
+                        "textarea",
+                        "[contenteditable='true']",
+                        ".input-box",
+                        ".chat-input"
+                    ];
+                    
+                    // 精确选择器优先
+                    const preciseInput = document.querySelector("#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea");
+                    if (preciseInput && preciseInput.offsetParent !== null) {
+                        return preciseInput;
                     }
                     
-                    // 如果没找到，尝试查找容器并获取其中的textarea
-                    const container = document.querySelector("#send_body_id > div.bottom > div.left > div.input_box");
-                    if (container) {
-                        const textarea = container.querySelector("textarea");
-                        if (textarea && textarea.offsetParent !== null) {
+                    // 遍历所有可能的选择器
+                    for (const selector of selectors) {
+                        const elements = document.querySelectorAll(selector);
+                        for (const el of elements) {
+                            if (el.offsetParent !== null && 
+                                (el.tagName.toLowerCase() === 'textarea' || 
+                                 el.getAttribute('contenteditable') === 'true' ||
+                                 el.classList.contains('input-box'))) {
+                                return el;
+                            }
+                        }
+                    }
+                    
+                    // 最后尝试查找任何可见的textarea
+                    const allTextareas = document.querySelectorAll('textarea');
+                    for (const textarea of allTextareas) {
+                        if (textarea.offsetParent !== null && textarea.style.display !== 'none') {
                             return textarea;
                         }
                     }
                     
                     return null;
                 """)
-                if specific_input:
-                    input_area = specific_input
-                    logger.info("使用精确的JavaScript路径找到输入框")
+                if input_area:
+                    logger.info("通过JavaScript查询找到输入框")
             except Exception as e:
-                logger.debug(f"使用精确的JavaScript路径查找输入框时出错: {e}")
-            
-            # 2. 如果没找到，尝试其他选择器
-            if not input_area:
-                for selector in input_selectors:
-                    try:
-                        input_areas = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                        for element in input_areas:
-                            if element.is_displayed() and element.is_enabled():
-                                input_area = element
-                                logger.info(f"找到输入框，选择器: {selector}")
-                                break
-                        if input_area:
-                            break
-                    except Exception as e:
-                        logger.debug(f"使用选择器 {selector} 查找输入框时出错: {e}")
-            
-            # 3. 如果还是没找到，尝试使用更广泛的JavaScript查询
-            if not input_area:
+                logger.debug(f"使用JavaScript查询查找输入框时出错: {e}")
+        
+        if not input_area:
+            raise AssistantError("无法找到输入框")
+        
+        # 验证找到的输入框是否为可输入元素
+        try:
+            # 检查元素类型和可编辑状态
+            is_valid_input = self.driver.execute_script("""
+                const el = arguments[0];
+                // 检查是否为textarea或可编辑div
+                return (el.tagName.toLowerCase() === 'textarea' || 
+                       el.getAttribute('contenteditable') === 'true') &&
+                       el.offsetParent !== null && !el.disabled;
+            """, input_area)
+            
+            if not is_valid_input:
+                logger.warning("找到的元素不是有效的输入框，尝试查找其中的textarea")
+                # 如果不是有效输入框，尝试在其中查找textarea
                 try:
-                    input_area = self.driver.execute_script("""
-                        // 尝试查找所有可能的输入元素
-                        const selectors = [
-                            "#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea",
-                            "#send_body_id > div.bottom > div.left > div.input_box",
-                            "textarea",
-                            "[contenteditable='true']",
-                            ".input-box",
-                            ".chat-input"
-                        ];
-                        
-                        // 精确选择器优先
-                        const preciseInput = document.querySelector("#send_body_id > div.bottom > div.left > div.input_box > div > div.n-input-wrapper > div.n-input__textarea.n-scrollbar > textarea");
-                        if (preciseInput && preciseInput.offsetParent !== null) {
-                            return preciseInput;
-                        }
-                        
-                        // 遍历所有可能的选择器
-                        for (const selector of selectors) {
-                            const elements = document.querySelectorAll(selector);
-                            for (const el of elements) {
-                                if (el.offsetParent !== null && 
-                                    (el.tagName.toLowerCase() === 'textarea' || 
-                                     el.getAttribute('contenteditable') === 'true' ||
-                                     el.classList.contains('input-box'))) {
-                                    return el;
-                                }
-                            }
-                        }
-                        
-                        // 最后尝试查找任何可见的textarea
-                        const allTextareas = document.querySelectorAll('textarea');
-                        for (const textarea of allTextareas) {
-                            if (textarea.offsetParent !== null && textarea.style.display !== 'none') {
-                                return textarea;
-                            }
-                        }
-                        
-                        return null;
-                    """)
-                    if input_area:
-                        logger.info("通过JavaScript查询找到输入框")
+                    textarea = self.driver.execute_script("""
+                        const container = arguments[0];
+                        return container.querySelector('textarea') || 
+                              container.querySelector('[contenteditable="true"]');
+                    """, input_area)
+                    
+                    if textarea:
+                        input_area = textarea
+                        logger.info("在容器中找到了有效的输入框")
                 except Exception as e:
-                    logger.debug(f"使用JavaScript查询查找输入框时出错: {e}")
-            
-            if not input_area:
-                raise AssistantError("无法找到输入框")
-            
-            # 验证找到的输入框是否为可输入元素
-            try:
-                # 检查元素类型和可编辑状态
-                is_valid_input = self.driver.execute_script("""
-                    const el = arguments[0];
-                    // 检查是否为textarea或可编辑div
-                    return (el.tagName.toLowerCase() === 'textarea' || 
-                           el.getAttribute('contenteditable') === 'true') &&
-                           el.offsetParent !== null && !el.disabled;
-                """, input_area)
-                
-                if not is_valid_input:
-                    logger.warning("找到的元素不是有效的输入框，尝试查找其中的textarea")
-                    # 如果不是有效输入框，尝试在其中查找textarea
-                    try:
-                        textarea = self.driver.execute_script("""
-                            const container = arguments[0];
-                            return container.querySelector('textarea') || 
-                                  container.querySelector('[contenteditable="true"]');
-                        """, input_area)
-                        
-                        if textarea:
-                            input_area = textarea
-                            logger.info("在容器中找到了有效的输入框")
-                    except Exception as e:
-                        logger.debug(f"尝试在容器中查找输入框时出错: {e}")
-            except Exception as e:
-                logger.debug(f"验证输入框时出错: {e}")
-            
-            # 修改消息，添加结束标志词提示
-            message_with_prompt = message + ";请在完成回答后回复结束标志词'我的回答完毕'"
-            logger.debug(f"添加结束标志词提示后的消息: {message_with_prompt}")
-            
-            # 清空输入框并输入消息
+                    logger.debug(f"尝试在容器中查找输入框时出错: {e}")
+        except Exception as e:
+            logger.debug(f"验证输入框时出错: {e}")
+        
+        # 修改消息，添加结束标志词提示
+        message_with_prompt = message + ";请在完成回答后回复结束标志词'我的回答完毕'"
+        logger.debug(f"添加结束标志词提示后的消息: {message_with_prompt}")
+        
+        # 清空输入框并输入消息
+        try:
+            input_area.clear()
+            # 确保输入框清空
+            self.driver.execute_script("arguments[0].value = '';", input_area)
+            input_area.send_keys(Keys.CONTROL + "a")
+            input_area.send_keys(Keys.DELETE)
+            # 输入消息
+            input_area.send_keys(message_with_prompt)
+            logger.info("已在输入框中输入消息")
+        except Exception as e:
+            logger.warning(f"通过常规方法输入消息失败: {e}")
+            # 尝试使用JavaScript设置值
             try:
-                input_area.clear()
-                # 确保输入框清空
-                self.driver.execute_script("arguments[0].value = '';", input_area)
-                input_area.send_keys(Keys.CONTROL + "a")
-                input_area.send_keys(Keys.DELETE)
-                # 输入消息
-                input_area.send_keys(message_with_prompt)
-                logger.info("已在输入框中输入消息")
+                self.driver.execute_script("arguments[0].value = arguments[1];", input_area, message_with_prompt)
+                logger.info("已通过JavaScript在输入框中输入消息")
             except Exception as e:
-                logger.warning(f"通过常规方法输入消息失败: {e}")
-                # 尝试使用JavaScript设置值
-                try:
-                    self.driver.execute_script("arguments[0].value = arguments[1];", input_area, message_with_prompt)
-                    logger.info("已通过JavaScript在输入框中输入消息")
-                except Exception as e:
-                    logger.error(f"通过JavaScript输入消息也失败: {e}")
-                    raise AssistantError(f"无法在输入框中输入消息: {e}")
-            
-            # 查找发送按钮并点击
-            send_button = None
-            
-            # 1. 首先使用精确的JavaScript路径
+                logger.error(f"通过JavaScript输入消息也失败: {e}")
+                raise AssistantError(f"无法在输入框中输入消息: {e}")
+        
+        # 查找发送按钮并点击
+        self._bound_implicit_wait('点击发送')
+        send_button = None
+        
+        # 1. 首先使用精确的JavaScript路径
+        try:
+            # 使用用户提供的精确路径
+            specific_button = self.driver.find_element(By.CSS_SELECTOR, "#send_body_id > div.bottom > div.right > div")
+            if specific_button.is_displayed() and specific_button.is_enabled():
+                send_button = specific_button
+                logger.info("使用精确的JavaScript路径找到发送按钮")
+        except Exception as e:
+            logger.debug(f"使用精确的JavaScript路径查找按钮时出错: {e}")
+        
+        # 2. 尝试查找特定的send_botton类（注意之前的拼写错误：send_bottom -> send_botton）
+        if not send_button:
             try:
-                # 使用用户提供的精确路径
-                specific_button = self.driver.find_element(By.CSS_SELECTOR, "#send_body_id > div.bottom > div.right > div")
-                if specific_button.is_displayed() and specific_button.is_enabled():
-                    send_button = specific_button
-                    logger.info("使用精确的JavaScript路径找到发送按钮")
+                specific_buttons = self.driver.find_elements(By.CSS_SELECTOR, ".send_botton")
+                for button in specific_buttons:
+                    if button.is_displayed() and button.is_enabled():
+                        send_button = button
+                        logger.info("找到特定的send_botton类发送按钮")
+                        break
             except Exception as e:
-                logger.debug(f"使用精确的JavaScript路径查找按钮时出错: {e}")
-            
-            # 2. 尝试查找特定的send_botton类（注意之前的拼写错误：send_bottom -> send_botton）
-            if not send_button:
-                try:
-                    specific_buttons = self.driver.find_elements(By.CSS_SELECTOR, ".send_botton")
-                    for button in specific_buttons:
-                        if button.is_displayed() and button.is_enabled():
-                            send_button = button
-                            logger.info("找到特定的send_botton类发送按钮")
-                            break
-                except Exception as e:
-                    logger.debug(f"查找特定send_botton类按钮时出错: {e}")
-            
-            # 3. 如果没找到特定类，使用配置中的选择器列表
-            if not send_button:
-                for selector in send_button_selectors:
-                    try:
-                        buttons = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                        for button in buttons:
-                            if button.is_displayed() and button.is_enabled():
-                                send_button = button
-                                logger.info(f"找到发送按钮，选择器: {selector}")
-                                break
-                        if send_button:
-                            break
-                    except Exception as e:
-                        logger.debug(f"查找发送按钮时出错 (选择器: {selector}): {e}")
-                        continue
-            
-            # 备用方案：通过XPath查找含有"send"或"发送"文本或属性值的按钮
-            if not send_button:
+                logger.debug(f"查找特定send_botton类按钮时出错: {e}")
+        
+        # 3. 如果没找到特定类，使用配置中的选择器列表
+        if not send_button:
+            for selector in send_button_selectors:
                 try:
-                    # 通过文本或属性查找发送按钮
-                    xpath_buttons = self.driver.find_elements(By.XPATH, 
-                        "//*[contains(text(), 'send') or contains(text(), '发送') or contains(@class, 'send') or @type='submit']")
-                    for button in xpath_buttons:
+                    buttons = self.driver.find_elements(By.CSS_SELECTOR, selector)
+                    for button in buttons:
                         if button.is_displayed() and button.is_enabled():
                             send_button = button
-                            logger.info("通过XPath找到发送按钮")
+                            logger.info(f"找到发送按钮，选择器: {selector}")
                             break
+                    if send_button:
+                        break
                 except Exception as e:
-                    logger.debug(f"通过XPath查找发送按钮时出错: {e}")
-            
-            # 最终保障：通过JavaScript尝试查找按钮
-            if not send_button:
-                try:
-                    # 使用JavaScript查找所有可能的按钮
-                    js_buttons = self.driver.execute_script("""
-                        // 先尝试精确的路径
-                        const preciseButton = document.querySelector("#send_body_id > div.bottom > div.right > div");
-                        if (preciseButton && preciseButton.offsetParent !== null) {
-                            return [preciseButton];
-                        }
+                    logger.debug(f"查找发送按钮时出错 (选择器: {selector}): {e}")
+                    continue
+        
+        # 备用方案：通过XPath查找含有"send"或"发送"文本或属性值的按钮
+        if not send_button:
+            try:
+                # 通过文本或属性查找发送按钮
+                xpath_buttons = self.driver.find_elements(By.XPATH, 
+                    "//*[contains(text(), 'send') or contains(text(), '发送') or contains(@class, 'send') or @type='submit']")
+                for button in xpath_buttons:
+                    if button.is_displayed() and button.is_enabled():
+                        send_button = button
+                        logger.info("通过XPath找到发送按钮")
+                        break
+            except Exception as e:
+                logger.debug(f"通过XPath查找发送按钮时出错: {e}")
+        
+        # 最终保障：通过JavaScript尝试查找按钮
+        if not send_button:
+            try:
+                # 使用JavaScript查找所有可能的按钮
+                js_buttons = self.driver.execute_script("""
+                    // 先尝试精确的路径
+                    const preciseButton = document.querySelector("#send_body_id > div.bottom > div.right > div");
+                    if (preciseButton && preciseButton.offsetParent !== null) {
+                        return [preciseButton];
+                    }
+                    
+                    // 如果精确路径没找到，尝试其他选择器
+                    return Array.from(document.querySelectorAll('button, [role="button"], .button, .btn, .send, .send_botton'))
+                        .filter(el => el.offsetParent !== null);
+                """)
+                if js_buttons and len(js_buttons) > 0:
+                    # 如果有多个按钮，尝试找右下角位置的那个（通常是发送按钮）
+                    if len(js_buttons) > 1:
+                        # 获取输入框位置，找最靠近输入框的按钮
+                        input_rect = input_area.rect
+                        closest_button = None
+                        min_distance = float('inf')
                         
-                        // 如果精确路径没找到，尝试其他选择器
-                        return Array.from(document.querySelectorAll('button, [role="button"], .button, .btn, .send, .send_botton'))
-                            .filter(el => el.offsetParent !== null);
-                    """)
-                    if js_buttons and len(js_buttons) > 0:
-                        # 如果有多个按钮，尝试找右下角位置的那个（通常是发送按钮）
-                        if len(js_buttons) > 1:
-                            # 获取输入框位置，找最靠近输入框的按钮
-                            input_rect = input_area.rect
-                            closest_button = None
-                            min_distance = float('inf')
-                            
-                            for btn in js_buttons:
-                                btn_rect = btn.rect
-                                # 计算按钮与输入框的距离，优先选择输入框右侧的按钮
-                                if btn_rect['x'] >= input_rect['x']: # 在输入框右侧
-                                    distance = ((btn_rect['x'] - input_rect['x'] - input_rect['width']) ** 2 + 
-                                                (btn_rect['y'] - input_rect['y']) ** 2) ** 0.5
-                                    if distance < min_distance:
-                                        min_distance = distance
-                                        closest_button = btn
-                            
-                            if closest_button:
-                                send_button = closest_button
-                                logger.info("通过JavaScript和位置关系找到最可能的发送按钮")
-                        else:
-                            send_button = js_buttons[0]
-                            logger.info("通过JavaScript找到发送按钮")
-                except Exception as e:
-                    logger.debug(f"通过JavaScript查找发送按钮时出错: {e}")
-            
-            # 如果找到了按钮，尝试点击
-            if send_button:
+                        for btn in js_buttons:
+                            btn_rect = btn.rect
+                            # 计算按钮与输入框的距离，优先选择输入框右侧的按钮
+                            if btn_rect['x'] >= input_rect['x']: # 在输入框右侧
+                                distance = ((btn_rect['x'] - input_rect['x'] - input_rect['width']) ** 2 + 
+                                            (btn_rect['y'] - input_rect['y']) ** 2) ** 0.5
+                                if distance < min_distance:
+                                    min_distance = distance
+                                    closest_button = btn
+                        
+                        if closest_button:
+                            send_button = closest_button
+                            logger.info("通过JavaScript和位置关系找到最可能的发送按钮")
+                    else:
+                        send_button = js_buttons[0]
+                        logger.info("通过JavaScript找到发送按钮")
+            except Exception as e:
+                logger.debug(f"通过JavaScript查找发送按钮时出错: {e}")
+        
+        # 如果找到了按钮，尝试点击
+        if send_button:
+            try:
+                logger.info(f"尝试点击发送按钮 (class: {send_button.get_attribute('class')})")
+                send_button.click()
+                logger.info("成功点击发送按钮")
+            except Exception as e:
+                logger.warning(f"直接点击发送按钮失败: {e}")
                 try:
-                    logger.info(f"尝试点击发送按钮 (class: {send_button.get_attribute('class')})")
-                    send_button.click()
-                    logger.info("成功点击发送按钮")
+                    # 尝试使用JavaScript点击
+                    self.driver.execute_script("arguments[0].click();", send_button)
+                    logger.info("使用JavaScript成功点击发送按钮")
                 except Exception as e:
-                    logger.warning(f"直接点击发送按钮失败: {e}")
+                    logger.warning(f"使用JavaScript点击发送按钮失败: {e}")
+                    # 最后的尝试：通过精确路径直接执行点击
                     try:
-                        # 尝试使用JavaScript点击
-                        self.driver.execute_script("arguments[0].click();", send_button)
-                        logger.info("使用JavaScript成功点击发送按钮")
+                        self.driver.execute_script("""
+                            const btn = document.querySelector("#send_body_id > div.bottom > div.right > div");
+                            if (btn) btn.click();
+                        """)
+                        logger.info("使用精确路径的JavaScript点击成功")
                     except Exception as e:
-                        logger.warning(f"使用JavaScript点击发送按钮失败: {e}")
-                        # 最后的尝试：通过精确路径直接执行点击
-                        try:
-                            self.driver.execute_script("""
-                                const btn = document.querySelector("#send_body_id > div.bottom > div.right > div");
-                                if (btn) btn.click();
-                            """)
-                            logger.info("使用精确路径的JavaScript点击成功")
-                        except Exception as e:
-                            logger.warning(f"所有点击方法都失败，将使用回车键发送: {e}")
-                            input_area.send_keys(Keys.ENTER)
-            else:
-                # 如果找不到发送按钮，尝试通过回车键发送
-                logger.warning("未找到任何发送按钮，使用回车键发送")
-                input_area.send_keys(Keys.RETURN)
-                logger.info("已通过回车键发送消息")
-            
-            # 等待回复出现并稳定
-            response_text = ""
-            previous_response_length = 0
-            stable_count = 0
-            wait_time = 0
-            wait_increment = 0.5
-            max_wait_time = 180  # 最长等待3分钟
-            
-            logger.info("等待AI助手回复...")
-            #time.sleep(1)#我知道这里不应该这么写，但不这么写很容易出bug。我有一个不会出bug的版本，但我还没想好怎么改
-            while wait_time < max_wait_time:
-                # 1. 首先尝试基于对话次数推测的md-editor元素获取回复
-                try:
-                    # 1.1 如果已知上一次对话ID，尝试使用预测的ID直接获取
-                    if self.last_md_editor_id:
-                        # 从上一次的ID提取数字部分
-                        try:
+                        logger.warning(f"所有点击方法都失败，将使用回车键发送: {e}")
+                        input_area.send_keys(Keys.ENTER)
+        else:
+            # 如果找不到发送按钮，尝试通过回车键发送
+            logger.warning("未找到任何发送按钮，使用回车键发送")
+            input_area.send_keys(Keys.RETURN)
+            logger.info("已通过回车键发送消息")
+    
+    def _receive_reply(self) -> str:
+        """
+        等待回复生成完成并提取最终回复
+        
+        Returns:
+            str: AI助手的回复
+        """
+        # 等待回复出现并稳定
+        deadline = self._turn_state['deadline']
+        response_text = ""
+        previous_response_length = 0
+        stable_count = 0
+        wait_time = 0
+        wait_increment = 0.5
+        max_wait_time = 180  # 最长等待3分钟
+        
+        # 轮询时只传回新增的字符，避免长回复每次都重新计算和传输全文
+        reader = IncrementalTextReader(self.driver)
+        predicted_id = None  # 本轮回复元素的ID，预测一次后固定，之后持续读取同一元素
+        
+        self._bound_implicit_wait('等待回复')
+        logger.info("等待AI助手回复...")
+        #time.sleep(1)#我知道这里不应该这么写，但不这么写很容易出bug。我有一个不会出bug的版本，但我还没想好怎么改
+        while wait_time < max_wait_time:
+            # 1. 首先尝试基于对话次数推测的md-editor元素获取回复
+            try:
+                # 1.1 如果已知上一次对话ID，尝试使用预测的ID直接获取
+                if self.last_md_editor_id:
+                    # 从上一次的ID提取数字部分
+                    try:
+                        if predicted_id is None:
                             # 提取id的数字部分，例如从"md-editor-v3_15-preview"提取"15"
                             id_num = int(self.last_md_editor_id.split('_')[1].split('-')[0])
                             # 预测当前回复的ID应该是上一个ID加1
                             predicted_id = f"md-editor-v3_{id_num + 1}-preview"
-                            
-                            logger.debug(f"尝试使用预测的ID获取回复: {predicted_id}")
-                            element = self.driver.find_element(By.ID, predicted_id)
-                            if element and element.is_displayed():
-                                element_text = element.text
-                                if element_text and len(element_text) > len(response_text):
-                                    response_text = element_text
-                                    logger.debug(f"从预测的md-editor元素 {predicted_id} 获取到回复，长度: {len(response_text)}")
-                                    # 更新最后的ID
-                                    self.last_md_editor_id = predicted_id
-                        except Exception as e:
-                            logger.debug(f"使用预测ID获取回复失败: {e}")
-                    
-                #     # 1.2 如果预测ID失败或没有上一次ID，使用JavaScript查找所有符合格式的元素
-                #     if not response_text or len(response_text) == 0:
-                #         md_editor_elements = self.driver.execute_script("""
-                #             return Array.from(document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]'))
-                #                 .filter(el => el.offsetParent !== null && el.textContent.trim().length > 0);
-                #         """)
-                        
-                #         # 找到包含最多文本的元素
-                #         max_text_length = 0
-                #         max_text_element = None
-                #         max_text_id = None
-                        
-                #         for element in md_editor_elements:
-                #             try:
-                #                 if element.is_displayed():
-                #                     element_text = element.text
-                #                     element_id = element.get_attribute('id')
-                #                     if element_text and len(element_text) > max_text_length:
-                #                         max_text_length = len(element_text)
-                #                         max_text_element = element
-                #                         max_text_id = element_id
-                #             except Exception:
-                #                 continue
                         
-                #         # 如果找到了有效元素，更新回复文本和最后ID
-                #         if max_text_element and max_text_length > len(response_text):
-                #             response_text = max_text_element.text
-                #             self.last_md_editor_id = max_text_id
-                #             logger.debug(f"从md-editor元素 {max_text_id} 获取到中间回复，长度: {len(response_text)}")
-                except Exception as e:
-                    logger.debug(f"获取md-editor元素时出错: {e}")
-                    # 如果JavaScript方法失败，继续尝试其他选择器
-                    pass
-                
-                # # 2. 如果md-editor元素未找到回复，尝试其他选择器
-                # if not response_text:
-                #     for selector in response_selectors:
-                #         try:
-                #             elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                #             for element in elements:
-                #                 if not element.is_displayed():
-                #                     continue
-                #                 element_text = element.text
-                #                 if element_text and len(element_text) > len(response_text):
-                #                     response_text = element_text
-                #         except Exception:
-                #             continue
+                        logger.debug(f"尝试使用预测的ID获取回复: {predicted_id}")
+                        element_text = reader.read(predicted_id)
+                        if element_text and len(element_text) > len(response_text):
+                            response_text = element_text
+                            logger.debug(f"从预测的md-editor元素 {predicted_id} 获取到回复，长度: {len(response_text)}")
+                            # 更新最后的ID
+                            self.last_md_editor_id = predicted_id
+                    except Exception as e:
+                        logger.debug(f"使用预测ID获取回复失败: {e}")
                 
-                # 检查回复是否稳定（不再变化）
-                if len(response_text) > 0:
-                    # 检查是否有当前对话的结束标志词
-                    current_dialogue_marker = f"[DIALOG_{self.dialog_count}_END]"
+            #     # 1.2 如果预测ID失败或没有上一次ID，使用JavaScript查找所有符合格式的元素
+            #     if not response_text or len(response_text) == 0:
+            #         md_editor_elements = self.driver.execute_script("""
+            #             return Array.from(document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]'))
+            #                 .filter(el => el.offsetParent !== null && el.textContent.trim().length > 0);
+            #         """)
                     
-                    if current_dialogue_marker in response_text:
-                        logger.info(f"检测到当前对话的结束标记: '{current_dialogue_marker}'，提前结束等待")
-                        break
+            #         # 找到包含最多文本的元素
+            #         max_text_length = 0
+            #         max_text_element = None
+            #         max_text_id = None
                     
-                    # 检查长度是否稳定
-                    if len(response_text) == previous_response_length:
-                        stable_count += 1
-                        if stable_count >= 2:  # 连续3秒没有变化视为回复结束
-                            logger.info("回复文本长度已稳定3秒，结束等待")
-                            break
-                    else:
-                        stable_count = 0
-                        previous_response_length = len(response_text)
+            #         for element in md_editor_elements:
+            #             try:
+            #                 if element.is_displayed():
+            #                     element_text = element.text
+            #                     element_id = element.get_attribute('id')
+            #                     if element_text and len(element_text) > max_text_length:
+            #                         max_text_length = len(element_text)
+            #                         max_text_element = element
+            #                         max_text_id = element_id
+            #             except Exception:
+            #                 continue
+                    
+            #         # 如果找到了有效元素，更新回复文本和最后ID
+            #         if max_text_element and max_text_length > len(response_text):
+            #             response_text = max_text_element.text
+            #             self.last_md_editor_id = max_text_id
+            #             logger.debug(f"从md-editor元素 {max_text_id} 获取到中间回复，长度: {len(response_text)}")
+            except Exception as e:
+                logger.debug(f"获取md-editor元素时出错: {e}")
+                # 如果JavaScript方法失败，继续尝试其他选择器
+                pass
+            
+            # # 2. 如果md-editor元素未找到回复，尝试其他选择器
+            # if not response_text:
+            #     for selector in response_selectors:
+            #         try:
+            #             elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
+            #             for element in elements:
+            #                 if not element.is_displayed():
+            #                     continue
+            #                 element_text = element.text
+            #                 if element_text and len(element_text) > len(response_text):
+            #                     response_text = element_text
+            #         except Exception:
+            #             continue
+            
+            # 检查回复是否稳定（不再变化）
+            if len(response_text) > 0:
+                if self._turn_state.get('first_char_at') is None:
+                    self._turn_state['first_char_at'] = time.monotonic()
                 
-                time.sleep(wait_increment)
-                wait_time += wait_increment
+                # 检查是否有当前对话的结束标志词
+                current_dialogue_marker = f"[DIALOG_{self.dialog_count}_END]"
                 
-                # 每15秒输出一次等待状态
-                if int(wait_time) % 15 == 0 and int(wait_time) > 0:
-                    logger.info(f"已等待 {int(wait_time)} 秒，当前回复长度: {len(response_text)}")
-            
-            # 获取最终回复
-            final_response = ""
-            
-            # 1. 首先尝试使用保存的最后ID直接获取回复
-            if self.last_md_editor_id:
-                try:
-                    element = self.driver.find_element(By.ID, self.last_md_editor_id)
-                    if element and element.is_displayed():
-                        final_response = element.text
-                        logger.info(f"从记录的最后ID {self.last_md_editor_id} 获取到最终回复")
-                except Exception as e:
-                    logger.debug(f"从最后ID获取最终回复失败: {e}")
+                if len(response_text) != previous_response_length:
+                    self._report_progress(self._progress_text(reader, response_text).split(current_dialogue_marker, 1)[0])
+                
+                if current_dialogue_marker in response_text:
+                    logger.info(f"检测到当前对话的结束标记: '{current_dialogue_marker}'，提前结束等待")
+                    break
+                
+                # 检查长度是否稳定
+                if len(response_text) == previous_response_length:
+                    stable_count += 1
+                    if stable_count >= 2:  # 连续3秒没有变化视为回复结束
+                        logger.info("回复文本长度已稳定3秒，结束等待")
+                        break
+                else:
+                    stable_count = 0
+                    previous_response_length = len(response_text)
             
-            # 2. 如果使用ID直接获取失败，使用JavaScript方法
-            if not final_response:
-                try:
-                    md_editor_elements = self.driver.execute_script("""
-                        // 查找所有以'md-editor-v3_'开头且以'-preview'结尾的元素
-                        return Array.from(document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]'))
-                            .filter(el => el.offsetParent !== null && el.textContent.trim().length > 0);
-                    """)
-                    
-                    if md_editor_elements:
-                        logger.info(f"找到 {len(md_editor_elements)} 个md-editor预览元素")
-                        max_length = 0
-                        max_element = None
-                        max_id = None
-                        
-                        for element in md_editor_elements:
-                            try:
-                                element_text = element.text
-                                element_id = element.get_attribute('id')
-                                if element_text and len(element_text) > max_length:
-                                    max_length = len(element_text)
-                                    max_element = element
-                                    max_id = element_id
-                            except Exception as e:
-                                logger.debug(f"提取md-editor元素文本时出错: {e}")
-                        
-                        if max_element:
-                            final_response = max_element.text
-                            self.last_md_editor_id = max_id
-                            logger.debug(f"从md-editor元素 {max_id} 获取到长度为{len(final_response)}的最终回复")
-                except Exception as e:
-                    logger.debug(f"使用JavaScript查找md-editor元素时出错: {e}")
+            # 超过截止时间时放弃本轮，不返回未完成的回复
+            self._bound_implicit_wait('等待回复')
+            time.sleep(min(wait_increment, deadline.remaining()))
+            wait_time += wait_increment
             
-            # 3. 最后尝试使用更广泛的XPath查询作为最终备份
-            if not final_response:
-                try:
-                    # 尝试查找带有"preview"或"content"或"response"相关的元素
-                    xpath_elements = self.driver.find_elements(By.XPATH, 
-                        "//*[contains(@id, 'preview') or contains(@class, 'preview') or contains(@class, 'content') or contains(@class, 'response')]")
+            # 每15秒输出一次等待状态
+            if int(wait_time) % 15 == 0 and int(wait_time) > 0:
+                logger.info(f"已等待 {int(wait_time)} 秒，当前回复长度: {len(response_text)}")
+        
+        # 获取最终回复
+        final_response = ""
+        
+        # 1. 首先使用保存的最后ID读取回复的Markdown源码（无法读取源码时转换预览HTML）
+        if self.last_md_editor_id:
+            try:
+                final_response = extract_markdown(self.driver, self.last_md_editor_id) or ""
+                if final_response:
+                    logger.info(f"从记录的最后ID {self.last_md_editor_id} 获取到最终回复")
+            except Exception as e:
+                logger.debug(f"从最后ID获取最终回复失败: {e}")
+        
+        # 2. 如果使用ID直接获取失败，使用JavaScript方法
+        if not final_response:
+            try:
+                md_editor_elements = self.driver.execute_script("""
+                    // 查找所有以'md-editor-v3_'开头且以'-preview'结尾的元素
+                    return Array.from(document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]'))
+                        .filter(el => el.offsetParent !== null && el.textContent.trim().length > 0);
+                """)
+                
+                if md_editor_elements:
+                    logger.info(f"找到 {len(md_editor_elements)} 个md-editor预览元素")
+                    max_length = 0
+                    max_element = None
+                    max_id = None
                     
-                    for element in xpath_elements:
+                    for element in md_editor_elements:
                         try:
-                            if element.is_displayed():
-                                element_text = element.text
-                                if element_text and len(element_text) > len(final_response):
-                                    final_response = element_text
-                                    logger.debug(f"从XPath元素获取到长度为{len(element_text)}的回复")
-                        except Exception:
-                            continue
-                except Exception as e:
-                    logger.debug(f"使用XPath查找元素时出错: {e}")
-            
-            # 4. 检查iframe中是否存在回复内容
-            if not final_response or len(final_response.strip()) < 10:  # 如果回复为空或太短
-                try:
-                    # 查找所有iframe
-                    iframes = self.driver.find_elements(By.TAG_NAME, "iframe")
+                            element_text = element.text
+                            element_id = element.get_attribute('id')
+                            if element_text and len(element_text) > max_length:
+                                max_length = len(element_text)
+                                max_element = element
+                                max_id = element_id
+                        except Exception as e:
+                            logger.debug(f"提取md-editor元素文本时出错: {e}")
                     
-                    if iframes:
-                        logger.info(f"找到 {len(iframes)} 个iframe，尝试从中获取回复内容")
-                        
-                        # 记住当前窗口句柄
-                        current_window = self.driver.current_window_handle
-                        
-                        for i, iframe in enumerate(iframes):
-                            try:
-                                # 切换到iframe
-                                self.driver.switch_to.frame(iframe)
-                                logger.debug(f"已切换到iframe {i+1}")
-                                
-                                # 在iframe中查找md-editor元素
-                                iframe_content = self.driver.execute_script("""
-                                    // 尝试查找md-editor元素
-                                    const editorElements = document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]');
-                                    if (editorElements.length > 0) {
-                                        return Array.from(editorElements)
-                                            .map(el => el.textContent)
-                                            .join('\\n\\n')
-                                            .trim();
-                                    }
-                                    // 如果没找到特定元素，尝试获取整个body内容
-                                    return document.body.textContent.trim();
-                                """)
-                                
-                                if iframe_content and len(iframe_content) > len(final_response):
-                                    final_response = iframe_content
-                                    logger.info(f"从iframe {i+1}中获取到回复，长度为{len(iframe_content)}")
-                                
-                                # 返回主文档
-                                self.driver.switch_to.default_content()
-                            except Exception as e:
-                                logger.debug(f"处理iframe {i+1}时出错: {e}")
-                                try:
-                                    # 确保返回主文档
-                                    self.driver.switch_to.default_content()
-                                except:
-                                    pass
-                except Exception as e:
-                    logger.debug(f"尝试从iframe获取内容时出错: {e}")
-                    # 确保返回主文档
+                    if max_element:
+                        final_response = max_element.text
+                        self.last_md_editor_id = max_id
+                        logger.debug(f"从md-editor元素 {max_id} 获取到长度为{len(final_response)}的最终回复")
+            except Exception as e:
+                logger.debug(f"使用JavaScript查找md-editor元素时出错: {e}")
+        
+        # 3. 最后尝试使用更广泛的XPath查询作为最终备份
+        if not final_response:
+            try:
+                # 尝试查找带有"preview"或"content"或"response"相关的元素
+                xpath_elements = self.driver.find_elements(By.XPATH, 
+                    "//*[contains(@id, 'preview') or contains(@class, 'preview') or contains(@class, 'content') or contains(@class, 'response')]")
+                
+                for element in xpath_elements:
                     try:
-                        self.driver.switch_to.default_content()
-                    except:
-                        pass
-            
-            logger.info(f"获取到的最终回复长度: {len(final_response)}")
-            
-            if not final_response:
-                raise AssistantError("无法获取AI助手的回复")
+                        if element.is_displayed():
+                            element_text = element.text
+                            if element_text and len(element_text) > len(final_response):
+                                final_response = element_text
+                                logger.debug(f"从XPath元素获取到长度为{len(element_text)}的回复")
+                    except Exception:
+                        continue
+            except Exception as e:
+                logger.debug(f"使用XPath查找元素时出错: {e}")
+        
+        # 4. 检查iframe中是否存在回复内容
+        if not final_response or len(final_response.strip()) < 10:  # 如果回复为空或太短
+            try:
+                # 查找所有iframe
+                iframes = self.driver.find_elements(By.TAG_NAME, "iframe")
                 
-            # 处理最终响应，移除结束标志词
-            current_dialogue_marker = f"[DIALOG_{self.dialog_count}_END]"
-            if current_dialogue_marker in final_response:
-                # 找到标记的位置并截取
-                marker_index = final_response.find(current_dialogue_marker)
-                # 只保留到标记之前的内容
-                final_response = final_response[:marker_index].strip()
-                logger.info(f"已从回复中移除结束标记，处理后的回复长度: {len(final_response)}")
-            
-            return final_response.strip()
+                if iframes:
+                    logger.info(f"找到 {len(iframes)} 个iframe，尝试从中获取回复内容")
+                    
+                    # 记住当前窗口句柄
+                    current_window = self.driver.current_window_handle
+                    
+                    for i, iframe in enumerate(iframes):
+                        try:
+                            # 切换到iframe
+                            self.driver.switch_to.frame(iframe)
+                            logger.debug(f"已切换到iframe {i+1}")
+                            
+                            # 在iframe中查找md-editor元素，取预览HTML在本地转换为Markdown
+                            iframe_content = self.driver.execute_script("""
+                                // 尝试查找md-editor元素
+                                const editorElements = document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]');
+                                if (editorElements.length > 0) {
+                                    return {html: Array.from(editorElements).map(el => el.innerHTML).join('')};
+                                }
+                                // 如果没找到特定元素，尝试获取整个body内容
+                                return document.body.textContent.trim();
+                            """)
+                            if isinstance(iframe_content, dict):
+                                iframe_content = html_to_markdown(iframe_content.get('html', ''))
+                            
+                            if iframe_content and len(iframe_content) > len(final_response):
+                                final_response = iframe_content
+                                logger.info(f"从iframe {i+1}中获取到回复，长度为{len(iframe_content)}")
+                            
+                            # 返回主文档
+                            self.driver.switch_to.default_content()
+                        except Exception as e:
+                            logger.debug(f"处理iframe {i+1}时出错: {e}")
+                            try:
+                                # 确保返回主文档
+                                self.driver.switch_to.default_content()
+                            except:
+                                pass
+            except Exception as e:
+                logger.debug(f"尝试从iframe获取内容时出错: {e}")
+                # 确保返回主文档
+                try:
+                    self.driver.switch_to.default_content()
+                except:
+                    pass
+        
+        logger.info(f"获取到的最终回复长度: {len(final_response)}")
+        
+        if not final_response:
+            raise GenerationTimeoutError("无法获取AI助手的回复")
+            
+        # 处理最终响应，移除结束标志词
+        current_dialogue_marker = f"[DIALOG_{self.dialog_count}_END]"
+        if current_dialogue_marker in final_response:
+            # 找到标记的位置并截取
+            marker_index = final_response.find(current_dialogue_marker)
+            # 只保留到标记之前的内容
+            final_response = final_response[:marker_index].strip()
+            logger.info(f"已从回复中移除结束标记，处理后的回复长度: {len(final_response)}")
+        
+        return final_response.strip()
+    
+    def _progress_text(self, reader: IncrementalTextReader, text: str) -> str:
+        """
+        获取用于进度回调的回复文本，保证与最终回复使用同一种提取方式
+        
+        页面没有Markdown源码时增量读取得到的是纯文本，而最终回复由预览HTML转换为Markdown，
+        两者格式不同；此时有进度回调的轮次改为按最终回复的方式提取，流式输出的内容才是最终回复的前缀。
+        
+        Args:
+            reader (IncrementalTextReader): 本轮的增量读取器
+            text (str): 增量读取得到的文本
             
+        Returns:
+            str: 已生成的回复文本
+        """
+        if reader.from_markdown or self._turn_state.get('on_progress') is None or not reader.element_id:
+            return text
+        try:
+            return extract_markdown(self.driver, reader.element_id) or text
         except Exception as e:
-            raise AssistantError(f"浏览器模拟交互失败: {str(e)}")
\ No newline at end of file
+            logger.debug(f"提取进度回复的Markdown失败: {e}")
+            return text
+    
+    def _report_progress(self, text: str) -> None:
+        """
+        把当前已生成的回复文本交给本轮对话的进度回调
+        
+        Args:
+            text (str): 已生成的回复文本
+        """
+        on_progress = self._turn_state.get('on_progress')
+        if on_progress is None:
+            return
+        try:
+            on_progress(text)
+        except Exception as e:
+            logger.debug(f"回复进度回调出错: {e}")
+    
+    def close(self, keep_browser_open: bool = False) -> None:
+        """
+        关闭助手，释放自己创建的浏览器和HTTP会话
+        
+        Args:
+            keep_browser_open (bool): 是否保持浏览器开启
+        """
+        if self.keepalive is not None:
+            self.keepalive.stop()
+            self.keepalive = None
+        
+        # 确保本次会话的历史已经写入文件
+        if not flush_history():
+            logger.warning("部分对话历史写入失败，将在进程退出时重试")
+        flush_histograms()
+        
+        if self.driver and self.owns_driver and not keep_browser_open:
+            try:
+                self.driver.quit()
+                logger.info("已关闭助手创建的浏览器实例")
+            except Exception as e:
+                logger.error(f"关闭浏览器实例失败: {str(e)}")
+            self.driver = None
+            self.owns_driver = False
+        
+        try:
+            self.http_client.close()
+        except Exception as e:
+            logger.debug(f"关闭HTTP会话失败: {str(e)}")
+        
+        self.is_ready = False
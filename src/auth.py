@@ -10,22 +10,27 @@ import time
 import re
 import json
 import logging
+import threading
 from typing import Dict, Optional, Tuple, Any
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.firefox import GeckoDriverManager
 from webdriver_manager.microsoft import EdgeChromiumDriverManager
 
 from src.utils.logger import get_logger
 from src.utils.http import HTTPClient
+from src.utils.wait import (
+    wait_until, document_ready, input_filled, mark_document, navigation_completed, url_left
+)
 import config
 
 # 获取日志记录器
@@ -35,10 +40,15 @@ class AuthError(Exception):
     """认证错误"""
     pass
 
+class CaptchaRequiredError(AuthError):
+    """登录需要验证码，且当前不允许等待人工输入"""
+    pass
+
 class BUAAAuth:
     """北航统一身份认证"""
     
-    def __init__(self, username: str = None, password: str = None, shared_driver=None):
+    def __init__(self, username: str = None, password: str = None, shared_driver=None,
+                 login_url: str = None, redirect_url: str = None, interactive_captcha: bool = True):
         """
         初始化北航统一身份认证
         
@@ -46,16 +56,31 @@ class BUAAAuth:
             username (str, optional): 用户名（学号），默认从配置中获取
             password (str, optional): 密码，默认从配置中获取
             shared_driver (WebDriver, optional): 共享的浏览器实例，如果提供则使用该实例而不创建新的
+            login_url (str, optional): CAS登录地址，默认从配置中获取（可指向本地CAS模拟服务进行测试）
+            redirect_url (str, optional): 登录后跳转的地址，默认从配置中获取
+            interactive_captcha (bool): 需要验证码时是否回退到浏览器表单等待人工输入；
+                为False时抛出CaptchaRequiredError，供多账号批量任务跳过该账号
         """
         self.username = username or config.AUTH_CONFIG.get('username', '')
         self.password = password or config.AUTH_CONFIG.get('password', '')
-        self.login_url = config.AUTH_CONFIG.get('login_url', 'https://sso.buaa.edu.cn/login')
-        self.redirect_url = config.AUTH_CONFIG.get('redirect_url', 'https://chat.buaa.edu.cn/')
+        self.login_url = login_url or config.AUTH_CONFIG.get('login_url', 'https://sso.buaa.edu.cn/login')
+        self.redirect_url = redirect_url or config.AUTH_CONFIG.get('redirect_url', 'https://chat.buaa.edu.cn/')
         
         self.http_client = HTTPClient()
         self.session = requests.Session()
+        # 复用连接池，避免CAS登录的多次往返重复建立TLS连接
+        pool_size = config.AUTH_CONFIG.get('http_pool_size', 10)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = config.ASSISTANT_CONFIG.get('timeout', 60)
         self.cookies = {}
         self.is_authenticated = False
+        self.captcha_required = False  # 最近一次requests登录是否检测到验证码
+        self.credentials_rejected = False  # 最近一次requests登录是否被CAS明确拒绝（用户名或密码错误）
+        self.interactive_captcha = interactive_captcha
+        self._login_lock = threading.RLock()  # 后台保活线程与对话线程可能同时重新登录
+        self._login_checks: Dict[str, Tuple[float, bool]] = {}  # URL -> (检查时间, 是否需要登录)
         self.driver = shared_driver  # 使用共享的浏览器实例
         if shared_driver:
             logger.info(f"BUAAAuth已接收全局共享浏览器实例，ID: {id(shared_driver)}")
@@ -80,12 +105,22 @@ class BUAAAuth:
         Returns:
             bool: 登录是否成功
         """
+        with self._login_lock:
+            success = self._login_with_requests()
+        if success:
+            self.invalidate_login_cache()
+        return success
+    
+    def _login_with_requests(self) -> bool:
+        """使用requests库完成一次CAS登录（调用方需持有登录锁）"""
         logger.info(f"使用requests登录统一身份认证 (用户: {self.username})")
         
         try:
             # 第一步：访问登录页面获取必要参数
             logger.debug("访问登录页面获取参数")
-            login_response = self.session.get(self.login_url, allow_redirects=True)
+            self.captcha_required = False
+            self.credentials_rejected = False
+            login_response = self.session.get(self.login_url, allow_redirects=True, timeout=self.timeout)
             login_response.raise_for_status()
             
             # 解析HTML
@@ -111,8 +146,10 @@ class BUAAAuth:
             captcha = ''
             
             if need_captcha:
-                logger.warning("登录需要验证码，直接使用requests方式可能会失败")
-                # 这里可以尝试处理验证码，但更建议使用Selenium方式
+                # 验证码只能在浏览器表单中完成，直接提交必然失败，交由调用方回退到浏览器登录
+                logger.warning("登录需要验证码，requests方式无法完成登录")
+                self.captcha_required = True
+                return False
             
             # 第二步：构造登录数据
             login_data = {
@@ -133,16 +170,19 @@ class BUAAAuth:
             login_submit_response = self.session.post(
                 self.login_url,
                 data=login_data,
-                allow_redirects=True
+                allow_redirects=True,
+                timeout=self.timeout
             )
             
             # 第四步：检查登录是否成功
             if "统一身份认证" in login_submit_response.text and "登录" in login_submit_response.text:
                 if "认证信息无效" in login_submit_response.text or "Invalid credentials" in login_submit_response.text:
                     logger.error("统一身份认证登录失败：用户名或密码错误")
+                    self.credentials_rejected = True
                     return False
                 elif "验证码错误" in login_submit_response.text:
                     logger.error("统一身份认证登录失败：验证码错误")
+                    self.captcha_required = True
                     return False
                 else:
                     logger.error("统一身份认证登录失败：未知原因")
@@ -154,8 +194,11 @@ class BUAAAuth:
             # 第五步：如果有重定向URL，尝试访问
             if self.redirect_url:
                 logger.debug(f"访问重定向URL: {self.redirect_url}")
-                redirect_response = self.session.get(self.redirect_url, allow_redirects=True)
+                redirect_response = self.session.get(self.redirect_url, allow_redirects=True, timeout=self.timeout)
                 redirect_response.raise_for_status()
+                if self.is_sso_url(redirect_response.url):
+                    logger.error(f"访问重定向URL后仍停留在登录页面: {redirect_response.url}")
+                    return False
                 self.cookies.update(dict(self.session.cookies))
             
             self.is_authenticated = True
@@ -175,13 +218,14 @@ class BUAAAuth:
         """
         logger.info(f"使用Selenium登录统一身份认证 (用户: {self.username})")
         
+        headless = config.WEBDRIVER_CONFIG.get('headless', False)
+        
         try:
             # 如果没有共享的浏览器实例，则创建一个
             if self.driver is None:
                 logger.warning("没有共享的浏览器实例，将创建新的浏览器实例。这可能导致会话问题！")
                 # 直接使用全局配置，不再创建本地变量
                 browser_type = config.WEBDRIVER_CONFIG.get('browser', 'chrome').lower()
-                headless = config.WEBDRIVER_CONFIG.get('headless', False)
                 
                 # 初始化WebDriver
                 options = None
@@ -267,6 +311,7 @@ class BUAAAuth:
             self.driver.get(self.login_url)
             
             # 等待登录表单加载完成
+            login_frame = None
             try:
                 # 等待登录页面中的iframe加载完成
                 WebDriverWait(self.driver, 10).until(
@@ -276,6 +321,7 @@ class BUAAAuth:
                 # 切换到iframe内部
                 iframe = self.driver.find_element(By.ID, "loginIframe")
                 self.driver.switch_to.frame(iframe)
+                login_frame = iframe
                 
                 # 等待用户名输入框加载完成
                 WebDriverWait(self.driver, 10).until(
@@ -307,22 +353,18 @@ class BUAAAuth:
                 # 检查是否需要输入验证码
                 try:
                     captcha_div = self.driver.find_element(By.ID, "captchaPasswor")
-                    if captcha_div.is_displayed():
-                        logger.info("需要输入验证码")
-                        # 等待用户手动输入验证码
-                        if not headless:
-                            logger.info("请在浏览器窗口中手动输入验证码，然后等待自动提交")
-                            # 等待用户输入验证码
-                            time.sleep(15)
+                    self._wait_for_captcha(captcha_div, headless)
                 except NoSuchElementException:
                     logger.debug("无需输入验证码")
                 
                 # 提交表单
                 login_button = self.driver.find_element(By.CSS_SELECTOR, ".submit-btn")
-                login_button.click()
+                self._mark_before_submit(login_frame)
+                self._click_submit(login_button)
             except NoSuchElementException:
                 # 如果无法在iframe中找到元素，切回主文档尝试
                 self.driver.switch_to.default_content()
+                login_frame = None
                 
                 # 尝试在主文档中填写表单
                 try:
@@ -337,31 +379,21 @@ class BUAAAuth:
                     # 检查是否需要输入验证码
                     try:
                         captcha_div = self.driver.find_element(By.ID, "captchaParent")
-                        if captcha_div.is_displayed():
-                            logger.info("需要输入验证码")
-                            # 等待用户手动输入验证码
-                            if not headless:
-                                logger.info("请在浏览器窗口中手动输入验证码，然后等待自动提交")
-                                # 等待用户输入验证码
-                                time.sleep(15)
+                        self._wait_for_captcha(captcha_div, headless)
                     except NoSuchElementException:
                         logger.debug("无需输入验证码")
                     
                     # 提交表单
                     submit_button = self.driver.find_element(By.NAME, "submit")
-                    submit_button.click()
+                    self._mark_before_submit(None)
+                    self._click_submit(submit_button)
                 except NoSuchElementException as e:
                     logger.error(f"找不到登录表单元素: {str(e)}")
                     self.quit_driver()
                     return False
             
             # 等待登录完成
-            try:
-                # 等待重定向完成
-                WebDriverWait(self.driver, 15).until(
-                    lambda driver: "sso.buaa.edu.cn/login" not in driver.current_url
-                )
-            except TimeoutException:
+            if not self.wait_for_login_redirect(self.driver):
                 # 检查是否失败
                 if "认证信息无效" in self.driver.page_source or "Invalid credentials" in self.driver.page_source:
                     logger.error("统一身份认证登录失败：用户名或密码错误")
@@ -389,9 +421,7 @@ class BUAAAuth:
                 
                 # 等待页面加载完成
                 try:
-                    WebDriverWait(self.driver, 15).until(
-                        lambda driver: driver.execute_script("return document.readyState") == "complete"
-                    )
+                    wait_until(self.driver, document_ready(), 15, name='redirect_page_ready')
                     
                     # 更新cookies
                     selenium_cookies = self.driver.get_cookies()
@@ -412,20 +442,212 @@ class BUAAAuth:
             # 关闭浏览器
             self.quit_driver()
     
+    def _wait_for_captcha(self, captcha_div, headless: bool) -> None:
+        """
+        验证码可见时，等待用户在浏览器中填写验证码
+        
+        Args:
+            captcha_div (WebElement): 验证码区域元素
+            headless (bool): 是否为无头模式
+        """
+        if not captcha_div.is_displayed():
+            return
+        
+        logger.info("需要输入验证码")
+        if headless:
+            logger.warning("无头模式下无法手动输入验证码，登录可能失败")
+            return
+        
+        try:
+            captcha_input = captcha_div.find_element(By.TAG_NAME, "input")
+        except NoSuchElementException:
+            logger.warning("未找到验证码输入框")
+            return
+        
+        logger.info("请在浏览器窗口中手动输入验证码，填写完成后将自动提交")
+        wait_until(
+            self.driver,
+            input_filled(captcha_input, config.WEBDRIVER_CONFIG.get('captcha_min_length', 4)),
+            config.WEBDRIVER_CONFIG.get('captcha_timeout', 120),
+            name='captcha_input',
+            poll_frequency=0.5,
+            raise_on_timeout=False
+        )
+    
+    def _mark_before_submit(self, login_frame=None) -> None:
+        """
+        提交登录表单前在顶层文档设置导航标记
+        
+        Args:
+            login_frame (WebElement, optional): 登录表单所在的iframe，标记后切回该iframe
+        """
+        try:
+            if login_frame is not None:
+                self.driver.switch_to.default_content()
+            mark_document(self.driver)
+        except Exception as e:
+            logger.debug(f"设置导航标记失败: {str(e)}")
+        finally:
+            if login_frame is not None:
+                self.driver.switch_to.frame(login_frame)
+    
+    def _click_submit(self, button) -> None:
+        """
+        点击登录按钮
+        
+        Args:
+            button (WebElement): 登录按钮
+        """
+        try:
+            button.click()
+        except StaleElementReferenceException:
+            # 用户已在填写验证码后自行提交，表单已随页面跳转失效
+            logger.debug("登录表单已提交")
+    
+    def wait_for_login_redirect(self, driver, timeout: float = None) -> bool:
+        """
+        等待提交登录表单后离开统一认证站点
+        
+        先等待提交前设置的导航标记消失（导航事件），若新页面已离开认证站点则立即返回；
+        若仍处于认证站点（多段跳转），在剩余时间内继续等待离开。
+        
+        Args:
+            driver (WebDriver): 浏览器实例
+            timeout (float, optional): 超时时间(秒)，默认使用配置中的login_redirect_timeout
+            
+        Returns:
+            bool: 是否已离开统一认证站点
+        """
+        if timeout is None:
+            timeout = config.WEBDRIVER_CONFIG.get('login_redirect_timeout', 20)
+        deadline = time.monotonic() + timeout
+        
+        try:
+            driver.switch_to.default_content()
+        except Exception:
+            pass
+        
+        new_url = wait_until(driver, navigation_completed(), timeout,
+                             name='sso_navigation', raise_on_timeout=False)
+        if new_url and not self.is_sso_url(new_url):
+            logger.info(f"登录成功，已重定向到: {new_url}")
+            return True
+        
+        remaining = max(0.0, deadline - time.monotonic())
+        new_url = wait_until(driver, url_left(self.is_sso_url), remaining,
+                             name='sso_redirect', raise_on_timeout=False)
+        if new_url:
+            logger.info(f"登录成功，已重定向到: {new_url}")
+            return True
+        return False
+    
     def login(self) -> bool:
         """
         登录统一身份认证
         
         Returns:
             bool: 登录是否成功
+        
+        Raises:
+            CaptchaRequiredError: 需要验证码且不允许等待人工输入
         """
         # 先尝试使用requests登录
         if self.login_with_requests():
             return True
         
+        if self.captcha_required and not self.interactive_captcha:
+            raise CaptchaRequiredError(f"账号 {self.username} 登录需要验证码")
+        
+        # 快速登录模式下，CAS明确拒绝用户名或密码时浏览器表单同样无法登录；
+        # 页面结构变化、无法解析或未知的跳转等其他失败仍回退到浏览器表单
+        if config.AUTH_CONFIG.get('fast_login', True) and self.credentials_rejected:
+            logger.error("用户名或密码错误，跳过浏览器表单登录")
+            return False
+        
         logger.info("使用requests登录失败，尝试使用Selenium登录")
         # 如果失败，尝试使用Selenium登录
-        return self.login_with_selenium()
+        success = self.login_with_selenium()
+        if success:
+            self.invalidate_login_cache()
+        return success
+    
+    def is_sso_url(self, url: str) -> bool:
+        """
+        判断URL是否位于统一认证登录站点
+        
+        Args:
+            url (str): 要检查的URL
+            
+        Returns:
+            bool: 是否为统一认证站点的URL
+        """
+        if not url:
+            return False
+        return urlparse(url).netloc == urlparse(self.login_url).netloc
+    
+    def inject_cookies_into_driver(self, driver, target_url: str = None) -> int:
+        """
+        将requests会话中的认证cookies注入WebDriver
+        
+        WebDriver只允许为当前页面所在的域设置cookie，因此对每个域先打开同域下的
+        轻量资源（favicon），再调用add_cookie。应在首次访问助手页面之前调用，
+        这样浏览器加载页面时即处于登录状态，无需再填写登录表单。
+        
+        Args:
+            driver (WebDriver): 目标浏览器实例
+            target_url (str, optional): 登录后要访问的页面，默认为redirect_url
+            
+        Returns:
+            int: 成功注入的cookie数量
+        """
+        target_url = target_url or self.redirect_url
+        
+        # 已知站点的协议和端口（支持本地CAS模拟服务）
+        origins = {}
+        for url in (self.login_url, self.redirect_url, target_url):
+            parsed = urlparse(url)
+            if parsed.hostname:
+                origins[parsed.hostname] = (parsed.scheme, parsed.netloc)
+        default_scheme = urlparse(target_url).scheme or 'https'
+        
+        # 按域分组
+        cookies_by_host = {}
+        for cookie in self.session.cookies:
+            host = (cookie.domain or urlparse(target_url).hostname or '').lstrip('.')
+            if host:
+                cookies_by_host.setdefault(host, []).append(cookie)
+        
+        injected = 0
+        for host, cookies in cookies_by_host.items():
+            scheme, netloc = origins.get(host, (default_scheme, host))
+            try:
+                current_url = driver.current_url or ''
+                if urlparse(current_url).hostname != host:
+                    driver.get(urlunparse((scheme, netloc, '/favicon.ico', '', '', '')))
+            except Exception as e:
+                logger.warning(f"打开 {host} 以注入cookies失败: {str(e)}")
+                continue
+            
+            for cookie in cookies:
+                selenium_cookie = {
+                    'name': cookie.name,
+                    'value': cookie.value,
+                    'path': cookie.path or '/',
+                    'secure': bool(cookie.secure),
+                }
+                # 仅在cookie显式指定了域时传递domain，主机cookie由当前页面决定
+                if cookie.domain_specified:
+                    selenium_cookie['domain'] = cookie.domain
+                if cookie.expires:
+                    selenium_cookie['expiry'] = int(cookie.expires)
+                try:
+                    driver.add_cookie(selenium_cookie)
+                    injected += 1
+                except Exception as e:
+                    logger.debug(f"注入cookie {cookie.name} ({host}) 失败: {str(e)}")
+        
+        logger.info(f"已向浏览器注入 {injected} 个认证cookie")
+        return injected
     
     def get_cookies(self) -> Dict[str, str]:
         """
@@ -474,10 +696,34 @@ class BUAAAuth:
         
         return self.session
     
-    def is_login_required(self, url: str) -> bool:
+    def is_login_required(self, url: str, use_cache: bool = True) -> bool:
         """
         检查是否需要登录
         
+        结果在 AUTH_CONFIG['login_check_ttl'] 秒内缓存，后台保活线程定期刷新缓存，
+        对话线程调用时通常不需要发起请求。
+        
+        Args:
+            url (str): 要检查的URL
+            use_cache (bool): 是否使用缓存的检查结果
+            
+        Returns:
+            bool: 是否需要登录
+        """
+        ttl = config.AUTH_CONFIG.get('login_check_ttl', 60)
+        if use_cache:
+            cached = self._login_checks.get(url)
+            if cached and time.monotonic() - cached[0] < ttl:
+                return cached[1]
+        
+        required = self._check_login_required(url)
+        self._login_checks[url] = (time.monotonic(), required)
+        return required
+    
+    def _check_login_required(self, url: str) -> bool:
+        """
+        请求URL（不跟随重定向）判断会话是否已失效，同时起到保持会话活跃的作用
+        
         Args:
             url (str): 要检查的URL
             
@@ -485,7 +731,7 @@ class BUAAAuth:
             bool: 是否需要登录
         """
         try:
-            response = self.session.get(url, allow_redirects=False)
+            response = self.session.get(url, allow_redirects=False, timeout=self.timeout)
             # 如果状态码是302或301，检查是否重定向到登录页面
             if response.status_code in (301, 302):
                 location = response.headers.get('Location', '')
@@ -500,6 +746,21 @@ class BUAAAuth:
             logger.error(f"检查登录状态失败: {str(e)}")
             return True
     
+    def invalidate_login_cache(self) -> None:
+        """清空登录状态检查的缓存（登录成功或检测到会话失效后调用）"""
+        self._login_checks.clear()
+    
+    def cookie_expiry(self) -> Optional[float]:
+        """
+        获取会话中最早过期的持久cookie的过期时间
+        
+        Returns:
+            float or None: UNIX时间戳，只有会话cookie（无过期时间）时返回None
+        """
+        self.session.cookies.clear_expired_cookies()
+        expiries = [cookie.expires for cookie in self.session.cookies if cookie.expires]
+        return min(expiries) if expiries else None
+    
     def quit_driver(self) -> None:
         """关闭WebDriver"""
         # 只关闭自己创建的浏览器实例
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多账号凭据池模块
+从环境变量文件或本地凭据库加载多个统一认证账号，每个工作线程独占一个账号，
+使用独立的cookies和浏览器配置目录；记录每个账号的吞吐量，用于按速度分配问题。
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+
+from dotenv import dotenv_values
+
+from src.utils.logger import get_logger
+from src.utils.filelock import FileLock
+from src.utils.circuit_breaker import CircuitOpenError
+from src.utils.deadline import DeadlineExceeded
+from src.utils.recovery import iter_causes
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class CredentialError(Exception):
+    """凭据加载或保存失败"""
+    pass
+
+
+def is_account_failure(error: BaseException) -> bool:
+    """
+    判断对话失败是否应计入账号的连续失败
+
+    熔断拒绝和调用方截止时间耗尽与账号本身无关，计入会让一个账号的故障扩散到整个账号池。
+
+    Args:
+        error (BaseException): 对话失败的异常（会沿异常链查找根因）
+
+    Returns:
+        bool: 是否计入账号失败
+    """
+    return not any(isinstance(cause, (CircuitOpenError, DeadlineExceeded)) for cause in iter_causes(error))
+
+
+class Account:
+    """一个统一认证账号及其运行状态"""
+
+    ACTIVE = 'active'
+    CAPTCHA = 'captcha'  # 需要验证码，无法自动登录
+    LOCKED = 'locked'    # 登录失败或连续对话失败，冷却中
+
+    def __init__(self, username: str, password: str, profile_root: Optional[str] = None):
+        """
+        初始化账号
+
+        Args:
+            username (str): 用户名（学号）
+            password (str): 密码
+            profile_root (str, optional): 浏览器配置目录的根目录，每个账号使用其下以用户名命名的子目录
+        """
+        self.username = username
+        self.password = password
+        profile_root = profile_root or config.CREDENTIAL_CONFIG.get('profile_root')
+        self.profile_dir = os.path.join(profile_root, re.sub(r'[^\w.-]', '_', username)) if profile_root else None
+
+        self.status = self.ACTIVE
+        self.cooldown_until = 0.0
+        self.in_use = False
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.consecutive_failures = 0
+        self.throughput = None  # 每秒完成的问题数（指数滑动平均），None表示尚无观测
+
+    @property
+    def available(self) -> bool:
+        """账号当前是否可用（未占用、未处于冷却期）"""
+        if self.in_use:
+            return False
+        if self.status != self.ACTIVE and time.time() < self.cooldown_until:
+            return False
+        return True
+
+    def __repr__(self) -> str:
+        return f"Account({self.username}, status={self.status})"
+
+
+class CredentialPool:
+    """
+    账号池
+
+    账号来源（按顺序合并，用户名相同的以先出现的为准）：
+    1. 环境变量文件中的 BUAA_ACCOUNTS=学号1:密码1,学号2:密码2 或 BUAA_ACCOUNT_<n>=学号:密码
+    2. 本地凭据库（JSON，可用 BUAA_CREDENTIAL_KEY 指定的Fernet密钥加密）
+    3. AUTH_CONFIG中的单个账号
+    """
+
+    def __init__(self, accounts: List[Account], stats_file: Optional[str] = None):
+        """
+        初始化账号池
+
+        Args:
+            accounts (list): 账号列表
+            stats_file (str, optional): 保存各账号历史吞吐量的文件，默认使用配置
+        """
+        self.accounts = accounts
+        self.stats_file = stats_file or config.CREDENTIAL_CONFIG.get('stats_file')
+        self._lock = threading.Lock()
+        self._load_stats()
+
+    def __len__(self) -> int:
+        return len(self.accounts)
+
+    @staticmethod
+    def parse_env_accounts(values: Dict[str, Optional[str]]) -> List[Account]:
+        """
+        从环境变量中解析账号
+
+        Args:
+            values (dict): 环境变量
+
+        Returns:
+            list: 账号列表
+        """
+        entries = []
+        if values.get('BUAA_ACCOUNTS'):
+            entries.extend(values['BUAA_ACCOUNTS'].split(','))
+        numbered = sorted((key for key in values if re.fullmatch(r'BUAA_ACCOUNT_\d+', key)),
+                          key=lambda key: int(key.rsplit('_', 1)[1]))
+        entries.extend(values[key] for key in numbered if values[key])
+
+        accounts = []
+        for entry in entries:
+            username, sep, password = entry.strip().partition(':')
+            if not sep or not username or not password:
+                logger.warning("忽略格式错误的账号配置，应为 学号:密码")
+                continue
+            accounts.append(Account(username.strip(), password))
+        return accounts
+
+    @staticmethod
+    def _fernet(key: Optional[str]):
+        """根据密钥创建Fernet加解密器，未提供密钥时返回None"""
+        if not key:
+            return None
+        from cryptography.fernet import Fernet
+        return Fernet(key.encode() if isinstance(key, str) else key)
+
+    @classmethod
+    def load_store(cls, path: str, key: Optional[str] = None) -> List[Account]:
+        """
+        从本地凭据库加载账号
+
+        Args:
+            path (str): 凭据库文件路径
+            key (str, optional): Fernet密钥，凭据库加密时必须提供
+
+        Returns:
+            list: 账号列表
+
+        Raises:
+            CredentialError: 凭据库无法解密或解析
+        """
+        if not path or not os.path.exists(path):
+            return []
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            fernet = cls._fernet(key)
+            if fernet is not None:
+                data = fernet.decrypt(data)
+            entries = json.loads(data.decode('utf-8'))
+        except Exception as e:
+            raise CredentialError(f"读取凭据库失败: {path}: {str(e)}") from e
+        return [Account(username, password) for username, password in entries.items()]
+
+    @classmethod
+    def save_store(cls, path: str, credentials: Dict[str, str], key: Optional[str] = None) -> None:
+        """
+        保存账号到本地凭据库（会覆盖原文件）
+
+        Args:
+            path (str): 凭据库文件路径
+            credentials (dict): 用户名 -> 密码
+            key (str, optional): Fernet密钥，提供时加密保存
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        data = json.dumps(credentials, ensure_ascii=False).encode('utf-8')
+        fernet = cls._fernet(key)
+        if fernet is not None:
+            data = fernet.encrypt(data)
+        else:
+            logger.warning(f"未设置加密密钥，账号密码以明文保存到 {path}，请勿将其提交到版本库")
+        with open(path, 'wb') as f:
+            f.write(data)
+        try:
+            os.chmod(path, 0o600)
+        except OSError:
+            pass
+
+    @classmethod
+    def load(cls, env_file: Optional[str] = None, store_file: Optional[str] = None) -> 'CredentialPool':
+        """
+        按配置加载账号池
+
+        Args:
+            env_file (str, optional): 环境变量文件，默认使用配置
+            store_file (str, optional): 本地凭据库，默认使用配置
+
+        Returns:
+            CredentialPool: 账号池
+
+        Raises:
+            CredentialError: 没有可用的账号
+        """
+        credential_config = config.CREDENTIAL_CONFIG
+        env_file = env_file or credential_config.get('env_file')
+        store_file = store_file or credential_config.get('store_file')
+
+        values: Dict[str, Optional[str]] = dict(os.environ)
+        if env_file and os.path.exists(env_file):
+            values.update(dotenv_values(env_file))
+
+        accounts = cls.parse_env_accounts(values)
+        accounts += cls.load_store(store_file, values.get('BUAA_CREDENTIAL_KEY'))
+        if config.AUTH_CONFIG.get('username') and config.AUTH_CONFIG.get('password'):
+            accounts.append(Account(config.AUTH_CONFIG['username'], config.AUTH_CONFIG['password']))
+
+        unique: Dict[str, Account] = {}
+        for account in accounts:
+            unique.setdefault(account.username, account)
+        if not unique:
+            raise CredentialError("没有可用的账号，请配置 BUAA_ACCOUNTS 或本地凭据库")
+
+        logger.info(f"已加载 {len(unique)} 个账号")
+        return cls(list(unique.values()))
+
+    def acquire(self) -> Optional[Account]:
+        """
+        占用一个可用账号，优先选择历史吞吐量最高的账号
+
+        Returns:
+            Account or None: 没有可用账号时返回None
+        """
+        with self._lock:
+            candidates = [account for account in self.accounts if account.available]
+            if not candidates:
+                return None
+            account = max(candidates, key=lambda a: a.throughput or 0.0)
+            account.in_use = True
+            account.status = Account.ACTIVE
+            return account
+
+    def release(self, account: Account) -> None:
+        """
+        归还账号
+
+        Args:
+            account (Account): 账号
+        """
+        with self._lock:
+            account.in_use = False
+        self._save_stats()
+
+    def record(self, account: Account, seconds: float, questions: int = 1, success: bool = True,
+               account_failure: bool = True) -> None:
+        """
+        记录一次处理结果，更新账号吞吐量；连续失败达到阈值时让账号进入冷却
+
+        Args:
+            account (Account): 账号
+            seconds (float): 处理耗时(秒)
+            questions (int): 本次处理的问题数
+            success (bool): 是否成功
+            account_failure (bool): 失败是否归因于账号（见is_account_failure），
+                为False时不更新吞吐量，也不计入连续失败
+        """
+        credential_config = config.CREDENTIAL_CONFIG
+        alpha = credential_config.get('throughput_alpha', 0.3)
+        with self._lock:
+            account.busy_seconds += seconds
+            if not success and not account_failure:
+                return
+            if success:
+                account.completed += questions
+                account.consecutive_failures = 0
+                rate = questions / max(seconds, 1e-3)
+                account.throughput = rate if account.throughput is None else \
+                    (1 - alpha) * account.throughput + alpha * rate
+                return
+
+            account.consecutive_failures += 1
+            if account.consecutive_failures >= credential_config.get('max_consecutive_failures', 3):
+                self._suspend(account, Account.LOCKED)
+
+    def mark_unavailable(self, account: Account, status: str) -> None:
+        """
+        标记账号不可用（如需要验证码、登录失败），冷却期内不会再被分配
+
+        Args:
+            account (Account): 账号
+            status (str): Account.CAPTCHA 或 Account.LOCKED
+        """
+        with self._lock:
+            self._suspend(account, status)
+
+    def _suspend(self, account: Account, status: str) -> None:
+        """让账号进入冷却（调用方需持有锁）"""
+        account.status = status
+        account.cooldown_until = time.time() + config.CREDENTIAL_CONFIG.get('cooldown', 1800)
+        logger.warning(f"账号 {account.username} 暂停使用 ({status})")
+
+    def speeds(self, accounts: List[Account]) -> List[float]:
+        """
+        获取账号的相对速度，用于按吞吐量分配问题；尚无观测的账号按已知账号的平均速度计算
+
+        Args:
+            accounts (list): 账号列表
+
+        Returns:
+            list: 相对速度（平均为1）
+        """
+        known = [account.throughput for account in accounts if account.throughput]
+        if not known:
+            return [1.0] * len(accounts)
+        average = sum(known) / len(known)
+        return [(account.throughput or average) / average for account in accounts]
+
+    def _load_stats(self) -> None:
+        """读取各账号的历史吞吐量和冷却状态"""
+        if not self.stats_file or not os.path.exists(self.stats_file):
+            return
+        try:
+            with FileLock(self.stats_file), open(self.stats_file, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+        except Exception as e:
+            logger.debug(f"读取账号吞吐量记录失败: {e}")
+            return
+        now = time.time()
+        for account in self.accounts:
+            entry = stats.get(account.username)
+            if not entry:
+                continue
+            account.throughput = entry.get('throughput')
+            # 上次运行中需要验证码或被锁定的账号在冷却期内继续暂停
+            if entry.get('cooldown_until', 0) > now:
+                account.status = entry.get('status', Account.LOCKED)
+                account.cooldown_until = entry['cooldown_until']
+
+    def _save_stats(self) -> None:
+        """保存各账号的吞吐量和冷却状态（与文件中其他账号的记录合并）"""
+        if not self.stats_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.stats_file)), exist_ok=True)
+            with FileLock(self.stats_file):
+                stats = {}
+                if os.path.exists(self.stats_file):
+                    with open(self.stats_file, 'r', encoding='utf-8') as f:
+                        stats = json.load(f)
+                with self._lock:
+                    for account in self.accounts:
+                        if account.throughput or account.status != Account.ACTIVE:
+                            stats[account.username] = {'throughput': account.throughput,
+                                                       'status': account.status,
+                                                       'cooldown_until': account.cooldown_until,
+                                                       'updated_at': time.time()}
+                with open(self.stats_file, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.debug(f"保存账号吞吐量记录失败: {e}")
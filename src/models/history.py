@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史存储模块
+每个进程只写入自己的分片文件（在文件锁保护下原子替换），多个进程的写入互不阻塞；
+读取时合并主历史文件和所有分片，压缩时把分片并入主历史文件后删除分片。
+"""
+
+import os
+import json
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+
+from src.models.legacy_history import read_legacy_conversation
+from src.utils.filelock import FileLock
+from src.utils.logger import get_logger
+from src.utils import metrics
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+_SHARD_SUFFIX = '.json'
+
+
+def _read_json(file_path: str) -> Dict[str, Any]:
+    """读取历史文件，文件不存在或无法解析时返回空字典"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"读取历史文件 {file_path} 失败: {str(e)}")
+        return {}
+
+
+def _atomic_write(file_path: str, data: Dict[str, Any]) -> None:
+    """写入临时文件后原子替换目标文件（调用方需持有文件锁）"""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, file_path)
+
+
+def _newer(candidate: Dict[str, Any], current: Optional[Dict[str, Any]]) -> bool:
+    """同一对话出现在多个文件中时，以更新时间较晚（相同则消息较多）的为准"""
+    if current is None:
+        return True
+    return ((candidate.get('updated_at') or 0), len(candidate.get('messages') or ())) >= \
+        ((current.get('updated_at') or 0), len(current.get('messages') or ()))
+
+
+def merge_histories(target: Dict[str, Any], source: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把source中的对话合并到target，同一对话保留较新的版本
+
+    Args:
+        target (dict): 对话ID -> 对话字典，原地修改
+        source (dict): 对话ID -> 对话字典
+
+    Returns:
+        dict: target
+    """
+    for conversation_id, data in source.items():
+        if _newer(data, target.get(conversation_id)):
+            target[conversation_id] = data
+    return target
+
+
+def write_histories(file_path: str, updates: Dict[str, Dict[str, Any]]) -> None:
+    """
+    把若干对话合并写入单个历史文件
+
+    在文件锁内读取现有记录、更新对应对话后写入临时文件再原子替换，
+    多个线程或进程同时保存时不会互相覆盖，读取方也不会读到写了一半的文件。
+
+    Args:
+        file_path (str): 历史文件路径
+        updates (dict): 对话ID -> 对话字典
+    """
+    # 确保目录存在
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+
+    with FileLock(file_path):
+        histories = _read_json(file_path)
+        histories.update(updates)
+        _atomic_write(file_path, histories)
+
+
+def _pid_alive(pid: int) -> bool:
+    """本机上的进程是否仍在运行（非POSIX系统无法可靠判断，视为运行中）"""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class HistoryStore:
+    """
+    分片的对话历史存储
+
+    主历史文件保存压缩后的对话，分片目录中每个进程一个分片（主机名-进程号.json），
+    分片只包含该进程保存过的对话。读取时以更新时间较晚的版本为准合并所有文件。
+    """
+
+    def __init__(self, base_file: str, shard_dir: Optional[str] = None,
+                 compact_threshold: Optional[int] = None):
+        """
+        初始化存储
+
+        Args:
+            base_file (str): 主历史文件路径
+            shard_dir (str, optional): 分片目录，默认为主历史文件旁的 <文件名>_shards 目录
+            compact_threshold (int, optional): 分片数量达到多少时自动压缩，默认使用配置，0表示不自动压缩
+        """
+        message_config = config.MESSAGE_CONFIG
+        self.base_file = base_file
+        self.shard_dir = shard_dir or os.path.splitext(base_file)[0] + '_shards'
+        if compact_threshold is None:
+            compact_threshold = message_config.get('compact_threshold', 16)
+        self.compact_threshold = compact_threshold
+
+    def shard_path(self) -> str:
+        """
+        当前进程的分片文件路径（按调用时的进程号计算，fork出的子进程自动使用新分片）
+
+        Returns:
+            str: 分片文件路径
+        """
+        return os.path.join(self.shard_dir, f"{socket.gethostname()}-{os.getpid()}{_SHARD_SUFFIX}")
+
+    def shard_files(self) -> List[str]:
+        """
+        列出所有分片文件
+
+        Returns:
+            list: 分片文件路径列表
+        """
+        try:
+            names = os.listdir(self.shard_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(os.path.join(self.shard_dir, name) for name in names
+                      if name.endswith(_SHARD_SUFFIX))
+
+    def write(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """
+        把若干对话写入当前进程的分片
+
+        Args:
+            updates (dict): 对话ID -> 对话字典
+        """
+        if not updates:
+            return
+        os.makedirs(self.shard_dir, exist_ok=True)
+        shard = self.shard_path()
+        # 压缩可能在两次写入之间合并并删除本分片，因此每次都在锁内重新读取
+        with FileLock(shard):
+            histories = _read_json(shard)
+            histories.update(updates)
+            _atomic_write(shard, histories)
+        metrics.increment('history.shard_writes')
+
+        if self.compact_threshold and len(self.shard_files()) >= self.compact_threshold:
+            try:
+                self.compact(timeout=1.0)
+            except Exception as e:
+                logger.debug(f"自动压缩对话历史未完成: {str(e)}")
+
+    def read_all(self) -> Dict[str, Dict[str, Any]]:
+        """
+        读取主历史文件和所有分片合并后的对话
+
+        先读分片再读主文件：压缩在写完主文件后才删除分片，
+        因此读取期间即使发生压缩，已删除分片中的对话也一定出现在随后读取的主文件中。
+
+        Returns:
+            dict: 对话ID -> 对话字典
+        """
+        histories: Dict[str, Dict[str, Any]] = {}
+        for shard in self.shard_files():
+            merge_histories(histories, _read_json(shard))
+        return merge_histories(histories, _read_json(self.base_file))
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取一个对话
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            dict or None: 对话字典，不存在时返回None
+        """
+        found = None
+        for shard in self.shard_files():
+            data = _read_json(shard).get(conversation_id)
+            if data is not None and _newer(data, found):
+                found = data
+        # 主历史文件可能很大，流式查找，只解析这一个对话
+        data = read_legacy_conversation(self.base_file, conversation_id)
+        if data is not None and _newer(data, found):
+            found = data
+        return found
+
+    def compact(self, timeout: Optional[float] = None) -> int:
+        """
+        把所有分片并入主历史文件并删除已合并的分片
+
+        持有主文件锁和各分片的锁期间完成合并，写入分片的进程会短暂等待；
+        之后再次写入时从空分片开始。
+
+        Args:
+            timeout (float, optional): 获取文件锁的超时时间(秒)，默认使用FileLock的默认值
+
+        Returns:
+            int: 合并的分片数量
+
+        Raises:
+            FileLockTimeout: 在超时时间内无法获得文件锁
+        """
+        lock_kwargs = {} if timeout is None else {'timeout': timeout}
+        os.makedirs(os.path.dirname(self.base_file) or '.', exist_ok=True)
+        with FileLock(self.base_file, **lock_kwargs):
+            shards = self.shard_files()
+            if not shards:
+                return 0
+            locks = []
+            try:
+                for shard in shards:
+                    lock = FileLock(shard, **lock_kwargs)
+                    lock.acquire()
+                    locks.append(lock)
+
+                histories = _read_json(self.base_file)
+                for shard in shards:
+                    merge_histories(histories, _read_json(shard))
+                _atomic_write(self.base_file, histories)
+
+                for shard in shards:
+                    try:
+                        os.remove(shard)
+                    except FileNotFoundError:
+                        pass
+            finally:
+                for lock in locks:
+                    lock.release()
+            self._remove_stale_locks()
+
+        metrics.increment('history.compactions')
+        logger.info(f"已将 {len(shards)} 个历史分片合并到 {self.base_file}")
+        return len(shards)
+
+    def _remove_stale_locks(self) -> None:
+        """删除本机已退出进程遗留的分片锁文件"""
+        host = socket.gethostname()
+        try:
+            names = os.listdir(self.shard_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(_SHARD_SUFFIX + '.lock'):
+                continue
+            owner = name[:-len(_SHARD_SUFFIX + '.lock')]
+            owner_host, _, pid = owner.rpartition('-')
+            if owner_host != host or not pid.isdigit() or _pid_alive(int(pid)):
+                continue
+            if os.path.exists(os.path.join(self.shard_dir, owner + _SHARD_SUFFIX)):
+                continue
+            try:
+                os.remove(os.path.join(self.shard_dir, name))
+            except OSError:
+                pass
+
+
+def get_history_store(file_path: Optional[str] = None) -> Optional[HistoryStore]:
+    """
+    获取历史文件对应的分片存储
+
+    Args:
+        file_path (str, optional): 主历史文件路径，默认使用配置中的历史文件
+
+    Returns:
+        HistoryStore or None: 未启用分片时返回None
+    """
+    message_config = config.MESSAGE_CONFIG
+    if not message_config.get('history_shards', True):
+        return None
+    if file_path is None or file_path == message_config.get('history_file'):
+        return HistoryStore(message_config.get('history_file'), message_config.get('history_shard_dir'))
+    return HistoryStore(file_path)
+
+
+def save_histories(updates: Dict[str, Dict[str, Any]], file_path: Optional[str] = None) -> None:
+    """
+    保存若干对话：启用分片时写入当前进程的分片，否则直接写入历史文件
+
+    Args:
+        updates (dict): 对话ID -> 对话字典
+        file_path (str, optional): 主历史文件路径，默认使用配置中的历史文件
+    """
+    store = get_history_store(file_path)
+    if store is not None:
+        store.write(updates)
+    else:
+        write_histories(file_path or config.MESSAGE_CONFIG.get('history_file'), updates)
+
+
+def load_histories(file_path: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    读取所有对话（启用分片时合并主历史文件和所有分片）
+
+    Args:
+        file_path (str, optional): 主历史文件路径，默认使用配置中的历史文件
+
+    Returns:
+        dict: 对话ID -> 对话字典
+    """
+    store = get_history_store(file_path)
+    if store is not None:
+        return store.read_all()
+    return _read_json(file_path or config.MESSAGE_CONFIG.get('history_file'))
+
+
+def load_history(conversation_id: str, file_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    读取一个对话（主历史文件流式查找，不解析其他对话）
+
+    Args:
+        conversation_id (str): 对话ID
+        file_path (str, optional): 主历史文件路径，默认使用配置中的历史文件
+
+    Returns:
+        dict or None: 对话字典，不存在时返回None
+    """
+    store = get_history_store(file_path)
+    if store is not None:
+        return store.get(conversation_id)
+    return read_legacy_conversation(file_path or config.MESSAGE_CONFIG.get('history_file'), conversation_id)
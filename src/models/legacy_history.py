@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+旧版历史文件流式读取模块
+旧版 history.json 是一个 {对话ID: 对话字典} 的JSON对象。本模块通过内存映射扫描文件，
+只定位每个对话的字节范围，需要时才解析单个对话，读取大文件时内存占用与单个对话的大小相当；
+并提供按对话逐个迁移到其他存储格式的工具。
+"""
+
+import os
+import re
+import json
+import mmap
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from src.utils.logger import get_logger
+
+# 获取日志记录器
+logger = get_logger()
+
+# json.dump(indent=2) 写出的顶层键：换行后恰好两个空格缩进，JSON字符串内部的换行都已转义，不会误匹配
+_INDENTED_KEY = re.compile(rb'\n  "((?:[^"\\\n]|\\.)*)": ')
+# 通用扫描：字符串（跳过其中的括号）或括号
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+_WHITESPACE = b' \t\r\n'
+
+
+class LegacyHistoryError(Exception):
+    """旧版历史文件格式错误"""
+    pass
+
+
+def _decode_key(raw: bytes) -> str:
+    """解码JSON字符串的内容部分"""
+    return json.loads(b'"' + raw + b'"')
+
+
+class LegacyHistoryReader:
+    """
+    旧版历史文件的流式读取器
+
+    支持with语句；文件由 json.dump(indent=2) 写出时直接按缩进定位顶层键，
+    其他排版（如压缩成一行）时按字符串和括号扫描，两种方式都不会一次性解析整个文件。
+    """
+
+    def __init__(self, file_path: str):
+        """
+        打开历史文件
+
+        Args:
+            file_path (str): 历史文件路径
+        """
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._size = size
+
+    def close(self) -> None:
+        """关闭文件"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self) -> 'LegacyHistoryReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _skip_whitespace(self, pos: int) -> int:
+        while pos < self._size and self._map[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def _object_start(self) -> Optional[int]:
+        """顶层对象'{'之后的位置，空文件返回None"""
+        if self._map is None:
+            return None
+        pos = self._skip_whitespace(0)
+        if self._map[pos:pos + 3] == b'\xef\xbb\xbf':
+            pos = self._skip_whitespace(pos + 3)
+        if pos >= self._size:
+            return None
+        if self._map[pos:pos + 1] != b'{':
+            raise LegacyHistoryError(f"{self.file_path} 不是JSON对象")
+        return pos + 1
+
+    def spans(self) -> Iterator[Tuple[str, int, int]]:
+        """
+        按文件顺序遍历各对话在文件中的字节范围，不解析对话内容
+
+        Yields:
+            tuple: (对话ID, 起始偏移, 结束偏移)
+
+        Raises:
+            LegacyHistoryError: 文件不是JSON对象或结构不完整
+        """
+        start = self._object_start()
+        if start is None:
+            return
+        if self._map[start:start + 4] == b'\n  "':
+            yield from self._indented_spans(start)
+        else:
+            yield from self._scanned_spans(start)
+
+    def _indented_spans(self, start: int) -> Iterator[Tuple[str, int, int]]:
+        """按两个空格缩进定位顶层键；每个值延伸到下一个键之前的逗号"""
+        previous: Optional[Tuple[str, int]] = None
+        for match in _INDENTED_KEY.finditer(self._map, start):
+            if previous is not None:
+                # 上一个值到本行之前的逗号为止
+                end = self._map.rfind(b',', previous[1], match.start())
+                if end < 0:
+                    raise LegacyHistoryError(f"{self.file_path} 在偏移 {match.start()} 处格式错误")
+                yield previous[0], previous[1], end
+            previous = (_decode_key(match.group(1)), match.end())
+        if previous is not None:
+            end = self._map.rfind(b'}', previous[1])
+            if end < 0:
+                raise LegacyHistoryError(f"{self.file_path} 结构不完整")
+            yield previous[0], previous[1], end
+
+    def _scanned_spans(self, start: int) -> Iterator[Tuple[str, int, int]]:
+        """逐个扫描字符串和括号，按嵌套深度找出顶层键值对"""
+        depth = 0
+        key: Optional[str] = None
+        value_start = 0
+        for match in _TOKEN.finditer(self._map, start):
+            token = match.group()
+            if depth == 0:
+                if token == b'}':
+                    return
+                if key is None:
+                    if token[:1] != b'"':
+                        raise LegacyHistoryError(f"{self.file_path} 在偏移 {match.start()} 处格式错误")
+                    key = _decode_key(token[1:-1])
+                    value_start = self._skip_whitespace(self._map.find(b':', match.end()) + 1)
+                    continue
+            if token in (b'{', b'['):
+                depth += 1
+            elif token in (b'}', b']'):
+                depth -= 1
+                if depth == 0:
+                    yield key, value_start, match.end()
+                    key = None
+            elif depth == 0:
+                # 值本身是字符串
+                yield key, value_start, match.end()
+                key = None
+        raise LegacyHistoryError(f"{self.file_path} 结构不完整")
+
+    def _parse(self, start: int, end: int) -> Any:
+        return json.loads(self._map[start:end].decode('utf-8'))
+
+    def keys(self) -> Iterator[str]:
+        """
+        遍历所有对话ID
+
+        Yields:
+            str: 对话ID
+        """
+        for conversation_id, _, _ in self.spans():
+            yield conversation_id
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        逐个解析并遍历对话，同一时间只有一个对话在内存中
+
+        Yields:
+            tuple: (对话ID, 对话字典)
+        """
+        for conversation_id, start, end in self.spans():
+            yield conversation_id, self._parse(start, end)
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查找一个对话，只解析该对话
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            dict or None: 对话字典，不存在时返回None（同一ID出现多次时与json.load一致取最后一个）
+        """
+        found = None
+        for key, start, end in self.spans():
+            if key == conversation_id:
+                found = (start, end)
+        return self._parse(*found) if found else None
+
+
+def iter_legacy_history(file_path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    逐个读取旧版历史文件中的对话，文件不存在时不产生任何对话
+
+    Args:
+        file_path (str): 历史文件路径
+
+    Yields:
+        tuple: (对话ID, 对话字典)
+    """
+    if not os.path.exists(file_path):
+        return
+    with LegacyHistoryReader(file_path) as reader:
+        yield from reader.items()
+
+
+def read_legacy_conversation(file_path: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    从旧版历史文件中读取一个对话
+
+    Args:
+        file_path (str): 历史文件路径
+        conversation_id (str): 对话ID
+
+    Returns:
+        dict or None: 对话字典，文件或对话不存在、文件无法解析时返回None
+    """
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with LegacyHistoryReader(file_path) as reader:
+            return reader.get(conversation_id)
+    except Exception as e:
+        logger.warning(f"读取历史文件 {file_path} 失败: {str(e)}")
+        return None
+
+
+class JsonLinesSink:
+    """
+    迁移目标：每行一个 {"conversation_id": ..., ...} 对话的JSON Lines文件
+
+    写入临时文件，全部完成后再替换目标文件，迁移中断不会留下不完整的目标文件。
+    """
+
+    def __init__(self, file_path: str):
+        """
+        打开目标文件
+
+        Args:
+            file_path (str): 目标文件路径
+        """
+        self.file_path = file_path
+        self._tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+
+    def __call__(self, conversation_id: str, data: Dict[str, Any]) -> None:
+        record = dict(data)
+        record['conversation_id'] = conversation_id
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write('\n')
+
+    def close(self, commit: bool = True) -> None:
+        """
+        关闭文件
+
+        Args:
+            commit (bool): 是否用临时文件替换目标文件，False时丢弃临时文件
+        """
+        self._file.close()
+        if commit:
+            os.replace(self._tmp_path, self.file_path)
+        else:
+            os.remove(self._tmp_path)
+
+
+def migrate_legacy_history(file_path: str, sink: Callable[[str, Dict[str, Any]], None],
+                           progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    一次遍历旧版历史文件，把对话逐个交给sink写入新的存储格式
+
+    Args:
+        file_path (str): 旧版历史文件路径
+        sink (callable): 接收 (对话ID, 对话字典) 的写入函数，如 JsonLinesSink
+        progress (callable, optional): 每迁移1000个对话调用一次，参数为已迁移数量
+
+    Returns:
+        int: 迁移的对话数量
+    """
+    count = 0
+    for conversation_id, data in iter_legacy_history(file_path):
+        sink(conversation_id, data)
+        count += 1
+        if progress is not None and count % 1000 == 0:
+            progress(count)
+    logger.info(f"已从 {file_path} 迁移 {count} 个对话")
+    return count
+
+
+def migrate_to_jsonl(file_path: str, destination: str) -> int:
+    """
+    把旧版历史文件迁移为JSON Lines文件
+
+    Args:
+        file_path (str): 旧版历史文件路径
+        destination (str): 目标文件路径
+
+    Returns:
+        int: 迁移的对话数量
+    """
+    sink = JsonLinesSink(destination)
+    try:
+        count = migrate_legacy_history(file_path, sink)
+    except BaseException:
+        sink.close(commit=False)
+        raise
+    sink.close()
+    return count
@@ -4,19 +4,24 @@
 """
 消息模型模块
 定义AI助手对话中的消息数据结构
+
+Message和Conversation使用__slots__，消息的元数据字典在首次访问时才创建；
+从字典加载对话时直接创建Message对象，不保留原始的消息字典。
 """
 
-import json
+import sys
 import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
-import os
+from typing import Dict, Iterator, List, Optional, Any, Union, Tuple
 
+from src.models.history import save_histories, load_histories, load_history
 import config
 
 class Message:
     """AI助手消息模型"""
     
+    __slots__ = ('role', 'content', 'message_id', 'timestamp', '_metadata')
+    
     def __init__(
         self,
         role: str,
@@ -33,13 +38,41 @@ class Message:
             content (str): 消息内容
             message_id (str, optional): 消息ID，默认为None自动生成
             timestamp (float, optional): 时间戳，默认为当前时间
-            metadata (dict, optional): 元数据，默认为空字典
+            metadata (dict, optional): 元数据，默认为None，首次访问时创建空字典
         """
-        self.role = role
+        # 角色只有少数几种取值，驻留后所有消息共用同一个字符串对象
+        self.role = sys.intern(role)
         self.content = content
         self.message_id = message_id or f"{int(time.time() * 1000)}_{id(self)}"
         self.timestamp = timestamp or time.time()
-        self.metadata = metadata or {}
+        self._metadata = metadata or None
+    
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """
+        获取元数据（可直接修改）
+        
+        Returns:
+            dict: 元数据；没有元数据的消息在首次访问时才创建字典
+        """
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+    
+    @metadata.setter
+    def metadata(self, value: Optional[Dict[str, Any]]) -> None:
+        self._metadata = value or None
+    
+    def update_metadata(self, **kwargs) -> None:
+        """
+        更新元数据
+        
+        Args:
+            **kwargs: 要设置的元数据项
+        """
+        if self._metadata is None:
+            self._metadata = {}
+        self._metadata.update(kwargs)
     
     @property
     def formatted_time(self) -> str:
@@ -63,7 +96,7 @@ class Message:
             'content': self.content,
             'message_id': self.message_id,
             'timestamp': self.timestamp,
-            'metadata': self.metadata
+            'metadata': self._metadata or {}
         }
     
     @classmethod
@@ -82,7 +115,7 @@ class Message:
             content=data.get('content', ''),
             message_id=data.get('message_id'),
             timestamp=data.get('timestamp'),
-            metadata=data.get('metadata', {})
+            metadata=data.get('metadata')
         )
     
     def __str__(self) -> str:
@@ -98,6 +131,8 @@ class Message:
 class Conversation:
     """对话历史管理"""
     
+    __slots__ = ('conversation_id', 'title', 'created_at', 'updated_at', 'metadata', 'messages')
+    
     def __init__(self, conversation_id: Optional[str] = None, title: Optional[str] = None):
         """
         初始化对话
@@ -113,6 +148,15 @@ class Conversation:
         self.updated_at = time.time()
         self.metadata: Dict[str, Any] = {}
     
+    def iter_messages(self) -> Iterator[Message]:
+        """
+        逐条遍历消息
+        
+        Yields:
+            Message: 消息对象
+        """
+        return iter(self.messages)
+    
     def add_message(self, message: Union[Message, Dict[str, Any]]) -> Message:
         """
         添加消息
@@ -192,9 +236,8 @@ class Conversation:
         conversation.created_at = data.get('created_at', time.time())
         conversation.updated_at = data.get('updated_at', time.time())
         conversation.metadata = data.get('metadata', {})
-        
-        for msg_data in data.get('messages', []):
-            conversation.add_message(Message.from_dict(msg_data))
+        # 直接创建Message对象，不保留原始消息字典（Message使用__slots__，占用更少内存）
+        conversation.messages = [Message.from_dict(message) for message in data.get('messages') or ()]
         
         return conversation
     
@@ -216,25 +259,8 @@ class Conversation:
         if file_path is None:
             file_path = config.MESSAGE_CONFIG.get('history_file')
         
-        # 确保目录存在
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        # 读取现有历史记录
-        histories = {}
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    histories = json.load(f)
-            except Exception:
-                pass
-        
-        # 更新对话
-        histories[self.conversation_id] = self.to_dict()
-        
-        # 保存到文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(histories, f, ensure_ascii=False, indent=2)
-        
+        # 启用分片时写入当前进程的分片，读取时与其他进程的分片合并
+        save_histories({self.conversation_id: self.to_dict()}, file_path)
         return file_path
     
     @classmethod
@@ -252,20 +278,61 @@ class Conversation:
         if file_path is None:
             file_path = config.MESSAGE_CONFIG.get('history_file')
         
-        if not os.path.exists(file_path):
-            return None
+        conversation_data = load_history(conversation_id, file_path)
+        if conversation_data:
+            try:
+                return cls.from_dict(conversation_data)
+            except Exception:
+                pass
         
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                histories = json.load(f)
+        return None
+    
+    @classmethod
+    def load_all(cls, file_path: Optional[str] = None) -> List['Conversation']:
+        """
+        从文件加载所有对话
+        
+        Args:
+            file_path (str, optional): 文件路径，默认为None使用配置中的历史文件；启用分片时合并其所有分片
             
-            conversation_data = histories.get(conversation_id)
-            if conversation_data:
-                return cls.from_dict(conversation_data)
+        Returns:
+            list: 对话对象列表，文件不存在或无法解析时返回空列表
+        """
+        if file_path is None:
+            file_path = config.MESSAGE_CONFIG.get('history_file')
+        
+        try:
+            histories = load_histories(file_path)
+            # 逐个转换并移除原始字典，转换完成的对话不会与其原始字典同时常驻内存
+            return [cls.from_dict(histories.pop(conversation_id)) for conversation_id in list(histories)]
         except Exception:
-            pass
+            return []
+    
+    def turns(self) -> List[Tuple[Message, Message]]:
+        """
+        提取对话中成功的轮次（用户消息及紧随其后的助手回复）
         
-        return None
+        Returns:
+            list: [(用户消息, 助手消息), ...]，跳过错误回复和复用的回复
+        """
+        turns = []
+        question = None
+        for answer in self.messages:
+            # 读取_metadata，不为没有元数据的消息创建字典
+            if question is not None and question.role == 'user' and answer.role == 'assistant' \
+                    and not answer.content.startswith('错误:') and not (answer._metadata or {}).get('reused'):
+                turns.append((question, answer))
+            question = answer
+        return turns
+    
+    def qa_pairs(self) -> List[Tuple[str, str]]:
+        """
+        提取对话中成功的问答对
+        
+        Returns:
+            list: [(问题, 回答), ...]，跳过错误回复和复用的回复
+        """
+        return [(question.content, answer.content) for question, answer in self.turns()]
     
     def __len__(self) -> int:
         """获取消息数量"""
@@ -273,4 +340,4 @@ class Conversation:
     
     def __str__(self) -> str:
         """字符串表示"""
-        return f"Conversation '{self.title}' ({len(self.messages)} messages)" 
\ No newline at end of file
+        return f"Conversation '{self.title}' ({len(self)} messages)" 
\ No newline at end of file
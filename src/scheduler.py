@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+请求调度模块
+在一组已登录的AI助手实例前按优先级和租户公平地排队：
+高优先级（交互）请求总是先于低优先级（批量）请求被分配，
+同一优先级内按租户加权公平排队；对话轮次不可中断，抢占发生在每轮对话结束时。
+"""
+
+import time
+import threading
+import itertools
+from concurrent.futures import Future
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+
+from src.utils.logger import get_logger
+from src.utils.deadline import Deadline
+from src.utils import metrics
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class SchedulerClosedError(Exception):
+    """调度器已关闭，不再接受请求"""
+    pass
+
+
+class _Request:
+    """排队中的请求"""
+
+    __slots__ = ('message', 'priority', 'tenant', 'deadline', 'future', 'enqueued_at', 'tag', 'sequence',
+                 'on_progress')
+
+    def __init__(self, message: str, priority: str, tenant: str, deadline: Deadline,
+                 tag: float, sequence: int, on_progress: Optional[Callable[[str], None]] = None):
+        self.message = message
+        self.on_progress = on_progress
+        self.priority = priority
+        self.tenant = tenant
+        self.deadline = deadline
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.tag = tag
+        self.sequence = sequence
+
+
+class _PriorityClass:
+    """同一优先级的请求队列，按租户的虚拟完成时间进行加权公平排队"""
+
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self.queues: Dict[str, Deque[_Request]] = {}
+        self.last_tag: Dict[str, float] = {}
+        self.virtual_time = 0.0
+        self.depth = 0
+        self.waits: Deque[float] = deque(maxlen=window)
+
+    def push(self, request: _Request) -> None:
+        self.queues.setdefault(request.tenant, deque()).append(request)
+        self.depth += 1
+
+    def pop(self) -> Optional[_Request]:
+        # 选择队首请求虚拟完成时间最小的租户，相同时按提交顺序
+        best = None
+        for queue in self.queues.values():
+            if queue and (best is None or (queue[0].tag, queue[0].sequence) < (best.tag, best.sequence)):
+                best = queue[0]
+        if best is None:
+            return None
+        self.queues[best.tenant].popleft()
+        if not self.queues[best.tenant]:
+            del self.queues[best.tenant]
+        self.depth -= 1
+        self.virtual_time = max(self.virtual_time, best.tag)
+        return best
+
+    def wait_percentile(self, percentile: float) -> float:
+        if not self.waits:
+            return 0.0
+        ordered = sorted(self.waits)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+class AssistantScheduler:
+    """
+    AI助手请求调度器
+
+    每个助手实例由一个分发线程独占驱动；分发线程每完成一轮对话就重新选择
+    当前最高优先级、虚拟完成时间最小的请求，因此交互请求最多等待一轮批量对话。
+    """
+
+    def __init__(self, assistants: List[Any], priorities: Optional[Dict[str, int]] = None,
+                 tenant_weights: Optional[Dict[str, float]] = None):
+        """
+        初始化调度器并启动分发线程
+
+        Args:
+            assistants (list): 已初始化的AI助手实例，每个实例同一时间只处理一轮对话
+            priorities (dict, optional): 优先级名称 -> 级别，数值越小越优先，默认使用配置
+            tenant_weights (dict, optional): 租户 -> 权重，权重越大分到的轮次越多，默认使用配置
+        """
+        scheduler_config = config.SCHEDULER_CONFIG
+        self.priorities = priorities or scheduler_config.get('priorities', {'interactive': 0, 'batch': 10})
+        self.tenant_weights = tenant_weights or scheduler_config.get('tenant_weights', {})
+        window = scheduler_config.get('wait_window', 1000)
+
+        self._classes = {name: _PriorityClass(name, window) for name in self.priorities}
+        self._order = sorted(self.priorities, key=lambda name: self.priorities[name])
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._closed = False
+        self._busy = 0
+
+        for name in self._classes:
+            metrics.register_gauge(f'scheduler.queue_depth.{name}', lambda n=name: self.queue_depth(n))
+            metrics.register_gauge(f'scheduler.wait_p50.{name}', lambda n=name: self.wait_time(n, 0.5))
+            metrics.register_gauge(f'scheduler.wait_p95.{name}', lambda n=name: self.wait_time(n, 0.95))
+        metrics.register_gauge('scheduler.busy_assistants', lambda: self._busy)
+
+        # 前reserved个助手实例只处理最高优先级的请求，交互请求无需等待批量对话结束
+        reserved = min(scheduler_config.get('reserved_interactive', 0), max(len(assistants) - 1, 0))
+        self._threads = [
+            threading.Thread(target=self._dispatch, args=(assistant, i < reserved),
+                             name=f"scheduler-{i}", daemon=True)
+            for i, assistant in enumerate(assistants)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, message: str, priority: str = 'interactive', tenant: str = 'default',
+               deadline: Union[Deadline, float, None] = None,
+               on_progress: Optional[Callable[[str], None]] = None) -> Future:
+        """
+        提交一个请求
+
+        Args:
+            message (str): 消息内容
+            priority (str): 优先级名称，如 'interactive' 或 'batch'
+            tenant (str): 租户（用户或批量任务）标识，用于同一优先级内的公平排队
+            deadline (Deadline or float, optional): 截止时间，从提交时开始计算（包含排队时间）
+            on_progress (callable, optional): 回复生成过程中以当前已生成的文本调用
+
+        Returns:
+            Future: 结果为AI助手的回复
+
+        Raises:
+            ValueError: 未知的优先级
+            SchedulerClosedError: 调度器已关闭
+        """
+        if priority not in self._classes:
+            raise ValueError(f"未知的优先级: {priority}")
+
+        with self._condition:
+            if self._closed:
+                raise SchedulerClosedError("调度器已关闭")
+            priority_class = self._classes[priority]
+            weight = self.tenant_weights.get(tenant, 1.0)
+            start = max(priority_class.virtual_time, priority_class.last_tag.get(tenant, 0.0))
+            tag = start + 1.0 / weight
+            priority_class.last_tag[tenant] = tag
+
+            request = _Request(message, priority, tenant, Deadline.coerce(deadline), tag, next(self._sequence),
+                               on_progress)
+            priority_class.push(request)
+            metrics.increment(f'scheduler.submitted.{priority}')
+            # 预留实例只等待最高优先级的请求，唤醒所有分发线程以免通知落到不能处理的线程上
+            self._condition.notify_all()
+        return request.future
+
+    def chat(self, message: str, priority: str = 'interactive', tenant: str = 'default',
+             deadline: Union[Deadline, float, None] = None) -> str:
+        """
+        提交请求并等待回复
+
+        Args:
+            message (str): 消息内容
+            priority (str): 优先级名称
+            tenant (str): 租户标识
+            deadline (Deadline or float, optional): 截止时间
+
+        Returns:
+            str: AI助手的回复
+        """
+        return self.submit(message, priority, tenant, deadline).result()
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        """
+        获取排队中的请求数
+
+        Args:
+            priority (str, optional): 优先级名称，默认统计所有优先级
+
+        Returns:
+            int: 排队请求数
+        """
+        with self._condition:
+            if priority is not None:
+                return self._classes[priority].depth
+            return sum(priority_class.depth for priority_class in self._classes.values())
+
+    def wait_time(self, priority: str, percentile: float = 0.95) -> float:
+        """
+        获取最近请求排队等待时间的分位数
+
+        Args:
+            priority (str): 优先级名称
+            percentile (float): 分位数，0~1
+
+        Returns:
+            float: 等待时间(秒)
+        """
+        with self._condition:
+            return self._classes[priority].wait_percentile(percentile)
+
+    def _next_request(self, reserved: bool = False) -> Optional[_Request]:
+        """取出下一个请求，没有请求时等待；调度器关闭且队列为空时返回None"""
+        names = self._order[:1] if reserved else self._order
+        with self._condition:
+            while True:
+                for name in names:
+                    priority_class = self._classes[name]
+                    request = priority_class.pop()
+                    if request is not None:
+                        priority_class.waits.append(time.monotonic() - request.enqueued_at)
+                        self._busy += 1
+                        return request
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def _dispatch(self, assistant: Any, reserved: bool) -> None:
+        """分发线程：独占驱动一个助手实例，逐轮处理请求"""
+        while True:
+            request = self._next_request(reserved)
+            if request is None:
+                return
+
+            if not request.future.set_running_or_notify_cancel():
+                with self._condition:
+                    self._busy -= 1
+                continue
+
+            try:
+                request.deadline.check("排队")
+                request.future.set_result(assistant.chat(request.message, deadline=request.deadline,
+                                                         on_progress=request.on_progress))
+            except BaseException as e:
+                request.future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._busy -= 1
+
+    def close(self, drain: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        关闭调度器
+
+        Args:
+            drain (bool): 是否处理完已排队的请求；为False时排队中的请求以SchedulerClosedError失败
+            timeout (float, optional): 等待分发线程结束的最长时间(秒)
+        """
+        with self._condition:
+            self._closed = True
+            if not drain:
+                for priority_class in self._classes.values():
+                    while True:
+                        request = priority_class.pop()
+                        if request is None:
+                            break
+                        if request.future.set_running_or_notify_cancel():
+                            request.future.set_exception(SchedulerClosedError("调度器已关闭"))
+            self._condition.notify_all()
+
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if give_up_at is None else max(0.0, give_up_at - time.monotonic()))
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地HTTP服务模块
+提供与OpenAI chat-completions协议兼容的 /v1/chat/completions 接口（支持SSE流式输出），
+请求经AssistantScheduler排队后分配给一组预先登录的AI助手实例，浏览器会话在请求之间复用。
+"""
+
+import json
+import math
+import queue
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.scheduler import AssistantScheduler, SchedulerClosedError
+from src.utils.circuit_breaker import CircuitOpenError
+from src.utils.deadline import DeadlineExceeded
+from src.utils.logger import get_logger
+from src.utils import metrics
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+_ROLE_NAMES = {'system': '系统', 'user': '用户', 'assistant': '助手'}
+_DONE = object()  # 流式输出结束的哨兵
+
+
+def _message_text(content: Any) -> str:
+    """提取OpenAI消息content中的文本，content可以是字符串或内容片段列表"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part.get('text', '') for part in content
+                         if isinstance(part, dict) and part.get('type') == 'text')
+    return ''
+
+
+def build_prompt(messages: List[Dict[str, Any]]) -> str:
+    """
+    把OpenAI格式的消息列表转换为一条提示
+
+    浏览器会话是池中共享的，不保留调用方的上下文；只有一条用户消息时直接发送，
+    否则按角色标注整段对话，由AI接着最后一条用户消息回答。
+
+    Args:
+        messages (list): [{'role': ..., 'content': ...}, ...]
+
+    Returns:
+        str: 提示
+
+    Raises:
+        ValueError: 消息格式错误或没有用户消息
+    """
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("messages 必须是非空列表")
+    turns = []
+    for message in messages:
+        if not isinstance(message, dict) or message.get('role') not in _ROLE_NAMES:
+            raise ValueError("messages 中的每一项必须包含 role (system/user/assistant) 和 content")
+        text = _message_text(message.get('content')).strip()
+        if text:
+            turns.append((message['role'], text))
+    if not turns or turns[-1][0] != 'user':
+        raise ValueError("最后一条消息必须是非空的用户消息")
+
+    if len(turns) == 1:
+        return turns[0][1]
+    return "\n\n".join(f"{_ROLE_NAMES[role]}: {text}" for role, text in turns)
+
+
+class ChatCompletionServer:
+    """
+    OpenAI兼容的本地服务
+
+    每个HTTP连接由一个线程处理并支持keep-alive；排队中的请求数达到上限时返回429，
+    并按当前排队长度和平均对话耗时给出Retry-After。关闭时先停止接受新请求，再处理完已排队的请求。
+    """
+
+    def __init__(self, assistants: List[Any], host: Optional[str] = None, port: Optional[int] = None,
+                 model: Optional[str] = None):
+        """
+        初始化服务
+
+        Args:
+            assistants (list): 已初始化的AI助手实例
+            host (str, optional): 监听地址，默认使用配置
+            port (int, optional): 监听端口，默认使用配置
+            model (str, optional): 对外展示的模型名称，默认为助手类型
+        """
+        server_config = config.SERVER_CONFIG
+        self.assistants = assistants
+        self.model = model or getattr(assistants[0], 'assistant_type', 'xiaohang')
+        self.max_queue = server_config.get('max_queue', 32)
+        self.request_timeout = server_config.get('request_timeout', 300)
+        self.heartbeat = server_config.get('heartbeat', 15)
+        self.api_key = server_config.get('api_key') or None
+        self.draining = False
+
+        self.scheduler = AssistantScheduler(assistants)
+        self._turn_seconds = float(server_config.get('initial_turn_seconds', 20))
+        self._stats_lock = threading.Lock()
+        self._active = 0  # 正在处理的HTTP请求数
+        self._idle = threading.Condition()
+
+        host = host or server_config.get('host', '127.0.0.1')
+        port = port if port is not None else server_config.get('port', 8000)
+        self.httpd = ThreadingHTTPServer((host, port), _ChatCompletionHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.app = self
+        metrics.register_gauge('server.turn_seconds', lambda: self._turn_seconds)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """实际监听的地址和端口"""
+        return self.httpd.server_address[:2]
+
+    def retry_after(self) -> int:
+        """估计排队中的请求全部开始处理还需要的秒数，作为429响应的Retry-After"""
+        depth = self.scheduler.queue_depth()
+        return max(1, math.ceil(depth / len(self.assistants) * self._turn_seconds))
+
+    def admit(self) -> Optional[Tuple[int, str, str]]:
+        """
+        判断是否接受新请求
+
+        Returns:
+            tuple or None: 拒绝时返回(状态码, 错误类型, 说明)，接受时返回None
+        """
+        if self.draining:
+            return 503, 'server_shutting_down', "服务正在关闭，不再接受新请求"
+        if self.scheduler.queue_depth() >= self.max_queue:
+            metrics.increment('server.rejected')
+            return 429, 'rate_limit_exceeded', "排队中的请求已达上限，请稍后重试"
+        return None
+
+    def begin_request(self) -> None:
+        """标记一个请求开始处理"""
+        with self._idle:
+            self._active += 1
+
+    def end_request(self) -> None:
+        """标记一个请求处理结束"""
+        with self._idle:
+            self._active -= 1
+            self._idle.notify_all()
+
+    def record_turn(self, seconds: float) -> None:
+        """记录一轮对话的耗时，更新平均耗时（指数滑动平均）"""
+        with self._stats_lock:
+            self._turn_seconds = 0.8 * self._turn_seconds + 0.2 * seconds
+
+    def serve_forever(self) -> None:
+        """
+        运行服务，收到SIGINT/SIGTERM时优雅关闭
+        """
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info(f"收到信号 {signum}，开始关闭服务")
+            stop.set()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, request_stop)
+            signal.signal(signal.SIGTERM, request_stop)
+
+        thread = threading.Thread(target=self.httpd.serve_forever, name="http-server", daemon=True)
+        thread.start()
+        host, port = self.address
+        logger.info(f"服务已启动: http://{host}:{port}/v1/chat/completions ({len(self.assistants)} 个AI助手)")
+        print(f"服务已启动: http://{host}:{port}/v1 ，按 Ctrl+C 停止")
+        try:
+            while not stop.wait(1.0):
+                pass
+        finally:
+            self.shutdown()
+            thread.join()
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """
+        优雅关闭：拒绝新请求，等待已排队和处理中的请求完成后停止监听
+
+        Args:
+            timeout (float, optional): 等待已排队请求完成的最长时间(秒)，默认使用配置
+        """
+        if timeout is None:
+            timeout = config.SERVER_CONFIG.get('drain_timeout', 120)
+        self.draining = True
+        pending = self.scheduler.queue_depth()
+        logger.info(f"等待 {pending} 个排队中的请求和处理中的请求完成 (最长 {timeout} 秒)")
+        give_up_at = time.monotonic() + timeout
+        self.scheduler.close(drain=True, timeout=timeout)
+        # 等待已完成的回复写回客户端
+        with self._idle:
+            while self._active and time.monotonic() < give_up_at:
+                self._idle.wait(give_up_at - time.monotonic())
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        logger.info("服务已关闭")
+
+
+class _ChatCompletionHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理器"""
+
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive，客户端可以在同一连接上连续发送请求
+    timeout = config.SERVER_CONFIG.get('idle_timeout', 60)  # 空闲连接的超时时间（秒）
+
+    @property
+    def app(self) -> ChatCompletionServer:
+        return self.server.app
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, error_type: str, message: str,
+                    headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {'error': {'message': message, 'type': error_type, 'code': status}}, headers)
+
+    def _authorized(self) -> bool:
+        if not self.app.api_key:
+            return True
+        return self.headers.get('Authorization', '') == f"Bearer {self.app.api_key}"
+
+    def do_GET(self) -> None:
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path == '/health':
+            self._send_json(200, {'status': 'draining' if self.app.draining else 'ok',
+                                  'queue_depth': self.app.scheduler.queue_depth(),
+                                  'assistants': len(self.app.assistants)})
+        elif path == '/v1/models':
+            if not self._authorized():
+                self._send_error(401, 'invalid_api_key', "API密钥无效")
+                return
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': self.app.model, 'object': 'model', 'created': 0, 'owned_by': 'buaa'}
+            ]})
+        else:
+            self._send_error(404, 'not_found', f"未知的路径: {self.path}")
+
+    def do_POST(self) -> None:
+        if self.path.split('?', 1)[0].rstrip('/') != '/v1/chat/completions':
+            self._send_error(404, 'not_found', f"未知的路径: {self.path}")
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+        except (ValueError, UnicodeDecodeError):
+            self._send_error(400, 'invalid_request_error', "请求体不是有效的JSON")
+            return
+
+        if not self._authorized():
+            self._send_error(401, 'invalid_api_key', "API密钥无效")
+            return
+
+        try:
+            prompt = build_prompt(body.get('messages'))
+        except ValueError as e:
+            self._send_error(400, 'invalid_request_error', str(e))
+            return
+
+        priority = self.headers.get('X-Priority', 'interactive')
+        if priority not in self.app.scheduler.priorities:
+            self._send_error(400, 'invalid_request_error', f"未知的优先级: {priority}")
+            return
+        tenant = body.get('user') or self.headers.get('X-Tenant') or self.client_address[0]
+        model = body.get('model') or self.app.model
+
+        rejection = self.app.admit()
+        if rejection is not None:
+            status, error_type, message = rejection
+            self._send_error(status, error_type, message, {'Retry-After': str(self.app.retry_after())})
+            return
+
+        metrics.increment('server.requests')
+        self.app.begin_request()
+        try:
+            if body.get('stream'):
+                self._stream_completion(prompt, priority, tenant, model)
+            else:
+                self._complete(prompt, priority, tenant, model)
+        finally:
+            self.app.end_request()
+
+    def _submit(self, prompt: str, priority: str, tenant: str, on_progress=None):
+        started = time.monotonic()
+        future = self.app.scheduler.submit(prompt, priority=priority, tenant=tenant,
+                                           deadline=self.app.request_timeout, on_progress=on_progress)
+
+        def record(done) -> None:
+            if not done.cancelled() and done.exception() is None:
+                self.app.record_turn(time.monotonic() - started)
+
+        future.add_done_callback(record)
+        return future
+
+    @staticmethod
+    def _failure(error: BaseException) -> Tuple[int, str]:
+        """把对话失败映射为HTTP状态码和错误类型"""
+        if isinstance(error, (SchedulerClosedError, CancelledError)):
+            return 503, 'server_shutting_down'
+        if isinstance(error, CircuitOpenError):
+            return 503, 'service_unavailable'
+        if isinstance(error, DeadlineExceeded):
+            return 504, 'timeout'
+        return 502, 'upstream_error'
+
+    def _complete(self, prompt: str, priority: str, tenant: str, model: str) -> None:
+        try:
+            future = self._submit(prompt, priority, tenant)
+            reply = future.result()
+        except Exception as e:
+            status, error_type = self._failure(e)
+            self._send_error(status, error_type, str(e))
+            return
+
+        self._send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+    def _write_chunk(self, data: bytes) -> None:
+        """按HTTP/1.1分块传输编码写出一块数据，连接在流式响应后仍可复用"""
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_completion(self, prompt: str, priority: str, tenant: str, model: str) -> None:
+        events: "queue.Queue[Any]" = queue.Queue()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        sent = ''
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+            payload = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                       'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        def content_delta(text: str) -> Optional[bytes]:
+            # 只输出在已发送内容之后追加的部分；恢复重发导致回复从头生成时等待新回复追上
+            nonlocal sent
+            if len(text) <= len(sent) or not text.startswith(sent):
+                return None
+            delta, sent = text[len(sent):], text
+            return chunk({'content': delta})
+
+        try:
+            future = self._submit(prompt, priority, tenant, on_progress=events.put)
+        except SchedulerClosedError as e:
+            self._send_error(503, 'server_shutting_down', str(e))
+            return
+        future.add_done_callback(lambda f: events.put(_DONE))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            self._write_chunk(chunk({'role': 'assistant'}))
+            while True:
+                try:
+                    event = events.get(timeout=self.app.heartbeat)
+                except queue.Empty:
+                    # 排队或生成期间定期发送SSE注释，避免客户端或代理因空闲断开连接
+                    self._write_chunk(b": keep-alive\n\n")
+                    continue
+                if event is _DONE:
+                    break
+                data = content_delta(event)
+                if data:
+                    self._write_chunk(data)
+
+            try:
+                reply = future.result()
+            except Exception as e:
+                # 包括服务关闭时被取消的排队请求：以错误事件结束，随后照常写出终止块
+                _, error_type = self._failure(e)
+                error = {'error': {'message': str(e) or '请求已取消', 'type': error_type}}
+                self._write_chunk(f"data: {json.dumps(error, ensure_ascii=False)}\n\n".encode('utf-8'))
+            else:
+                data = content_delta(reply)
+                if data:
+                    self._write_chunk(data)
+                elif not reply.startswith(sent):
+                    logger.warning("最终回复与已流式输出的内容不一致，仅输出了部分回复")
+                self._write_chunk(chunk({}, 'stop'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开：尚在排队的请求直接取消，处理中的对话照常完成并记入历史
+            future.cancel()
+            self.close_connection = True
+            logger.info("客户端在流式输出过程中断开连接")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史与批量结果分析模块
+把会话历史和批量处理结果转换为列式的pandas DataFrame，导出为Parquet/Feather（需要pyarrow）
+或压缩CSV，并提供向量化的统计：回答长度分布、按小时的延迟、按助手类型的错误率。
+"""
+
+import os
+import json
+import importlib.util
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.utils.logger import get_logger
+from src.models.history import load_histories
+
+# 获取日志记录器
+logger = get_logger()
+
+# 回答以此开头表示该轮对话失败（与会话历史和批量结果中的约定一致）
+ERROR_PREFIX = '错误:'
+
+_COLUMNAR_FORMATS = ('parquet', 'feather')
+
+
+def _conversation_dicts(conversations: Optional[Iterable[Any]], file_path: Optional[str]) -> Iterable[Dict[str, Any]]:
+    """统一为对话字典；未提供对话时从历史文件（含分片）读取"""
+    if conversations is None:
+        return load_histories(file_path).values()
+    return (item if isinstance(item, dict) else item.to_dict() for item in conversations)
+
+
+def history_frame(conversations: Optional[Iterable[Any]] = None,
+                  file_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    把会话历史转换为每条消息一行的DataFrame
+
+    Args:
+        conversations (iterable, optional): Conversation对象或对话字典，默认读取历史文件
+        file_path (str, optional): 历史文件路径，默认使用配置中的历史文件
+
+    Returns:
+        DataFrame: 列为 conversation_id, assistant_type, message_id, role, content,
+            timestamp(datetime64), length, reused, coalesced；按会话和时间排序
+    """
+    columns: Dict[str, List[Any]] = {name: [] for name in (
+        'conversation_id', 'assistant_type', 'message_id', 'role', 'content', 'timestamp', 'reused', 'coalesced')}
+    for data in _conversation_dicts(conversations, file_path):
+        conversation_id = data.get('conversation_id')
+        assistant_type = (data.get('metadata') or {}).get('assistant_type')
+        for message in data.get('messages') or ():
+            metadata = message.get('metadata') or {}
+            columns['conversation_id'].append(conversation_id)
+            columns['assistant_type'].append(assistant_type)
+            columns['message_id'].append(message.get('message_id'))
+            columns['role'].append(message.get('role', 'user'))
+            columns['content'].append(message.get('content') or '')
+            columns['timestamp'].append(message.get('timestamp'))
+            columns['reused'].append(bool(metadata.get('reused')))
+            columns['coalesced'].append(bool(metadata.get('coalesced')))
+
+    # 显式指定类型，历史为空时各列的类型也与有数据时一致
+    frame = pd.DataFrame({
+        # 重复值多的列用分类类型，几个月的历史也只占很少内存
+        'conversation_id': pd.Series(columns['conversation_id'], dtype='category'),
+        'assistant_type': pd.Series(columns['assistant_type'], dtype='category'),
+        'message_id': pd.Series(columns['message_id'], dtype=object),
+        'role': pd.Series(columns['role'], dtype='category'),
+        'content': pd.Series(columns['content'], dtype=object),
+        'timestamp': pd.to_datetime(pd.to_numeric(pd.Series(columns['timestamp'], dtype=object), errors='coerce'),
+                                    unit='s', errors='coerce'),
+        'reused': pd.Series(columns['reused'], dtype=bool),
+        'coalesced': pd.Series(columns['coalesced'], dtype=bool),
+    })
+    frame['length'] = frame['content'].map(len, na_action='ignore').astype('int32')
+    return frame.sort_values(['conversation_id', 'timestamp'], kind='stable').reset_index(drop=True)
+
+
+def turns_frame(messages: Optional[pd.DataFrame] = None,
+                conversations: Optional[Iterable[Any]] = None,
+                file_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    把会话历史转换为每轮对话（用户消息及紧随其后的助手回复）一行的DataFrame
+
+    Args:
+        messages (DataFrame, optional): history_frame的结果，未提供时由conversations或历史文件生成
+        conversations (iterable, optional): Conversation对象或对话字典
+        file_path (str, optional): 历史文件路径
+
+    Returns:
+        DataFrame: 列为 conversation_id, assistant_type, question, answer, asked_at, answered_at,
+            latency(秒), answer_length, error, reused, coalesced
+    """
+    if messages is None:
+        messages = history_frame(conversations, file_path)
+    following = messages.shift(-1)
+    is_turn = ((messages['role'] == 'user')
+               & (following['role'] == 'assistant')
+               & (messages['conversation_id'] == following['conversation_id']))
+
+    questions = messages[is_turn]
+    answers = following[is_turn]
+    turns = pd.DataFrame({
+        'conversation_id': questions['conversation_id'],
+        'assistant_type': questions['assistant_type'],
+        'question': questions['content'],
+        'answer': answers['content'],
+        'asked_at': questions['timestamp'],
+        'answered_at': answers['timestamp'],
+    })
+    turns['latency'] = (turns['answered_at'] - turns['asked_at']).dt.total_seconds()
+    turns['answer_length'] = answers['length'].astype('int32')
+    turns['error'] = turns['answer'].str.startswith(ERROR_PREFIX)
+    turns['reused'] = answers['reused'].astype(bool)
+    turns['coalesced'] = answers['coalesced'].astype(bool)
+    return turns.reset_index(drop=True)
+
+
+def results_frame(results: Union[List[Dict[str, Any]], pd.DataFrame],
+                  assistant_type: Optional[str] = None) -> pd.DataFrame:
+    """
+    把批量处理结果转换为DataFrame
+
+    Args:
+        results (list or DataFrame): 结果记录列表（question, answer, timestamp, 可选 success/duplicate_of）
+        assistant_type (str, optional): 处理这批问题的助手类型
+
+    Returns:
+        DataFrame: 原有列加上 timestamp(datetime64), answer_length, error, assistant_type
+    """
+    frame = results.copy() if isinstance(results, pd.DataFrame) else pd.DataFrame.from_records(results)
+    for name in ('question', 'answer'):
+        if name not in frame:
+            frame[name] = ''
+    frame['answer'] = frame['answer'].fillna('').astype(str)
+    frame['timestamp'] = pd.to_datetime(frame.get('timestamp'), errors='coerce')
+    frame['answer_length'] = frame['answer'].str.len().astype('int32')
+    frame['error'] = frame['answer'].str.startswith(ERROR_PREFIX)
+    if 'success' in frame:
+        frame['error'] = frame['error'] | ~frame['success'].fillna(True).astype(bool)
+    if 'duplicate_of' in frame:
+        frame['duplicate_of'] = pd.to_numeric(frame['duplicate_of'], errors='coerce').astype('Int32')
+    if assistant_type is not None or 'assistant_type' not in frame:
+        frame['assistant_type'] = assistant_type
+    frame['assistant_type'] = frame['assistant_type'].astype('category')
+    return frame
+
+
+def load_results(path: str, assistant_type: Optional[str] = None) -> pd.DataFrame:
+    """
+    读取批量处理的输出文件（json或csv）
+
+    Args:
+        path (str): 输出文件路径
+        assistant_type (str, optional): 处理这批问题的助手类型
+
+    Returns:
+        DataFrame: 同results_frame
+    """
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return results_frame(json.load(f), assistant_type)
+    frame = pd.read_csv(path)
+    # save_results写出的中文列名
+    frame = frame.rename(columns={'问题': 'question', '回答': 'answer', '时间': 'timestamp', '复用自': 'duplicate_of'})
+    return results_frame(frame, assistant_type)
+
+
+def pyarrow_available() -> bool:
+    """是否可以写出Parquet/Feather（需要安装pyarrow）"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def export_frame(frame: pd.DataFrame, path: str, format_type: Optional[str] = None) -> str:
+    """
+    导出DataFrame
+
+    Args:
+        frame (DataFrame): 要导出的数据
+        path (str): 输出路径
+        format_type (str, optional): parquet、feather或csv，默认按扩展名判断；
+            没有pyarrow时Parquet/Feather改为写出gzip压缩的CSV（路径改为 .csv.gz）
+
+    Returns:
+        str: 实际写出的文件路径
+    """
+    if format_type is None:
+        extension = os.path.splitext(path[:-3] if path.endswith('.gz') else path)[1].lstrip('.').lower()
+        format_type = extension if extension in _COLUMNAR_FORMATS else 'csv'
+
+    if format_type in _COLUMNAR_FORMATS and not pyarrow_available():
+        logger.warning(f"未安装pyarrow，无法写出{format_type}，改为压缩CSV")
+        path = os.path.splitext(path)[0] + '.csv.gz'
+        format_type = 'csv'
+
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if format_type == 'parquet':
+        frame.to_parquet(path, index=False)
+    elif format_type == 'feather':
+        frame.reset_index(drop=True).to_feather(path)
+    else:
+        compression = 'gzip' if path.endswith('.gz') else 'infer'
+        frame.to_csv(path, index=False, compression=compression)
+    logger.info(f"已导出 {len(frame)} 行到 {path}")
+    return path
+
+
+def _quantiles(grouped, index: pd.Index) -> pd.DataFrame:
+    """各组的p50/p90/p99；没有任何数据时返回同样列名的空表"""
+    quantiles = grouped.quantile([0.5, 0.9, 0.99]).unstack()
+    if quantiles.empty:
+        return pd.DataFrame(index=index, columns=['p50', 'p90', 'p99'], dtype=float)
+    quantiles.columns = ['p50', 'p90', 'p99']
+    return quantiles
+
+
+def answer_length_distribution(turns: pd.DataFrame) -> pd.DataFrame:
+    """
+    按助手类型统计成功回答的长度分布
+
+    Args:
+        turns (DataFrame): turns_frame或results_frame的结果
+
+    Returns:
+        DataFrame: 每种助手类型一行，列为 count, mean, p50, p90, p99, max
+    """
+    answered = turns[~turns['error']]
+    grouped = answered.groupby('assistant_type', observed=True, dropna=False)['answer_length']
+    summary = grouped.agg(['count', 'mean', 'max'])
+    return summary.join(_quantiles(grouped, summary.index))[['count', 'mean', 'p50', 'p90', 'p99', 'max']]
+
+
+def hourly_latency(turns: pd.DataFrame) -> pd.DataFrame:
+    """
+    按小时统计成功轮次的延迟（复用和合并的回答不计入）
+
+    Args:
+        turns (DataFrame): turns_frame的结果
+
+    Returns:
+        DataFrame: 以整点时间为索引，列为 count, mean, p50, p90, p99（秒）
+    """
+    measured = turns[~turns['error'] & ~turns['reused'] & ~turns['coalesced'] & (turns['latency'] > 0)]
+    grouped = measured.groupby(measured['asked_at'].dt.floor('h'))['latency']
+    summary = grouped.agg(['count', 'mean'])
+    return summary.join(_quantiles(grouped, summary.index))
+
+
+def error_rate_by_assistant(turns: pd.DataFrame) -> pd.DataFrame:
+    """
+    按助手类型统计错误率
+
+    Args:
+        turns (DataFrame): turns_frame或results_frame的结果
+
+    Returns:
+        DataFrame: 每种助手类型一行，列为 turns, errors, error_rate
+    """
+    grouped = turns.groupby('assistant_type', observed=True, dropna=False)['error']
+    summary = grouped.agg(turns='size', errors='sum')
+    summary['error_rate'] = np.where(summary['turns'] > 0, summary['errors'] / summary['turns'], np.nan)
+    return summary
+
+
+def summarize(turns: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    生成全部统计
+
+    Args:
+        turns (DataFrame): turns_frame的结果
+
+    Returns:
+        dict: answer_length, hourly_latency, error_rate 三张统计表
+    """
+    return {
+        'answer_length': answer_length_distribution(turns),
+        'hourly_latency': hourly_latency(turns),
+        'error_rate': error_rate_by_assistant(turns),
+    }
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+基准测试结果库模块
+每次基准测试的样本按提交（git commit）存入本地SQLite数据库；
+比较两个提交时对每个指标做单侧Mann-Whitney U检验，
+中位数变慢超过阈值且统计显著的指标判定为性能回退。
+"""
+
+import os
+import math
+import time
+import socket
+import sqlite3
+import subprocess
+import statistics
+from typing import Any, Dict, Iterable, List, Optional
+
+from src import __version__
+from src.utils.logger import get_logger
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    commit_hash TEXT NOT NULL,
+    dirty INTEGER NOT NULL,
+    version TEXT,
+    host TEXT,
+    started_at REAL NOT NULL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_commit ON runs(commit_hash);
+CREATE INDEX IF NOT EXISTS idx_samples_run ON samples(run_id, metric);
+"""
+
+
+def _git(*args: str) -> Optional[str]:
+    """在仓库根目录执行git命令，失败时返回None"""
+    try:
+        result = subprocess.run(['git', *args], cwd=_REPO_ROOT, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def current_commit() -> Dict[str, Any]:
+    """
+    获取当前代码的提交
+
+    Returns:
+        dict: commit（提交哈希，不在git仓库中时为'unknown'）和 dirty（是否有未提交的修改）
+    """
+    commit = _git('rev-parse', 'HEAD') or 'unknown'
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': commit, 'dirty': bool(status)}
+
+
+def resolve_commit(ref: str) -> str:
+    """
+    把分支名、标签或缩写解析为完整的提交哈希，无法解析时原样返回（按前缀在数据库中匹配）
+
+    Args:
+        ref (str): git引用
+
+    Returns:
+        str: 提交哈希
+    """
+    return _git('rev-parse', '--verify', '--quiet', f"{ref}^{{commit}}") or ref
+
+
+class BenchmarkDB:
+    """基准测试结果数据库"""
+
+    def __init__(self, db_file: Optional[str] = None):
+        """
+        打开数据库（不存在时创建）
+
+        Args:
+            db_file (str, optional): 数据库文件路径，默认使用配置
+        """
+        self.db_file = db_file or config.BENCHMARK_CONFIG.get('db_file')
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_file)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """关闭数据库"""
+        self._conn.close()
+
+    def record_run(self, samples: Dict[str, Iterable[float]], commit: Optional[Dict[str, Any]] = None,
+                   label: Optional[str] = None) -> int:
+        """
+        保存一次基准测试的样本
+
+        Args:
+            samples (dict): 指标名称 -> 样本值（越小越好）
+            commit (dict, optional): current_commit的结果，默认取当前提交
+            label (str, optional): 备注
+
+        Returns:
+            int: 运行ID
+        """
+        commit = commit or current_commit()
+        with self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO runs (commit_hash, dirty, version, host, started_at, label) VALUES (?, ?, ?, ?, ?, ?)',
+                (commit['commit'], int(commit['dirty']), __version__, socket.gethostname(), time.time(), label)
+            )
+            run_id = cursor.lastrowid
+            self._conn.executemany(
+                'INSERT INTO samples (run_id, metric, value) VALUES (?, ?, ?)',
+                [(run_id, metric, float(value)) for metric, values in samples.items() for value in values]
+            )
+        return run_id
+
+    def runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        列出最近的运行
+
+        Args:
+            limit (int): 最多返回的数量
+
+        Returns:
+            list: 每次运行的 id, commit, dirty, version, host, started_at, label, samples
+        """
+        rows = self._conn.execute(
+            'SELECT r.id, r.commit_hash, r.dirty, r.version, r.host, r.started_at, r.label, COUNT(s.run_id) '
+            'FROM runs r LEFT JOIN samples s ON s.run_id = r.id GROUP BY r.id ORDER BY r.id DESC LIMIT ?',
+            (limit,)
+        ).fetchall()
+        keys = ('id', 'commit', 'dirty', 'version', 'host', 'started_at', 'label', 'samples')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def find_commit(self, ref: str) -> Optional[str]:
+        """
+        在数据库中查找提交（完整哈希或唯一前缀）
+
+        Args:
+            ref (str): 提交哈希、前缀或git引用
+
+        Returns:
+            str or None: 数据库中的提交哈希，不存在或前缀不唯一时返回None
+        """
+        commit = resolve_commit(ref)
+        matches = [row[0] for row in self._conn.execute(
+            'SELECT DISTINCT commit_hash FROM runs WHERE commit_hash LIKE ?', (commit + '%',)
+        )]
+        return matches[0] if len(matches) == 1 else None
+
+    def latest_commits(self) -> List[str]:
+        """
+        按最近一次运行的时间从新到旧列出提交
+
+        Returns:
+            list: 提交哈希
+        """
+        return [row[0] for row in self._conn.execute(
+            'SELECT commit_hash FROM runs GROUP BY commit_hash ORDER BY MAX(id) DESC'
+        )]
+
+    def samples(self, commit: str) -> Dict[str, List[float]]:
+        """
+        读取一个提交所有运行的样本
+
+        Args:
+            commit (str): 提交哈希
+
+        Returns:
+            dict: 指标名称 -> 样本值
+        """
+        result: Dict[str, List[float]] = {}
+        for metric, value in self._conn.execute(
+            'SELECT s.metric, s.value FROM samples s JOIN runs r ON r.id = s.run_id WHERE r.commit_hash = ?',
+            (commit,)
+        ):
+            result.setdefault(metric, []).append(value)
+        return result
+
+
+def mann_whitney_greater(baseline: List[float], candidate: List[float]) -> float:
+    """
+    单侧Mann-Whitney U检验：candidate是否倾向于大于baseline（正态近似，含并列校正）
+
+    Args:
+        baseline (list): 基线样本
+        candidate (list): 待比较样本
+
+    Returns:
+        float: p值，样本不足或没有差异时为1.0
+    """
+    n1, n2 = len(baseline), len(candidate)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+
+    # 合并排序计算秩，并列的值取平均秩
+    values = sorted([(value, 0) for value in baseline] + [(value, 1) for value in candidate])
+    ranks = [0.0] * len(values)
+    tie_term = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        for k in range(i, j + 1):
+            ranks[k] = average_rank
+        tied = j - i + 1
+        tie_term += tied ** 3 - tied
+        i = j + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 1)
+    u = rank_sum - n2 * (n2 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    # 连续性校正
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline: Dict[str, List[float]], candidate: Dict[str, List[float]],
+            alpha: Optional[float] = None, min_slowdown: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    逐个指标比较两个提交的样本
+
+    Args:
+        baseline (dict): 基线的 指标 -> 样本
+        candidate (dict): 待比较的 指标 -> 样本
+        alpha (float, optional): 显著性水平，默认使用配置
+        min_slowdown (float, optional): 中位数至少变慢的比例才判定为回退，默认使用配置
+
+    Returns:
+        list: 每个共同指标一项，包含 metric, baseline_median, candidate_median, change, p_value, regression
+    """
+    benchmark_config = config.BENCHMARK_CONFIG
+    alpha = benchmark_config.get('alpha', 0.05) if alpha is None else alpha
+    min_slowdown = benchmark_config.get('min_slowdown', 0.05) if min_slowdown is None else min_slowdown
+
+    results = []
+    for metric in sorted(set(baseline) & set(candidate)):
+        base, cand = baseline[metric], candidate[metric]
+        base_median, cand_median = statistics.median(base), statistics.median(cand)
+        change = (cand_median - base_median) / base_median if base_median else (math.inf if cand_median else 0.0)
+        p_value = mann_whitney_greater(base, cand)
+        results.append({
+            'metric': metric,
+            'baseline_n': len(base),
+            'candidate_n': len(cand),
+            'baseline_median': base_median,
+            'candidate_median': cand_median,
+            'change': change,
+            'p_value': p_value,
+            'regression': p_value < alpha and change > min_slowdown,
+        })
+    return results
+
+
+def format_comparison(results: List[Dict[str, Any]]) -> str:
+    """
+    格式化比较结果
+
+    Args:
+        results (list): compare的结果
+
+    Returns:
+        str: 表格文本
+    """
+    if not results:
+        return "两个提交没有共同的指标"
+    header = ['指标', '基线中位数', '当前中位数', '变化', 'p值', '样本数', '结论']
+    rows = [header]
+    for item in results:
+        rows.append([
+            item['metric'],
+            f"{item['baseline_median']:.4g}",
+            f"{item['candidate_median']:.4g}",
+            f"{item['change'] * 100:+.1f}%",
+            f"{item['p_value']:.3g}",
+            f"{item['baseline_n']}/{item['candidate_n']}",
+            '回退' if item['regression'] else '-',
+        ])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+熔断器模块
+站点持续故障时快速失败，避免每个问题都耗尽等待时间和重试次数
+"""
+
+import time
+import threading
+from typing import Dict, Optional
+
+from src.utils.logger import get_logger
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class CircuitOpenError(Exception):
+    """熔断器已打开，请求被拒绝"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    关闭(closed)：正常放行，连续失败达到阈值后打开。
+    打开(open)：拒绝所有请求，经过reset_timeout后进入半开。
+    半开(half_open)：只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None):
+        """
+        初始化熔断器
+
+        Args:
+            name (str): 熔断器名称
+            failure_threshold (int, optional): 打开熔断所需的连续失败次数
+            reset_timeout (float, optional): 打开后进入半开状态前的等待时间(秒)
+        """
+        breaker_config = config.CIRCUIT_BREAKER_CONFIG
+        self.name = name
+        self.failure_threshold = failure_threshold or breaker_config.get('failure_threshold', 3)
+        self.reset_timeout = reset_timeout or breaker_config.get('reset_timeout', 60)
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """当前状态（打开且已过等待时间时报告为半开）"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def time_until_half_open(self) -> float:
+        """
+        距离进入半开状态的剩余时间
+
+        Returns:
+            float: 剩余秒数，未打开时为0
+        """
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        """
+        判断是否放行请求，半开状态下只放行一个探测请求
+
+        Returns:
+            bool: 是否放行
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"熔断器 {self.name} 进入半开状态，放行探测请求")
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        """记录一次成功"""
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"熔断器 {self.name} 探测成功，恢复关闭状态")
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """结束请求但不计入成功或失败（如调用方截止时间耗尽），半开状态下允许下一个探测请求"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """记录一次失败"""
+        with self._lock:
+            self._consecutive_failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(
+                        f"熔断器 {self.name} 打开（连续失败 {self._consecutive_failures} 次），"
+                        f"{self.reset_timeout} 秒后探测"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    获取共享的熔断器，同名熔断器在进程内共享
+
+    Args:
+        name (str): 熔断器名称，通常为站点域名
+
+    Returns:
+        CircuitBreaker: 熔断器
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+自适应并发控制模块
+根据观测到的延迟、错误率和空回复率，以加性增、乘性减(AIMD)的方式调整
+同时进行的对话数和发送间隔。状态保存在本地共享文件中，多个线程和进程共同遵守。
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from src.utils.filelock import FileLock
+from src.utils.logger import get_logger
+from src.utils import metrics
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class AIMDController:
+    """基于共享状态文件的AIMD并发控制器"""
+
+    def __init__(self, state_file: Optional[str] = None, **overrides):
+        """
+        初始化控制器
+
+        Args:
+            state_file (str, optional): 共享状态文件路径，默认使用配置中的state_file
+            **overrides: 覆盖CONCURRENCY_CONFIG中的参数
+        """
+        settings = dict(config.CONCURRENCY_CONFIG)
+        settings.update(overrides)
+        self.state_file = state_file or settings['state_file']
+        self.min_limit = settings.get('min_limit', 1)
+        self.max_limit = settings.get('max_limit', 4)
+        self.initial_limit = settings.get('initial_limit', 1)
+        self.increase_step = settings.get('increase_step', 1)
+        self.decrease_factor = settings.get('decrease_factor', 0.5)
+        self.min_interval = settings.get('min_interval', 0.5)
+        self.max_interval = settings.get('max_interval', 30)
+        self.latency_threshold = settings.get('latency_threshold', 90)
+        self.lease_timeout = settings.get('lease_timeout', 600)
+        self.ewma_alpha = settings.get('ewma_alpha', 0.2)
+
+        self._thread_lock = threading.Lock()
+        self._last_state: Dict[str, Any] = self._initial_state()
+
+        metrics.register_gauge('concurrency.limit', lambda: self._last_state['limit'])
+        metrics.register_gauge('concurrency.interval', lambda: self._last_state['interval'])
+        metrics.register_gauge('concurrency.in_flight', lambda: len(self._last_state['in_flight']))
+
+    def _initial_state(self) -> Dict[str, Any]:
+        """初始状态"""
+        return {
+            'limit': float(self.initial_limit),
+            'interval': float(self.min_interval),
+            'last_send': 0.0,
+            'last_decrease': 0.0,
+            'in_flight': {},
+            'latency_ewma': None,
+            'error_rate': 0.0,
+            'empty_rate': 0.0,
+        }
+
+    def _load(self) -> Dict[str, Any]:
+        """读取共享状态（调用方需持有文件锁）"""
+        state = self._initial_state()
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    state.update(json.load(f))
+            except Exception as e:
+                logger.debug(f"读取并发控制状态失败，使用初始状态: {e}")
+        return state
+
+    def _save(self, state: Dict[str, Any]) -> None:
+        """写入共享状态（调用方需持有文件锁）"""
+        tmp_path = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_file)
+        self._last_state = state
+
+    @contextmanager
+    def _locked_state(self):
+        """在线程锁和文件锁保护下读写共享状态"""
+        with self._thread_lock, FileLock(self.state_file):
+            state = self._load()
+            yield state
+            self._save(state)
+
+    def _purge_stale(self, state: Dict[str, Any], now: float) -> None:
+        """清理超过租期的在途记录（如进程崩溃后遗留的记录）"""
+        stale = [token for token, started in state['in_flight'].items()
+                 if now - started > self.lease_timeout]
+        for token in stale:
+            del state['in_flight'][token]
+
+    def acquire(self, timeout: Optional[float] = None) -> str:
+        """
+        等待获得一个对话名额
+
+        Args:
+            timeout (float, optional): 最长等待时间(秒)，None表示一直等待
+
+        Returns:
+            str: 名额令牌，对话结束后传给release
+
+        Raises:
+            TimeoutError: 超时仍未获得名额
+        """
+        token = f"{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._locked_state() as state:
+                now = time.time()
+                self._purge_stale(state, now)
+                in_flight = len(state['in_flight'])
+                wait_interval = state['last_send'] + state['interval'] - now
+                if in_flight < max(1, int(state['limit'])) and wait_interval <= 0:
+                    state['in_flight'][token] = now
+                    state['last_send'] = now
+                    return token
+
+            sleep_for = max(0.05, min(wait_interval if wait_interval > 0 else 0.2, 1.0))
+            if give_up_at is not None and time.monotonic() + sleep_for > give_up_at:
+                raise TimeoutError("等待对话名额超时")
+            time.sleep(sleep_for)
+
+    def release(self, token: str, latency: float, error: bool = False, empty: bool = False) -> None:
+        """
+        归还名额并根据本次对话结果调整并发数和发送间隔
+
+        Args:
+            token (str): acquire返回的令牌
+            latency (float): 本次对话耗时(秒)
+            error (bool): 是否失败
+            empty (bool): 是否为空回复
+        """
+        with self._locked_state() as state:
+            now = time.time()
+            state['in_flight'].pop(token, None)
+
+            alpha = self.ewma_alpha
+            previous = state['latency_ewma']
+            state['latency_ewma'] = latency if previous is None else (1 - alpha) * previous + alpha * latency
+            state['error_rate'] = (1 - alpha) * state['error_rate'] + alpha * (1.0 if error else 0.0)
+            state['empty_rate'] = (1 - alpha) * state['empty_rate'] + alpha * (1.0 if empty else 0.0)
+
+            congested = error or empty or latency > self.latency_threshold
+            if congested:
+                # 乘性减：同一个往返时间内只减一次，避免同一批并发失败把并发数压到底
+                if now - state['last_decrease'] >= (state['latency_ewma'] or 0):
+                    state['limit'] = max(self.min_limit, state['limit'] * self.decrease_factor)
+                    state['interval'] = min(self.max_interval,
+                                            max(state['interval'], self.min_interval) / self.decrease_factor)
+                    state['last_decrease'] = now
+                    logger.info(f"检测到拥塞，并发数降为 {state['limit']:.2f}，发送间隔 {state['interval']:.1f} 秒")
+            else:
+                # 加性增：每个窗口（limit个成功对话）约增加increase_step
+                state['limit'] = min(self.max_limit,
+                                     state['limit'] + self.increase_step / max(state['limit'], 1.0))
+                state['interval'] = max(self.min_interval,
+                                        state['interval'] - (state['interval'] - self.min_interval) / 2)
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """
+        以with语句获取名额，退出时自动归还；调用方可通过yield的字典标记结果
+
+        Args:
+            timeout (float, optional): 等待名额的最长时间(秒)
+
+        Yields:
+            dict: 结果标记，可设置 'empty' 为True表示空回复
+        """
+        token = self.acquire(timeout)
+        outcome = {'empty': False}
+        start = time.monotonic()
+        try:
+            yield outcome
+        except Exception:
+            self.release(token, time.monotonic() - start, error=True)
+            raise
+        self.release(token, time.monotonic() - start, empty=outcome['empty'])
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        获取控制器当前状态
+
+        Returns:
+            dict: 并发数上限、发送间隔、在途数量、延迟和错误率
+        """
+        with self._thread_lock, FileLock(self.state_file):
+            state = self._load()
+        return {
+            'limit': state['limit'],
+            'interval': state['interval'],
+            'in_flight': len(state['in_flight']),
+            'latency_ewma': state['latency_ewma'],
+            'error_rate': state['error_rate'],
+            'empty_rate': state['empty_rate'],
+        }
+
+
+_controller: Optional[AIMDController] = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> Optional[AIMDController]:
+    """
+    获取进程内共享的并发控制器
+
+    Returns:
+        AIMDController or None: 未启用自适应并发控制时返回None
+    """
+    global _controller
+    if not config.CONCURRENCY_CONFIG.get('enabled', False):
+        return None
+    with _controller_lock:
+        if _controller is None:
+            _controller = AIMDController()
+        return _controller
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+截止时间工具模块
+在一次对话的各个阶段之间传递剩余时间预算
+"""
+
+import time
+from typing import Optional, Union
+
+
+class DeadlineExceeded(Exception):
+    """超过截止时间"""
+    pass
+
+
+class Deadline:
+    """基于单调时钟的截止时间"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        初始化截止时间
+
+        Args:
+            timeout (float, optional): 从现在起的时间预算(秒)，None表示不限时
+        """
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+
+    @classmethod
+    def coerce(cls, value: Union['Deadline', float, int, None]) -> 'Deadline':
+        """
+        将秒数或Deadline统一转换为Deadline
+
+        Args:
+            value (Deadline or float or None): 截止时间对象，或从现在起的秒数
+
+        Returns:
+            Deadline: 截止时间对象
+        """
+        if isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    @property
+    def unlimited(self) -> bool:
+        """是否不限时"""
+        return self.expires_at is None
+
+    def remaining(self) -> float:
+        """
+        剩余时间
+
+        Returns:
+            float: 剩余秒数，不限时返回无穷大
+        """
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        """是否已过截止时间"""
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cap(self, timeout: float) -> float:
+        """
+        用剩余时间限制给定的超时时间
+
+        Args:
+            timeout (float): 原超时时间(秒)
+
+        Returns:
+            float: 不超过剩余时间的超时时间
+        """
+        return min(timeout, self.remaining())
+
+    def check(self, phase: str = '') -> None:
+        """
+        检查是否已过截止时间
+
+        Args:
+            phase (str): 当前阶段名称，用于错误信息
+
+        Raises:
+            DeadlineExceeded: 已过截止时间
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"已超过截止时间{f'（阶段: {phase}）' if phase else ''}")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批内近似重复问题检测模块
+用MinHash签名估计字符shingle集合的Jaccard相似度，通过LSH分桶只比较同桶的候选，
+整体开销与输入规模近似线性。
+"""
+
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from src.utils.similarity import hash_ngrams, normalize_batch
+import config
+
+# shingle哈希值的范围（31位）
+_SHINGLE_SPACE = (1 << 31) - 1
+_MAX_HASH = np.uint64(0xFFFFFFFFFFFFFFFF)
+_MIX_MULTIPLIER = np.uint64(0xBF58476D1CE4E5B9)
+_BAND_PRIME = np.uint64(1000003)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """64位整数混合函数（splitmix64的最终化步骤），使线性变换后的值接近随机置换"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * _MIX_MULTIPLIER
+    return values ^ (values >> np.uint64(31))
+
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = 64, shingle_size: int = 3,
+                       seed: int = 1) -> np.ndarray:
+    """
+    批量计算文本的MinHash签名
+
+    Args:
+        texts (list): 文本
+        num_perm (int): 置换（签名）数量
+        shingle_size (int): 字符shingle长度，短于该长度的文本使用其全部1..shingle_size字符片段
+        seed (int): 随机种子，相同种子得到可比较的签名
+
+    Returns:
+        np.ndarray: 形状为(文本数, num_perm)的签名矩阵
+    """
+    count = len(texts)
+    normalized = normalize_batch(texts)
+    docs, shingles = hash_ngrams(normalized, (shingle_size, shingle_size), _SHINGLE_SPACE)
+
+    short = np.flatnonzero(np.bincount(docs, minlength=count) == 0)
+    if short.size:
+        short_docs, short_shingles = hash_ngrams([normalized[i] for i in short],
+                                                 (1, shingle_size), _SHINGLE_SPACE)
+        docs = np.concatenate([docs, short[short_docs]])
+        shingles = np.concatenate([shingles, short_shingles])
+
+    signatures = np.full((count, num_perm), _MAX_HASH, dtype=np.uint64)
+    if docs.size == 0:
+        return signatures
+
+    order = np.argsort(docs, kind='stable')
+    docs = docs[order]
+    shingles = shingles[order].astype(np.uint64)
+    starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+    b = rng.randint(0, 1 << 62, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    # 按列分块计算，限制中间矩阵的大小
+    chunk = max(1, 4000000 // docs.size)
+    for begin in range(0, num_perm, chunk):
+        end = min(num_perm, begin + chunk)
+        hashed = _mix(shingles[:, None] * a[None, begin:end] + b[None, begin:end])
+        signatures[docs[starts], begin:end] = np.minimum.reduceat(hashed, starts, axis=0)
+    return signatures
+
+
+def cluster_near_duplicates(texts: Sequence[str], threshold: float = None, num_perm: int = None,
+                            bands: int = None, shingle_size: int = None) -> List[int]:
+    """
+    将近似重复的文本聚类，每类以最先出现的文本作为代表
+
+    签名分为bands段，任意一段完全相同的文本成为候选，再用签名估计的Jaccard相似度确认。
+
+    Args:
+        texts (list): 文本
+        threshold (float, optional): 判定为重复的最低Jaccard相似度，默认使用配置
+        num_perm (int, optional): MinHash签名长度，默认使用配置
+        bands (int, optional): LSH分段数，需整除num_perm，默认使用配置
+        shingle_size (int, optional): 字符shingle长度，默认使用配置
+
+    Returns:
+        list: 每个文本所属类的代表序号，代表自身的序号等于其位置
+    """
+    dedup_config = config.DEDUP_CONFIG
+    threshold = dedup_config.get('threshold', 0.85) if threshold is None else threshold
+    num_perm = num_perm or dedup_config.get('num_perm', 64)
+    bands = bands or dedup_config.get('bands', 16)
+    shingle_size = shingle_size or dedup_config.get('shingle_size', 3)
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) 必须能被 bands ({bands}) 整除")
+
+    count = len(texts)
+    parent = list(range(count))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if count < 2:
+        return parent
+
+    signatures = minhash_signatures(texts, num_perm, shingle_size)
+    rows = num_perm // bands
+    for band in range(bands):
+        block = signatures[:, band * rows:(band + 1) * rows]
+        keys = np.zeros(count, dtype=np.uint64)
+        for column in range(rows):
+            keys = keys * _BAND_PRIME + block[:, column]
+
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        run_start = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        # 同桶内以序号最小的文本为基准，一次性估计其余文本与它的相似度
+        leaders = order[np.maximum.accumulate(np.where(run_start, np.arange(count), 0))]
+        candidates = np.flatnonzero(~run_start)
+        if candidates.size == 0:
+            continue
+        members = order[candidates]
+        similarity = (signatures[members] == signatures[leaders[candidates]]).mean(axis=1)
+
+        accepted = similarity >= threshold
+        for member, leader in zip(members[accepted], leaders[candidates][accepted]):
+            root_member, root_leader = find(int(member)), find(int(leader))
+            if root_member != root_leader:
+                # 始终以较小的序号为根，使代表为最先出现的文本
+                parent[max(root_member, root_leader)] = min(root_member, root_leader)
+
+    return [find(i) for i in range(count)]
+
+
+def fan_out(questions: Sequence[str], representatives: Sequence[int],
+            answered: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    将代表问题的结果复制给同类的每一行，结果按输入顺序排列
+
+    Args:
+        questions (list): 全部问题
+        representatives (list): cluster_near_duplicates返回的代表序号
+        answered (dict): 代表序号 -> 结果记录
+
+    Returns:
+        list: 每个问题一条结果，复制来的结果带有 'duplicate_of' 字段（代表问题的行号，从1开始）
+    """
+    results = []
+    for index, question in enumerate(questions):
+        representative = representatives[index]
+        result = answered[representative]
+        if representative != index:
+            result = dict(result, question=question, duplicate_of=representative + 1)
+        results.append(result)
+    return results
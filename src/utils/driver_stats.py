@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+WebDriver命令统计模块
+包装浏览器实例的execute方法（每个WebDriver命令对应一次HTTP请求），
+统计各命令的次数和耗时，并记录每个线程当前正在等待的命令，用于基准测试和性能分析。
+每个线程还单独累计WebDriver调用期间本线程消耗的CPU时间（客户端序列化请求、解析响应），
+耗时减去这部分才是真正阻塞在浏览器上的时间。
+"""
+
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+# 挂在浏览器实例上的统计对象属性名
+_STATS_ATTRIBUTE = '_buaa_command_stats'
+
+# 线程ID -> 正在执行的WebDriver命令
+_active_commands: Dict[int, str] = {}
+# 线程ID -> [命令次数, 累计耗时, 累计本线程CPU时间]
+_thread_totals: Dict[int, list] = {}
+_thread_lock = threading.Lock()
+
+
+class CommandStats:
+    """一个浏览器实例的WebDriver命令统计"""
+
+    def __init__(self):
+        """初始化"""
+        self._lock = threading.Lock()
+        self.count = 0
+        self.seconds = 0.0
+        self.by_command: Dict[str, int] = {}
+
+    def add(self, command: str, seconds: float) -> None:
+        """
+        记录一次命令
+
+        Args:
+            command (str): 命令名称，如 executeScript、findElement
+            seconds (float): 耗时(秒)
+        """
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.by_command[command] = self.by_command.get(command, 0) + 1
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        获取当前的累计值
+
+        Returns:
+            dict: count（命令次数）和 seconds（累计耗时）
+        """
+        with self._lock:
+            return {'count': self.count, 'seconds': self.seconds}
+
+
+def instrument(driver) -> Optional[CommandStats]:
+    """
+    为浏览器实例启用命令统计（重复调用返回同一个统计对象）
+
+    Args:
+        driver (WebDriver): 浏览器实例
+
+    Returns:
+        CommandStats or None: 统计对象，driver为None时返回None
+    """
+    if driver is None:
+        return None
+    stats = getattr(driver, _STATS_ATTRIBUTE, None)
+    if stats is not None:
+        return stats
+
+    stats = CommandStats()
+    execute = driver.execute
+
+    def timed_execute(driver_command, params=None):
+        thread_id = threading.get_ident()
+        _active_commands[thread_id] = driver_command
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            return execute(driver_command, params)
+        finally:
+            cpu = time.thread_time() - cpu_start
+            elapsed = time.perf_counter() - start
+            _active_commands.pop(thread_id, None)
+            stats.add(driver_command, elapsed)
+            with _thread_lock:
+                totals = _thread_totals.setdefault(thread_id, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+                totals[2] += cpu
+
+    driver.execute = timed_execute
+    setattr(driver, _STATS_ATTRIBUTE, stats)
+    return stats
+
+
+def active_command(thread_id: int) -> Optional[str]:
+    """
+    获取线程当前正在等待的WebDriver命令
+
+    Args:
+        thread_id (int): 线程ID
+
+    Returns:
+        str or None: 命令名称，不在WebDriver调用中时返回None
+    """
+    return _active_commands.get(thread_id)
+
+
+def thread_totals(thread_id: Optional[int] = None) -> Tuple[int, float, float]:
+    """
+    获取线程累计执行的WebDriver命令次数、耗时和其间消耗的本线程CPU时间（所有已启用统计的浏览器实例合计）
+
+    Args:
+        thread_id (int, optional): 线程ID，默认为当前线程
+
+    Returns:
+        tuple: (命令次数, 累计耗时秒数, 其中本线程CPU秒数)
+    """
+    if thread_id is None:
+        thread_id = threading.get_ident()
+    with _thread_lock:
+        count, seconds, cpu = _thread_totals.get(thread_id, (0, 0.0, 0.0))
+    return count, seconds, cpu
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+文件锁工具模块
+基于操作系统的建议性文件锁，用于多个进程协调访问同一文件
+"""
+
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLockTimeout(Exception):
+    """获取文件锁超时"""
+    pass
+
+
+class FileLock:
+    """
+    跨进程的建议性文件锁
+
+    在目标文件旁创建 .lock 文件并加锁，支持with语句。
+    同一进程内的多个线程应各自使用独立的FileLock实例。
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0, poll_interval: float = 0.05):
+        """
+        初始化文件锁
+
+        Args:
+            path (str): 要保护的文件路径，锁文件为 path + '.lock'
+            timeout (float): 获取锁的超时时间(秒)
+            poll_interval (float): 重试获取锁的间隔(秒)
+        """
+        self.lock_path = path + '.lock'
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    def _try_lock(self) -> bool:
+        """尝试以非阻塞方式加锁"""
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self) -> None:
+        """
+        获取锁
+
+        Raises:
+            FileLockTimeout: 超时仍未获取到锁
+        """
+        directory = os.path.dirname(self.lock_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT)
+
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                os.close(self._fd)
+                self._fd = None
+                raise FileLockTimeout(f"获取文件锁超时: {self.lock_path}")
+            time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+        """释放锁"""
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对数分桶直方图模块
+每轮对话的端到端延迟、首字延迟和回答长度记入按相对误差分桶的直方图：
+同样参数的直方图可以直接相加合并，分位数的相对误差有上界。
+直方图按 (指标, 助手类型, 日期, 工具版本) 分组，定期合并写入文件，跨多次运行累积。
+"""
+
+import os
+import math
+import json
+import atexit
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src import __version__
+from src.utils.filelock import FileLock
+from src.utils.logger import get_logger
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+# 每轮对话记录的指标
+TURN_LATENCY = 'turn.latency'  # 端到端延迟（秒）
+TURN_FIRST_CHAR = 'turn.first_char'  # 发送后到出现第一个回复字符的时间（秒）
+TURN_ANSWER_CHARS = 'turn.answer_chars'  # 回答长度（字符）
+
+_METRIC_NAMES = {
+    TURN_LATENCY: '端到端延迟(秒)',
+    TURN_FIRST_CHAR: '首字延迟(秒)',
+    TURN_ANSWER_CHARS: '回答长度(字符)',
+}
+
+HistogramKey = Tuple[str, str, str, str]  # (指标, 助手类型, 日期, 工具版本)
+
+
+class LogHistogram:
+    """
+    对数分桶直方图
+
+    第i个桶覆盖 (gamma^(i-1), gamma^i]，gamma = (1+a)/(1-a)，a为相对误差；
+    分位数取桶的中点估计，相对误差不超过a。非正值单独计数。
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        初始化
+
+        Args:
+            relative_accuracy (float): 分位数的相对误差上界
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float, count: int = 1) -> None:
+        """
+        记录一个值
+
+        Args:
+            value (float): 观测值
+            count (int): 次数
+        """
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+        self.total += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'LogHistogram') -> 'LogHistogram':
+        """
+        把另一个直方图合并进来
+
+        Args:
+            other (LogHistogram): 相对误差相同的直方图
+
+        Returns:
+            LogHistogram: self
+
+        Raises:
+            ValueError: 两个直方图的相对误差不同，无法合并
+        """
+        if not math.isclose(self.relative_accuracy, other.relative_accuracy):
+            raise ValueError(f"相对误差不同的直方图无法合并: {self.relative_accuracy} != {other.relative_accuracy}")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> Optional[float]:
+        """平均值，没有数据时为None"""
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        估计分位数
+
+        Args:
+            q (float): 0到1之间的分位点
+
+        Returns:
+            float or None: 分位数估计值（限制在最小值和最大值之间），没有数据时为None
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                estimate = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        转换为可JSON序列化的字典
+
+        Returns:
+            dict: 直方图数据
+        """
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'buckets': {str(index): count for index, count in self.buckets.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'total': self.total,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LogHistogram':
+        """
+        从字典创建直方图
+
+        Args:
+            data (dict): to_dict的结果
+
+        Returns:
+            LogHistogram: 直方图
+        """
+        histogram = cls(data.get('relative_accuracy', 0.01))
+        histogram.buckets = {int(index): count for index, count in (data.get('buckets') or {}).items()}
+        histogram.zero_count = data.get('zero_count', 0)
+        histogram.count = data.get('count', 0)
+        histogram.total = data.get('total', 0.0)
+        if histogram.count:
+            histogram.min = data.get('min', 0.0)
+            histogram.max = data.get('max', 0.0)
+        return histogram
+
+
+def _encode_key(key: HistogramKey) -> str:
+    return '|'.join(key)
+
+
+def _decode_key(text: str) -> HistogramKey:
+    metric, assistant_type, day, version = text.split('|', 3)
+    return metric, assistant_type, day, version
+
+
+def load_histograms(file_path: Optional[str] = None) -> Dict[HistogramKey, LogHistogram]:
+    """
+    读取持久化的直方图
+
+    Args:
+        file_path (str, optional): 直方图文件路径，默认使用配置
+
+    Returns:
+        dict: (指标, 助手类型, 日期, 工具版本) -> 直方图，文件不存在或无法解析时为空
+    """
+    file_path = file_path or config.LATENCY_CONFIG.get('histogram_file')
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"读取延迟直方图失败: {str(e)}")
+        return {}
+    return {_decode_key(key): LogHistogram.from_dict(value) for key, value in data.items()}
+
+
+class HistogramRecorder:
+    """
+    进程内的直方图记录器
+
+    记录先累积在内存中，flush时在文件锁内与文件中的直方图合并后原子写回，
+    多个进程、多次运行的记录都累积在同一个文件中。
+    """
+
+    def __init__(self, file_path: Optional[str] = None, relative_accuracy: Optional[float] = None):
+        """
+        初始化
+
+        Args:
+            file_path (str, optional): 直方图文件路径，默认使用配置
+            relative_accuracy (float, optional): 分位数的相对误差上界，默认使用配置
+        """
+        latency_config = config.LATENCY_CONFIG
+        self.file_path = file_path or latency_config.get('histogram_file')
+        self.relative_accuracy = relative_accuracy or latency_config.get('relative_accuracy', 0.01)
+        self.version = __version__
+        self._lock = threading.Lock()
+        self._pending: Dict[HistogramKey, LogHistogram] = {}  # 尚未写入文件的记录
+        self.run: Dict[HistogramKey, LogHistogram] = {}  # 本次运行的全部记录
+
+    def record(self, metric: str, value: float, assistant_type: str) -> None:
+        """
+        记录一个观测值
+
+        Args:
+            metric (str): 指标名称
+            value (float): 观测值
+            assistant_type (str): 助手类型
+        """
+        key = (metric, assistant_type, datetime.now().strftime('%Y-%m-%d'), self.version)
+        with self._lock:
+            for histograms in (self._pending, self.run):
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = LogHistogram(self.relative_accuracy)
+                histogram.record(value)
+
+    def flush(self) -> bool:
+        """
+        把内存中的记录合并写入文件
+
+        Returns:
+            bool: 是否写入成功（失败的记录保留，下次再写）
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return True
+
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            with FileLock(self.file_path):
+                histograms = load_histograms(self.file_path)
+                for key, histogram in pending.items():
+                    if key in histograms:
+                        histograms[key].merge(histogram)
+                    else:
+                        histograms[key] = histogram
+                tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({_encode_key(key): histogram.to_dict() for key, histogram in histograms.items()}, f)
+                os.replace(tmp_path, self.file_path)
+            return True
+        except Exception as e:
+            logger.warning(f"写入延迟直方图失败: {str(e)}")
+            with self._lock:
+                for key, histogram in pending.items():
+                    if key in self._pending:
+                        histogram.merge(self._pending[key])
+                    self._pending[key] = histogram
+            return False
+
+
+_recorder: Optional[HistogramRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> Optional[HistogramRecorder]:
+    """
+    获取进程内共享的直方图记录器
+
+    Returns:
+        HistogramRecorder or None: 未启用延迟直方图时返回None
+    """
+    global _recorder
+    if not config.LATENCY_CONFIG.get('enabled', True):
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = HistogramRecorder()
+            atexit.register(_recorder.flush)
+        return _recorder
+
+
+def record_turn(assistant_type: str, latency: float, first_char: Optional[float], answer_chars: int) -> None:
+    """
+    记录一轮对话的延迟、首字延迟和回答长度
+
+    Args:
+        assistant_type (str): 助手类型
+        latency (float): 端到端延迟(秒)
+        first_char (float, optional): 首字延迟(秒)，未观察到增量回复时为None
+        answer_chars (int): 回答长度(字符)
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    recorder.record(TURN_LATENCY, latency, assistant_type)
+    if first_char is not None:
+        recorder.record(TURN_FIRST_CHAR, first_char, assistant_type)
+    recorder.record(TURN_ANSWER_CHARS, answer_chars, assistant_type)
+
+
+def flush_histograms() -> bool:
+    """
+    把本进程尚未写入的记录写入文件
+
+    Returns:
+        bool: 是否写入成功（未启用时返回True）
+    """
+    if _recorder is None:
+        return True
+    return _recorder.flush()
+
+
+def _format_value(metric: str, value: Optional[float]) -> str:
+    if value is None:
+        return '-'
+    return f"{value:.0f}" if metric == TURN_ANSWER_CHARS else f"{value:.2f}"
+
+
+def format_report(histograms: Dict[HistogramKey, LogHistogram], group_by: Iterable[str] = ('assistant', 'day', 'version'),
+                  quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> str:
+    """
+    生成分位数报告，对照配置中的SLO标出超出目标的分位数
+
+    Args:
+        histograms (dict): (指标, 助手类型, 日期, 工具版本) -> 直方图
+        group_by (iterable): 分组维度，assistant、day、version的任意组合，未列出的维度合并
+        quantiles (iterable): 报告的分位点
+
+    Returns:
+        str: 报告文本
+    """
+    dimensions = {'assistant': 1, 'day': 2, 'version': 3}
+    positions = [dimensions[name] for name in group_by]
+    quantiles = list(quantiles)
+    slo = config.LATENCY_CONFIG.get('slo', {})
+
+    grouped: Dict[Tuple[str, ...], LogHistogram] = {}
+    for key, histogram in histograms.items():
+        group = (key[0],) + tuple(key[position] for position in positions)
+        if group in grouped:
+            grouped[group].merge(histogram)
+        else:
+            grouped[group] = LogHistogram(histogram.relative_accuracy).merge(histogram)
+
+    if not grouped:
+        return "没有延迟记录"
+
+    header = ['指标'] + [{'assistant': '助手', 'day': '日期', 'version': '版本'}[name] for name in group_by] \
+        + ['次数'] + [f"p{q * 100:g}" for q in quantiles]
+    rows: List[List[str]] = []
+    violations = 0
+    for group in sorted(grouped):
+        metric = group[0]
+        histogram = grouped[group]
+        cells = []
+        for q in quantiles:
+            value = histogram.quantile(q)
+            cell = _format_value(metric, value)
+            target = slo.get(metric, {}).get(f"p{q * 100:g}")
+            if target is not None and value is not None and value > target:
+                cell += f" (>{target:g}!)"
+                violations += 1
+            cells.append(cell)
+        rows.append([_METRIC_NAMES.get(metric, metric)] + list(group[1:]) + [str(histogram.count)] + cells)
+
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in [header] + rows]
+    if slo:
+        lines.append(f"超出SLO目标的分位数: {violations} 个" if violations else "所有分位数均满足SLO目标")
+    return '\n'.join(lines)
+
+
+def run_report() -> str:
+    """
+    本次运行中记录的延迟报告（按助手类型分组）
+
+    Returns:
+        str: 报告文本
+    """
+    if _recorder is None:
+        return "没有延迟记录"
+    with _recorder._lock:
+        histograms = {key: LogHistogram(h.relative_accuracy).merge(h) for key, h in _recorder.run.items()}
+    return format_report(histograms, group_by=('assistant',))
@@ -7,8 +7,8 @@ HTTP请求工具模块
 
 import requests
 import time
+import math
 import json
-from retry import retry
 from urllib.parse import urljoin
 from fake_useragent import UserAgent
 import logging
@@ -39,6 +39,7 @@ class HTTPClient:
         self.timeout = timeout or config.ASSISTANT_CONFIG.get('timeout', 60)
         self.max_retries = max_retries or config.ASSISTANT_CONFIG.get('max_retries', 3) 
         self.retry_delay = retry_delay or config.ASSISTANT_CONFIG.get('retry_delay', 2)
+        self.max_retry_after = config.ASSISTANT_CONFIG.get('max_retry_after', 30)
         
         # 创建会话
         self.session = requests.Session()
@@ -106,11 +107,50 @@ class HTTPClient:
         except Exception as e:
             logger.debug(f"Failed to parse response: {str(e)}")
     
-    @retry(tries=3, delay=2, backoff=2, logger=logger)
+    def _retry_delay(self, error, attempt):
+        """
+        根据失败类型决定是否重试以及重试前的等待时间
+        
+        Args:
+            error (requests.exceptions.RequestException): 请求异常
+            attempt (int): 已尝试次数（从1开始）
+            
+        Returns:
+            float or None: 重试前等待的秒数，None表示不应重试
+        """
+        backoff = self.retry_delay * (2 ** (attempt - 1))
+        
+        if isinstance(error, requests.exceptions.HTTPError):
+            response = error.response
+            status = response.status_code if response is not None else 0
+            if status == 429 or status >= 500:
+                # 服务端限流或错误，优先遵循Retry-After（截断到上限，无效值改用指数退避）
+                retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    return backoff
+                if not math.isfinite(delay) or delay < 0:
+                    return backoff
+                return min(delay, self.max_retry_after)
+            # 其他4xx错误重试也无法成功
+            return None
+        
+        if isinstance(error, requests.exceptions.Timeout):
+            return backoff
+        
+        if isinstance(error, requests.exceptions.ConnectionError):
+            # 连接池中的连接被服务端关闭是常见的瞬时错误，首次立即重试
+            return 0 if attempt == 1 else backoff
+        
+        return None
+    
     def request(self, method, url, **kwargs):
         """
         发送HTTP请求
         
+        连接错误首次立即重试，超时和服务端错误指数退避重试，其他客户端错误不重试。
+        
         Args:
             method (str): 请求方法
             url (str): 请求URL
@@ -129,21 +169,28 @@ class HTTPClient:
         # 记录请求日志
         self._log_request(method, full_url, **kwargs)
         
-        # 发送请求
-        try:
-            response = self.session.request(method, full_url, **kwargs)
-            
-            # 记录响应日志
-            self._log_response(response)
-            
-            # 检查响应状态码
-            response.raise_for_status()
+        attempts = max(1, self.max_retries)
+        for attempt in range(1, attempts + 1):
+            # 发送请求
+            try:
+                response = self.session.request(method, full_url, **kwargs)
+                
+                # 记录响应日志
+                self._log_response(response)
+                
+                # 检查响应状态码
+                response.raise_for_status()
+                
+                return response
             
-            return response
-        
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request failed: {method.upper()} {full_url}, error: {str(e)}")
-            raise
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Request failed: {method.upper()} {full_url}, error: {str(e)}")
+                delay = self._retry_delay(e, attempt)
+                if delay is None or attempt >= attempts:
+                    raise
+                logger.warning(f"第 {attempt} 次请求失败，{delay:.1f} 秒后重试")
+                if delay:
+                    time.sleep(delay)
     
     def get(self, url, params=None, **kwargs):
         """
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+增量读取回复文本模块
+在页面中安装累加器，每次轮询只通过WebDriver传回上次读取位置之后新增的字符，
+Python端在本地拼接出完整文本，长回复的轮询开销与新增内容成正比。
+"""
+
+from typing import Optional
+
+from src.utils.logger import get_logger
+from src.utils import metrics
+
+# 获取日志记录器
+logger = get_logger()
+
+# 页面端累加器：优先读取md-editor的Markdown源码（与最终回复的提取方式一致），
+# 否则按块级元素插入换行拼接textContent（不触发布局计算）；
+# 记录每个元素上次返回的文本，调用方给出的偏移之前的内容发生变化（如重新渲染）时从头返回
+_READ_SCRIPT = """
+if (!window.__buaaReplyReader) {
+    const BLOCK = /^(P|DIV|LI|UL|OL|PRE|H[1-6]|BLOCKQUOTE|TABLE|THEAD|TBODY|TR|HR|SECTION|DETAILS)$/;
+    const collect = function (node, out) {
+        for (let child = node.firstChild; child; child = child.nextSibling) {
+            if (child.nodeType === 3) {
+                out.push(child.nodeValue);
+            } else if (child.nodeType === 1) {
+                if (child.tagName === 'BR') { out.push('\\n'); continue; }
+                if (child.tagName === 'SCRIPT' || child.tagName === 'STYLE') { continue; }
+                const block = BLOCK.test(child.tagName);
+                if (block && out.length && !out[out.length - 1].endsWith('\\n')) { out.push('\\n'); }
+                collect(child, out);
+                if (block) { out.push('\\n'); }
+            }
+        }
+        return out;
+    };
+    const source = function (id, element) {
+        const textarea = document.getElementById(id.replace(/-preview$/, '-textarea'));
+        if (textarea && textarea.value) { return textarea.value; }
+        let instance = element.__vueParentComponent;
+        for (let depth = 0; instance && depth < 20; depth++, instance = instance.parent) {
+            const props = instance.props || {};
+            for (const key of ['modelValue', 'text', 'value']) {
+                if (typeof props[key] === 'string' && props[key].trim()) { return props[key]; }
+            }
+        }
+        return null;
+    };
+    window.__buaaReplyTexts = {};
+    window.__buaaReplyReader = function (id, offset) {
+        const element = document.getElementById(id);
+        if (!element) { return null; }
+        const markdown = source(id, element);
+        const text = (markdown !== null ? markdown : collect(element, []).join('').replace(/\\n{3,}/g, '\\n\\n')).trim();
+        const previous = window.__buaaReplyTexts[id] || '';
+        window.__buaaReplyTexts[id] = text;
+        let start = Math.min(offset, previous.length);
+        if (text.length < start || text.substring(0, start) !== previous.substring(0, start)) {
+            start = 0;
+        }
+        return {start: start, delta: text.substring(start), length: text.length, markdown: markdown !== null};
+    };
+}
+return window.__buaaReplyReader(arguments[0], arguments[1]);
+"""
+
+
+class IncrementalTextReader:
+    """
+    增量读取页面元素的文本
+
+    每轮对话创建一个实例；页面重新加载后累加器随之丢失，会自动重新安装并从头读取。
+    """
+
+    def __init__(self, driver):
+        """
+        初始化
+
+        Args:
+            driver (WebDriver): 浏览器实例
+        """
+        self.driver = driver
+        self.element_id: Optional[str] = None
+        self.text = ''
+        # 最近一次读取的是否为Markdown源码；为False时文本来自textContent，与最终回复的格式不同
+        self.from_markdown = True
+
+    def read(self, element_id: str) -> Optional[str]:
+        """
+        读取元素当前的完整文本，只传输上次读取之后新增的部分
+
+        Args:
+            element_id (str): 元素ID
+
+        Returns:
+            str or None: 元素的完整文本，元素不存在时返回None
+        """
+        if element_id != self.element_id:
+            self.element_id = element_id
+            self.text = ''
+
+        result = self.driver.execute_script(_READ_SCRIPT, element_id, len(self.text))
+        if not result:
+            return None
+
+        self.from_markdown = bool(result.get('markdown', True))
+        start = int(result.get('start', 0))
+        delta = result.get('delta') or ''
+        text = self.text[:start] + delta
+        metrics.increment('reply.transferred_chars', len(delta))
+        # 长度不一致说明两端记录的文本已不同步，下次从头读取
+        if len(text) != result.get('length', len(text)):
+            logger.debug("增量读取的文本长度与页面不一致，下次从头读取")
+            self.text = ''
+        else:
+            self.text = text
+        return text
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+会话保活模块
+后台线程定期用已认证的requests会话访问助手页面，保持统一认证会话活跃；
+会话失效或cookie即将过期时提前通过requests重新登录，由对话线程在两轮对话之间把新cookies同步到浏览器。
+"""
+
+import time
+import threading
+from typing import Callable, Optional
+
+from src.utils.logger import get_logger
+from src.utils import metrics
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class SessionKeepalive:
+    """
+    会话保活线程
+
+    只使用requests会话，不操作浏览器（WebDriver不是线程安全的）；
+    重新登录成功后调用on_refresh，由调用方在合适的时机更新浏览器。
+    """
+
+    def __init__(self, auth, url: str, on_refresh: Optional[Callable[[], None]] = None,
+                 interval: Optional[float] = None, margin: Optional[float] = None):
+        """
+        初始化保活线程（需调用start启动）
+
+        Args:
+            auth (BUAAAuth): 认证对象
+            url (str): 用于检查和保持登录状态的页面
+            on_refresh (callable, optional): 重新登录成功后的回调
+            interval (float, optional): 检查间隔(秒)，默认使用配置
+            margin (float, optional): cookie过期前多少秒提前重新登录，默认使用配置
+        """
+        auth_config = config.AUTH_CONFIG
+        self.auth = auth
+        self.url = url
+        self.on_refresh = on_refresh
+        self.interval = interval or auth_config.get('keepalive_interval', 300)
+        self.margin = auth_config.get('keepalive_margin', 120) if margin is None else margin
+        self.refreshes = 0
+        # 重新登录后仍然很快过期的cookie（站点本身的有效期短于margin）不再触发提前登录
+        self._short_lived_expiry: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'SessionKeepalive':
+        """启动保活线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-keepalive", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        """
+        停止保活线程
+
+        Args:
+            timeout (float, optional): 等待线程结束的最长时间(秒)
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _tracked_expiry(self) -> Optional[float]:
+        """需要跟踪的cookie过期时间"""
+        expiry = self.auth.cookie_expiry()
+        return None if expiry == self._short_lived_expiry else expiry
+
+    def next_check_delay(self) -> float:
+        """距离下一次检查的秒数：默认按固定间隔，cookie临近过期时提前到过期前margin秒"""
+        delay = self.interval
+        expiry = self._tracked_expiry()
+        if expiry is not None:
+            delay = min(delay, expiry - self.margin - time.time())
+        return max(delay, 1.0)
+
+    def check(self) -> bool:
+        """
+        检查一次会话，需要时重新登录
+
+        Returns:
+            bool: 检查后会话是否有效
+        """
+        expiry = self._tracked_expiry()
+        expiring = expiry is not None and expiry - time.time() <= self.margin
+        # 不使用缓存：这次请求本身就是保活请求，同时刷新对话线程读取的缓存
+        required = self.auth.is_login_required(self.url, use_cache=False)
+        metrics.increment('keepalive.checks')
+        if not required and not expiring:
+            return True
+
+        logger.info("统一认证会话" + ("已失效" if required else "即将过期") + "，后台重新登录")
+        self.auth.invalidate_login_cache()
+        if not self.auth.login_with_requests():
+            metrics.increment('keepalive.failures')
+            logger.warning("后台重新登录失败，将在对话时按原流程登录")
+            return False
+
+        self.refreshes += 1
+        expiry = self.auth.cookie_expiry()
+        if expiry is not None and expiry - time.time() <= self.margin:
+            self._short_lived_expiry = expiry
+        metrics.increment('keepalive.refreshes')
+        if self.on_refresh is not None:
+            try:
+                self.on_refresh()
+            except Exception as e:
+                logger.warning(f"会话刷新回调出错: {str(e)}")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.next_check_delay()):
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"会话保活检查出错: {str(e)}")
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+回复Markdown提取模块
+优先在一次脚本调用中读取md-editor组件的Markdown源码（隐藏的textarea或Vue组件的modelValue），
+无法读取时取预览元素的innerHTML，在Python端用lxml转换为Markdown，保留代码块、表格和列表结构。
+"""
+
+import re
+from typing import List, Optional
+
+from lxml import html as lxml_html
+
+from src.utils.logger import get_logger
+from src.utils import metrics
+
+# 获取日志记录器
+logger = get_logger()
+
+# 按预览元素ID查找Markdown源码：同一编辑器的textarea -> 祖先Vue组件的modelValue/text -> 预览的innerHTML
+MARKDOWN_SOURCE_SCRIPT = """
+const preview = document.getElementById(arguments[0]);
+if (!preview) { return null; }
+const textarea = document.getElementById(arguments[0].replace(/-preview$/, '-textarea'));
+if (textarea && textarea.value) { return {source: 'textarea', markdown: textarea.value}; }
+let instance = preview.__vueParentComponent;
+for (let depth = 0; instance && depth < 20; depth++, instance = instance.parent) {
+    const props = instance.props || {};
+    for (const key of ['modelValue', 'text', 'value']) {
+        if (typeof props[key] === 'string' && props[key].trim()) {
+            return {source: 'vue', markdown: props[key]};
+        }
+    }
+}
+return {source: 'html', html: preview.innerHTML};
+"""
+
+# md-editor渲染时附加的界面元素（代码块标题栏、复制按钮、行号），转换时忽略
+_SKIP_CLASS = re.compile(r'(code-head|copy-button|code-lang|code-action|md-editor-collapse-tips)')
+_BLOCK_TAGS = {'p', 'div', 'section', 'pre', 'ul', 'ol', 'table', 'blockquote', 'hr',
+               'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'details', 'figure'}
+
+
+def _skipped(element) -> bool:
+    if element.get('rn-wrapper') is not None or element.tag in ('script', 'style', 'button', 'svg'):
+        return True
+    return bool(_SKIP_CLASS.search(element.get('class', '')))
+
+
+def _inline(element) -> str:
+    """转换行内内容"""
+    parts = [element.text or '']
+    for child in element:
+        if isinstance(child.tag, str) and not _skipped(child):
+            parts.append(_inline_element(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def _inline_element(element) -> str:
+    tag = element.tag
+    if tag == 'br':
+        return '\n'
+    if tag in ('strong', 'b'):
+        text = _inline(element).strip()
+        return f"**{text}**" if text else ''
+    if tag in ('em', 'i'):
+        text = _inline(element).strip()
+        return f"*{text}*" if text else ''
+    if tag in ('del', 's'):
+        return f"~~{_inline(element).strip()}~~"
+    if tag == 'code':
+        code = element.text_content()
+        fence = '``' if '`' in code else '`'
+        return f"{fence}{code}{fence}"
+    if tag == 'a':
+        text = _inline(element).strip()
+        href = element.get('href', '')
+        return f"[{text}]({href})" if href and text != href else text
+    if tag == 'img':
+        return f"![{element.get('alt', '')}]({element.get('src', '')})"
+    if tag in _BLOCK_TAGS or tag == 'li':
+        return _block(element).strip()
+    return _inline(element)
+
+
+def _code_block(pre) -> str:
+    code = pre.find('.//code')
+    node = code if code is not None else pre
+    language = ''
+    match = re.search(r'language-([\w+#.-]+)', node.get('class', ''))
+    if match:
+        language = match.group(1)
+    # 行号等附加元素不属于代码内容
+    for extra in node.xpath('.//*[@rn-wrapper]'):
+        extra.drop_tree()
+    text = node.text_content().rstrip('\n')
+    fence = '````' if '```' in text else '```'
+    return f"{fence}{language}\n{text}\n{fence}"
+
+
+def _list(element, depth: int) -> str:
+    ordered = element.tag == 'ol'
+    start = int(element.get('start', 1) or 1)
+    lines = []
+    for number, item in enumerate((child for child in element if child.tag == 'li'), start):
+        marker = f"{number}." if ordered else '-'
+        indent = '   ' * depth if ordered else '  ' * depth
+        body_parts = [item.text or '']
+        nested = []
+        for child in item:
+            if not isinstance(child.tag, str) or _skipped(child):
+                body_parts.append(child.tail or '')
+                continue
+            if child.tag in ('ul', 'ol'):
+                nested.append(_list(child, depth + 1))
+            elif child.tag in ('p', 'div'):
+                body_parts.append(_inline(child).strip() + ' ')
+            else:
+                body_parts.append(_inline_element(child))
+            body_parts.append(child.tail or '')
+        body = re.sub(r'\s*\n\s*', ' ', ''.join(body_parts)).strip()
+        # 任务列表复选框
+        checkbox = item.find('input')
+        if checkbox is not None and checkbox.get('type') == 'checkbox':
+            body = ('[x] ' if checkbox.get('checked') is not None else '[ ] ') + body
+        lines.append(f"{indent}{marker} {body}")
+        lines.extend(nested)
+    return '\n'.join(lines)
+
+
+def _table(table) -> str:
+    rows = []
+    for row in table.iter('tr'):
+        cells = [re.sub(r'\s+', ' ', _inline(cell)).strip().replace('|', '\\|')
+                 for cell in row if cell.tag in ('th', 'td')]
+        if cells:
+            rows.append(cells)
+    if not rows:
+        return ''
+    width = max(len(row) for row in rows)
+    rows = [row + [''] * (width - len(row)) for row in rows]
+    lines = ['| ' + ' | '.join(rows[0]) + ' |', '|' + '---|' * width]
+    lines.extend('| ' + ' | '.join(row) + ' |' for row in rows[1:])
+    return '\n'.join(lines)
+
+
+def _block(element) -> str:
+    """转换块级元素，返回的各块之间以空行分隔"""
+    tag = element.tag
+    if tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+        return '#' * int(tag[1]) + ' ' + re.sub(r'\s+', ' ', _inline(element)).strip()
+    if tag == 'pre':
+        return _code_block(element)
+    if tag in ('ul', 'ol'):
+        return _list(element, 0)
+    if tag == 'table':
+        return _table(element)
+    if tag == 'hr':
+        return '---'
+    if tag == 'blockquote':
+        inner = _children(element)
+        return '\n'.join('> ' + line if line else '>' for line in inner.split('\n'))
+    if tag == 'p':
+        return _inline(element).strip()
+    return _children(element)
+
+
+def _children(element) -> str:
+    """转换容器元素：连续的行内内容合并为段落，块级子元素各自成块"""
+    blocks: List[str] = []
+    inline_parts = [element.text or '']
+
+    def flush():
+        text = ''.join(inline_parts).strip()
+        if text:
+            blocks.append(text)
+        inline_parts.clear()
+
+    for child in element:
+        if not isinstance(child.tag, str) or _skipped(child):
+            inline_parts.append(child.tail or '')
+            continue
+        if child.tag in _BLOCK_TAGS:
+            flush()
+            block = _block(child)
+            if block.strip():
+                blocks.append(block)
+        else:
+            inline_parts.append(_inline_element(child))
+        inline_parts.append(child.tail or '')
+    flush()
+    return '\n\n'.join(blocks)
+
+
+def html_to_markdown(html: str) -> str:
+    """
+    把md-editor预览区的HTML转换为Markdown
+
+    Args:
+        html (str): 预览元素的innerHTML
+
+    Returns:
+        str: Markdown文本
+    """
+    if not html or not html.strip():
+        return ''
+    root = lxml_html.fragment_fromstring(html, create_parent='div')
+    return re.sub(r'\n{3,}', '\n\n', _children(root)).strip()
+
+
+def extract_markdown(driver, element_id: str) -> Optional[str]:
+    """
+    读取回复的Markdown：一次脚本调用取得源码或预览HTML，HTML在本地转换
+
+    Args:
+        driver (WebDriver): 浏览器实例
+        element_id (str): 预览元素ID，如 md-editor-v3_15-preview
+
+    Returns:
+        str or None: Markdown文本，元素不存在时返回None
+    """
+    result = driver.execute_script(MARKDOWN_SOURCE_SCRIPT, element_id)
+    if not result:
+        return None
+    source = result.get('source')
+    metrics.increment(f'reply.markdown_source.{source}')
+    if source == 'html':
+        return html_to_markdown(result.get('html', ''))
+    return (result.get('markdown') or '').strip()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+运行指标模块
+进程内的计数器和仪表，供批量处理和服务模式输出运行状态
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, Callable[[], Any]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    """
+    累加计数器
+
+    Args:
+        name (str): 指标名称
+        value (float): 增量
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def register_gauge(name: str, getter: Callable[[], Any]) -> None:
+    """
+    注册仪表，读取指标时调用getter获取当前值
+
+    Args:
+        name (str): 指标名称
+        getter (callable): 返回当前值的函数
+    """
+    with _lock:
+        _gauges[name] = getter
+
+
+def get_metrics() -> Dict[str, Any]:
+    """
+    获取所有指标的当前值
+
+    Returns:
+        dict: 指标名称 -> 当前值
+    """
+    with _lock:
+        result: Dict[str, Any] = dict(_counters)
+        gauges = dict(_gauges)
+
+    for name, getter in gauges.items():
+        try:
+            result[name] = getter()
+        except Exception:
+            result[name] = None
+    return result
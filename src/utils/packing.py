@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+多问题打包模块
+把多个简短问题合并为一条带编号和结束标记的提示，在一轮浏览器对话中回答，
+再按标记把回复拆分回每个问题的回答；缺失或格式错误的回答单独重新提问。
+"""
+
+import re
+from typing import Any, Callable, List, Optional, Sequence
+
+from src.utils.logger import get_logger
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+def item_start_marker(number: int) -> str:
+    """第number个问题回答的开始标记"""
+    return f"[ITEM_{number}_START]"
+
+
+def item_end_marker(number: int) -> str:
+    """第number个问题回答的结束标记，与对话结束标记[DIALOG_n_END]的格式一致"""
+    return f"[ITEM_{number}_END]"
+
+
+_ITEM_MARKER = re.compile(r'\[ITEM_\d+_START\]')
+
+
+def is_packed_prompt(text: str) -> bool:
+    """是否为打包提示（包含问题回答的开始标记），打包的问答不应作为单个问题复用"""
+    return bool(_ITEM_MARKER.search(text or ''))
+
+
+def build_packed_prompt(questions: Sequence[str], dialog_end_marker: Optional[str] = None) -> str:
+    """
+    构造打包提示
+
+    Args:
+        questions (list): 问题
+        dialog_end_marker (str, optional): 要求AI在全部回答之后输出的对话结束标记
+
+    Returns:
+        str: 打包后的提示
+    """
+    lines = [
+        f"请依次回答下面 {len(questions)} 个相互独立的问题。",
+        "每个回答以对应的开始标记单独一行开头，以对应的结束标记单独一行结尾，"
+        "标记必须原样输出，不要在标记之外添加其他内容。",
+        "",
+    ]
+    for number, question in enumerate(questions, 1):
+        lines.append(f"问题{number}: {question.strip()}")
+    lines.append("")
+    lines.append("回答格式：")
+    for number in range(1, len(questions) + 1):
+        lines.append(f"{item_start_marker(number)}\n（问题{number}的回答）\n{item_end_marker(number)}")
+    if dialog_end_marker:
+        lines.append(f"全部回答完成后，最后单独输出一行 {dialog_end_marker}")
+    return "\n".join(lines)
+
+
+def split_packed_reply(reply: str, count: int) -> List[Optional[str]]:
+    """
+    按标记拆分打包回复
+
+    Args:
+        reply (str): AI助手的回复
+        count (int): 打包的问题数
+
+    Returns:
+        list: 每个问题的回答，缺失、为空或混入其他问题标记的回答为None
+    """
+    answers: List[Optional[str]] = []
+    marker_pattern = re.compile(r'\[ITEM_\d+_(?:START|END)\]')
+    for number in range(1, count + 1):
+        match = re.search(re.escape(item_start_marker(number)) + r'(.*?)' + re.escape(item_end_marker(number)),
+                          reply, re.S)
+        if not match:
+            answers.append(None)
+            continue
+        answer = match.group(1).strip()
+        if not answer or marker_pattern.search(answer):
+            answers.append(None)
+            continue
+        answers.append(answer)
+    return answers
+
+
+def plan_packs(questions: Sequence[str], max_items: Optional[int] = None,
+               max_question_length: Optional[int] = None) -> List[List[int]]:
+    """
+    把问题分组，简短的问题按输入顺序每max_items个一组，较长的问题单独成组
+
+    Args:
+        questions (list): 问题
+        max_items (int, optional): 每组最多问题数，默认使用配置
+        max_question_length (int, optional): 可打包问题的最大长度，默认使用配置
+
+    Returns:
+        list: 分组，每组为问题序号列表
+    """
+    packing_config = config.PACKING_CONFIG
+    max_items = max_items or packing_config.get('max_items', 5)
+    max_question_length = max_question_length or packing_config.get('max_question_length', 80)
+    # 为说明文字和标记预留空间，保证打包后的提示不超过单条消息长度上限
+    budget = config.MESSAGE_CONFIG.get('max_message_length', 2000) - 300
+
+    packs: List[List[int]] = []
+    current: List[int] = []
+    current_length = 0
+    for index, question in enumerate(questions):
+        length = len(question.strip())
+        if length > max_question_length:
+            packs.append([index])
+            continue
+        item_length = length + 60  # 编号和开始/结束标记
+        if current and (len(current) >= max_items or current_length + item_length > budget):
+            packs.append(current)
+            current, current_length = [], 0
+        current.append(index)
+        current_length += item_length
+    if current:
+        packs.append(current)
+    # 按组内第一个问题的位置排序，尽量保持输入顺序
+    packs.sort(key=lambda pack: pack[0])
+    return packs
+
+
+def answer_pack(assistant, questions: Sequence[str], ask_single: Callable[[str], Any],
+                make_result: Callable[[str, str], Any], deadline=None) -> List[Any]:
+    """
+    在一轮对话中回答一组问题，拆分失败的问题单独重新提问
+
+    Args:
+        assistant (AIAssistant): AI助手实例
+        questions (list): 一组问题
+        ask_single (callable): 单独提问一个问题并返回结果记录
+        make_result (callable): 由(问题, 回答)生成与单独提问相同格式的结果记录
+        deadline (Deadline or float, optional): 打包对话的截止时间
+
+    Returns:
+        list: 与questions一一对应的结果记录
+    """
+    if len(questions) == 1:
+        return [ask_single(questions[0])]
+
+    prompt = build_packed_prompt(questions, assistant.next_dialog_end_marker)
+    try:
+        reply = assistant.chat(prompt, deadline=deadline)
+        answers = split_packed_reply(reply, len(questions))
+    except Exception as e:
+        logger.warning(f"打包提问失败，逐个重新提问: {str(e)}")
+        answers = [None] * len(questions)
+
+    missing = sum(1 for answer in answers if answer is None)
+    if missing:
+        logger.info(f"打包回复中有 {missing}/{len(questions)} 个回答缺失或格式错误，单独重新提问")
+
+    return [make_result(question, answer) if answer is not None else ask_single(question)
+            for question, answer in zip(questions, answers)]
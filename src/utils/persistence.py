@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史后台持久化模块
+对话线程只把有变化的会话登记到队列后立即返回，后台线程按时间间隔或积压数量把多轮更新合并为一次写入；
+关闭助手或进程退出时同步写完所有积压的更新。
+"""
+
+import time
+import atexit
+import threading
+from typing import Dict, Optional, Tuple
+
+from src.utils.logger import get_logger
+from src.utils import metrics
+from src.models.message import Conversation
+from src.models.history import save_histories
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class HistoryWriter:
+    """
+    合并写入对话历史的后台线程
+
+    队列中同一会话只保留一项，写入时序列化会话的最新状态，
+    因此一个刷新周期内同一会话的多轮更新只写一次；同一历史文件的多个会话也合并为一次读写。
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None, max_pending: Optional[int] = None):
+        """
+        初始化写入线程（首次提交时自动启动）
+
+        Args:
+            flush_interval (float, optional): 第一项更新入队后最多等待多少秒写入，默认使用配置
+            max_pending (int, optional): 积压的更新达到多少次时立即写入，默认使用配置
+        """
+        persistence_config = config.PERSISTENCE_CONFIG
+        self.flush_interval = flush_interval or persistence_config.get('flush_interval', 2.0)
+        self.max_pending = max_pending or persistence_config.get('max_pending', 20)
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()  # 保证多次写入按提交顺序落盘
+        self._pending: Dict[Tuple[str, str], Conversation] = {}  # (历史文件, 会话ID) -> 会话
+        self._updates = 0  # 上次写入以来提交的更新次数
+        self._first_pending_at: Optional[float] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, conversation: Conversation, file_path: Optional[str] = None) -> None:
+        """
+        登记会话有更新，稍后由后台线程写入
+
+        Args:
+            conversation (Conversation): 会话对象
+            file_path (str, optional): 历史文件路径，默认使用配置中的历史文件
+        """
+        if file_path is None:
+            file_path = config.MESSAGE_CONFIG.get('history_file')
+
+        with self._cond:
+            if self._closed:
+                # 进程正在退出，直接同步写入
+                conversation.save(file_path)
+                return
+            key = (file_path, conversation.conversation_id)
+            if key in self._pending:
+                metrics.increment('history.coalesced')
+            self._pending[key] = conversation
+            self._updates += 1
+            self._ensure_thread()
+            # 队列由空变为非空时唤醒后台线程开始计时，积压达到上限时唤醒立即写入
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+                self._cond.notify_all()
+            elif self._updates >= self.max_pending:
+                self._cond.notify_all()
+
+    def pending(self) -> int:
+        """
+        获取等待写入的会话数量
+
+        Returns:
+            int: 会话数量
+        """
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self) -> bool:
+        """
+        在当前线程中立即写入所有积压的更新
+
+        Returns:
+            bool: 是否全部写入成功
+        """
+        with self._write_lock:
+            with self._cond:
+                batch = self._take_pending()
+            if not batch:
+                return True
+            return self._write(batch)
+
+    def close(self, timeout: Optional[float] = 10.0) -> bool:
+        """
+        停止后台线程并写入所有积压的更新，之后的提交改为同步写入
+
+        Args:
+            timeout (float, optional): 等待后台线程结束的最长时间(秒)
+
+        Returns:
+            bool: 是否全部写入成功
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        return self.flush()
+
+    def _ensure_thread(self) -> None:
+        """启动后台线程（调用方需持有_cond）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def _take_pending(self) -> Dict[Tuple[str, str], Conversation]:
+        """取出积压的更新（调用方需持有_cond）"""
+        batch = self._pending
+        self._pending = {}
+        self._updates = 0
+        self._first_pending_at = None
+        return batch
+
+    def _write(self, batch: Dict[Tuple[str, str], Conversation]) -> bool:
+        """
+        按历史文件分组写入（调用方需持有_write_lock）
+
+        写入失败的会话重新放回队列（期间已有新的提交则以新的为准），下个周期重试。
+        """
+        by_file: Dict[str, Dict[str, Conversation]] = {}
+        for (file_path, conversation_id), conversation in batch.items():
+            by_file.setdefault(file_path, {})[conversation_id] = conversation
+
+        success = True
+        for file_path, conversations in by_file.items():
+            start = time.monotonic()
+            try:
+                save_histories({
+                    conversation_id: conversation.to_dict()
+                    for conversation_id, conversation in conversations.items()
+                }, file_path)
+            except Exception as e:
+                success = False
+                metrics.increment('history.write_errors')
+                logger.error(f"写入对话历史失败: {str(e)}")
+                with self._cond:
+                    for conversation_id, conversation in conversations.items():
+                        key = (file_path, conversation_id)
+                        if key not in self._pending:
+                            self._pending[key] = conversation
+                            self._updates += 1
+                    if self._first_pending_at is None:
+                        self._first_pending_at = time.monotonic()
+                continue
+            metrics.increment('history.writes')
+            metrics.increment('history.conversations_written', len(conversations))
+            logger.debug(f"写入 {len(conversations)} 个会话到 {file_path}，"
+                         f"耗时 {time.monotonic() - start:.3f} 秒")
+        return success
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._first_pending_at is not None:
+                        if self._updates >= self.max_pending:
+                            break
+                        remaining = self._first_pending_at + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"后台写入对话历史出错: {str(e)}")
+                # 避免持续出错时空转
+                time.sleep(self.flush_interval)
+
+
+_writer: Optional[HistoryWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer() -> Optional[HistoryWriter]:
+    """
+    获取进程内共享的历史写入线程
+
+    Returns:
+        HistoryWriter or None: 未启用后台写入时返回None
+    """
+    global _writer
+    if not config.PERSISTENCE_CONFIG.get('background_writes', True):
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter()
+            metrics.register_gauge('history.pending', _writer.pending)
+            atexit.register(_writer.close)
+        return _writer
+
+
+def save_conversation(conversation: Conversation) -> None:
+    """
+    保存会话：启用后台写入时入队后立即返回，否则同步写入
+
+    Args:
+        conversation (Conversation): 会话对象
+    """
+    writer = get_history_writer()
+    if writer is None:
+        conversation.save()
+    else:
+        writer.submit(conversation)
+
+
+def flush_history() -> bool:
+    """
+    同步写入所有积压的会话更新
+
+    Returns:
+        bool: 是否全部写入成功（未启用后台写入时返回True）
+    """
+    if _writer is None:
+        return True
+    return _writer.flush()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话轮次采样分析模块
+后台线程按固定间隔读取正在对话的线程的调用栈（sys._current_frames），开销与采样频率成正比、与代码量无关。
+每轮对话输出collapsed stack文件（flamegraph.pl、speedscope等工具可直接读取），并累积为整批的汇总；
+线程正在等待WebDriver HTTP调用时，栈顶追加 [webdriver:<命令>] 帧，与Python自身的CPU时间分开统计。
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.utils.driver_stats import instrument, active_command, thread_totals
+from src.utils.logger import get_logger
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+_MAX_DEPTH = 128
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}"
+
+
+def _collapse(frame) -> List[str]:
+    """从栈底到栈顶的帧名称"""
+    names = []
+    while frame is not None and len(names) < _MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class TurnProfile:
+    """一轮对话的采样结果"""
+
+    def __init__(self, name: str):
+        """
+        初始化
+
+        Args:
+            name (str): 轮次名称，用作输出文件名
+        """
+        self.name = name
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.webdriver_samples = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.webdriver_seconds = 0.0
+        self.webdriver_cpu_seconds = 0.0
+        self.webdriver_commands = 0
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._webdriver_start = thread_totals()
+
+    def finish(self) -> None:
+        """在对话线程中结束计时"""
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.thread_time() - self._cpu_start
+        commands, seconds, cpu = thread_totals()
+        self.webdriver_commands = commands - self._webdriver_start[0]
+        # WebDriver调用期间本线程的CPU时间已计入cpu_seconds，这里只保留阻塞在浏览器上的时间
+        self.webdriver_cpu_seconds = cpu - self._webdriver_start[2]
+        self.webdriver_seconds = max(seconds - self._webdriver_start[1] - self.webdriver_cpu_seconds, 0.0)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        汇总本轮的时间分布
+
+        Returns:
+            dict: 墙钟时间、线程CPU时间（含其中WebDriver客户端部分）、WebDriver等待时间和命令数、其他等待时间以及采样数
+        """
+        return {
+            'name': self.name,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'webdriver_cpu_seconds': round(self.webdriver_cpu_seconds, 4),
+            'webdriver_seconds': round(self.webdriver_seconds, 4),
+            'webdriver_commands': self.webdriver_commands,
+            # 既不在执行Python代码也不在等待WebDriver：sleep、锁、登录等其他网络请求
+            'other_wait_seconds': round(max(self.wall_seconds - self.cpu_seconds - self.webdriver_seconds, 0.0), 4),
+            'samples': self.samples,
+            'webdriver_samples': self.webdriver_samples,
+        }
+
+
+def write_collapsed(stacks: Counter, path: str) -> None:
+    """
+    写出collapsed stack格式（每行"帧;帧;帧 次数"）
+
+    Args:
+        stacks (Counter): 栈 -> 采样次数
+        path (str): 输出文件路径
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+class SamplingProfiler:
+    """
+    采样分析器
+
+    一个后台线程为所有正在对话的线程采样；对话线程通过turn()登记，结束时写出本轮结果。
+    """
+
+    def __init__(self, output_dir: Optional[str] = None, interval: Optional[float] = None):
+        """
+        初始化
+
+        Args:
+            output_dir (str, optional): 输出目录，默认为配置目录下以启动时间命名的子目录
+            interval (float, optional): 采样间隔(秒)，默认使用配置
+        """
+        profiler_config = config.PROFILER_CONFIG
+        self.output_dir = output_dir or os.path.join(
+            profiler_config.get('output_dir'), datetime.now().strftime('%Y%m%d_%H%M%S'))
+        self.interval = interval or profiler_config.get('interval', 0.01)
+        self.turns: List[Dict[str, Any]] = []
+        self.aggregate: Counter = Counter()
+        self._active: Dict[int, TurnProfile] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._counter = 0
+        self._closed = False
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, profile in active.items():
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == sampler_id:
+                    continue
+                names = _collapse(frame)
+                command = active_command(thread_id)
+                if command is not None:
+                    names.append(f"[webdriver:{command}]")
+                    profile.webdriver_samples += 1
+                profile.stacks[';'.join(names)] += 1
+                profile.samples += 1
+            del frames
+
+    @contextmanager
+    def turn(self, name: str, driver=None) -> Iterator[TurnProfile]:
+        """
+        在当前线程中采样一轮对话
+
+        Args:
+            name (str): 轮次名称
+            driver (WebDriver, optional): 本轮使用的浏览器实例，提供时统计其WebDriver命令
+
+        Yields:
+            TurnProfile: 本轮的采样结果
+        """
+        if driver is not None:
+            instrument(driver)
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._counter += 1
+            profile = TurnProfile(f"turn_{self._counter:04d}_{name}")
+            nested = thread_id in self._active
+            if not nested:
+                self._active[thread_id] = profile
+                self._ensure_thread()
+        try:
+            yield profile
+        finally:
+            if not nested:
+                profile.finish()
+                with self._lock:
+                    self._active.pop(thread_id, None)
+                self._save_turn(profile)
+
+    def _save_turn(self, profile: TurnProfile) -> None:
+        summary = profile.summary()
+        with self._lock:
+            self.turns.append(summary)
+            self.aggregate.update(profile.stacks)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            write_collapsed(profile.stacks, os.path.join(self.output_dir, f"{profile.name}.collapsed"))
+        except Exception as e:
+            logger.warning(f"写出采样结果失败: {str(e)}")
+        logger.info(f"{profile.name}: 墙钟 {summary['wall_seconds']:.2f} 秒，CPU {summary['cpu_seconds']:.2f} 秒，"
+                    f"WebDriver {summary['webdriver_seconds']:.2f} 秒 ({summary['webdriver_commands']} 个命令)")
+
+    def totals(self) -> Dict[str, Any]:
+        """
+        汇总所有轮次
+
+        Returns:
+            dict: 轮次数及墙钟、CPU、WebDriver、其他等待时间和WebDriver命令数的合计
+        """
+        with self._lock:
+            turns = list(self.turns)
+        keys = ('wall_seconds', 'cpu_seconds', 'webdriver_cpu_seconds', 'webdriver_seconds', 'other_wait_seconds',
+                'webdriver_commands')
+        totals: Dict[str, Any] = {key: round(sum(turn[key] for turn in turns), 4) for key in keys}
+        totals['turns'] = len(turns)
+        return totals
+
+    def close(self) -> Optional[str]:
+        """
+        停止采样并写出整批的汇总（aggregate.collapsed 和 summary.json）
+
+        Returns:
+            str or None: 输出目录，没有采样任何轮次时返回None
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(1.0)
+        with self._lock:
+            if self._closed or not self.turns:
+                return None
+            self._closed = True
+            aggregate = Counter(self.aggregate)
+            turns = list(self.turns)
+        os.makedirs(self.output_dir, exist_ok=True)
+        write_collapsed(aggregate, os.path.join(self.output_dir, 'aggregate.collapsed'))
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump({'totals': self.totals(), 'turns': turns, 'interval': self.interval},
+                      f, ensure_ascii=False, indent=2)
+        return self.output_dir
+
+
+def format_totals(totals: Dict[str, Any]) -> str:
+    """
+    格式化汇总
+
+    Args:
+        totals (dict): SamplingProfiler.totals的结果
+
+    Returns:
+        str: 汇总文本
+    """
+    wall = totals['wall_seconds'] or 1.0
+    lines = [f"共采样 {totals['turns']} 轮对话，墙钟时间 {totals['wall_seconds']:.2f} 秒"]
+    for key, label in (('cpu_seconds', 'Python CPU'), ('webdriver_seconds', '等待WebDriver'),
+                       ('other_wait_seconds', '其他等待')):
+        lines.append(f"  {label}: {totals[key]:.2f} 秒 ({totals[key] / wall * 100:.1f}%)")
+        if key == 'cpu_seconds':
+            lines.append(f"    其中WebDriver客户端: {totals['webdriver_cpu_seconds']:.2f} 秒")
+    lines.append(f"  WebDriver命令: {totals['webdriver_commands']} 个")
+    return '\n'.join(lines)
+
+
+_profiler: Optional[SamplingProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[SamplingProfiler]:
+    """
+    获取进程内共享的采样分析器
+
+    Returns:
+        SamplingProfiler or None: 未启用采样分析时返回None
+    """
+    global _profiler
+    if not config.PROFILER_CONFIG.get('enabled', False):
+        return None
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler()
+            atexit.register(_profiler.close)
+        return _profiler
+
+
+@contextmanager
+def profile_turn(name: str, driver=None) -> Iterator[Optional[TurnProfile]]:
+    """
+    启用采样分析时采样一轮对话，否则不做任何事
+
+    Args:
+        name (str): 轮次名称
+        driver (WebDriver, optional): 本轮使用的浏览器实例
+
+    Yields:
+        TurnProfile or None: 本轮的采样结果，未启用时为None
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        yield None
+        return
+    with profiler.turn(name, driver) as profile:
+        yield profile
+
+
+def close_profiler() -> Optional[str]:
+    """
+    停止采样分析并写出整批的汇总
+
+    Returns:
+        str or None: 包含输出目录和时间分布的汇总文本，未启用或没有采样任何轮次时返回None
+    """
+    with _profiler_lock:
+        profiler = _profiler
+    if profiler is None:
+        return None
+    output_dir = profiler.close()
+    if output_dir is None:
+        return None
+    return f"{format_totals(profiler.totals())}\n采样结果已保存到 {output_dir}（*.collapsed 可用 flamegraph.pl 或 speedscope 查看）"
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+故障恢复模块
+按故障需要重做的范围对异常分类，每类故障采用代价最小的恢复动作
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    ElementNotInteractableException,
+    ElementClickInterceptedException,
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    WebDriverException,
+)
+
+from src.utils.logger import get_logger
+from src.utils.deadline import Deadline, DeadlineExceeded
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class FailureKind:
+    """故障类别，按恢复代价从低到高排列"""
+    STALE_ELEMENT = 'stale_element'            # 页面元素失效：重新探测元素即可
+    LOGIN_REQUIRED = 'login_required'          # 被重定向到登录页：重新登录
+    DRIVER_DEAD = 'driver_dead'                # 浏览器进程/会话已失效：重建浏览器
+    GENERATION_TIMEOUT = 'generation_timeout'  # 等待回复超时：重新发送问题
+    UNKNOWN = 'unknown'                        # 无法分类：退避后整体重试
+
+
+# 各类故障默认的最大恢复次数和恢复前等待时间（秒），廉价的恢复不等待
+DEFAULT_POLICY = {
+    FailureKind.STALE_ELEMENT: {'max_attempts': 3, 'delay': 0},
+    FailureKind.LOGIN_REQUIRED: {'max_attempts': 1, 'delay': 0},
+    FailureKind.DRIVER_DEAD: {'max_attempts': 1, 'delay': 0},
+    FailureKind.GENERATION_TIMEOUT: {'max_attempts': 1, 'delay': 0},
+    FailureKind.UNKNOWN: {'max_attempts': 2, 'delay': 2},
+}
+
+# 浏览器会话已失效时WebDriver错误信息中常见的片段
+_DEAD_DRIVER_MARKERS = (
+    'invalid session id',
+    'session deleted',
+    'chrome not reachable',
+    'disconnected',
+    'target window already closed',
+    'no such window',
+    'connection refused',
+    'max retries exceeded',
+)
+
+
+def iter_causes(exc: BaseException):
+    """
+    遍历异常及其__cause__/__context__链
+
+    Args:
+        exc (BaseException): 异常
+
+    Yields:
+        BaseException: 链上的每个异常
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def classify_webdriver_error(exc: BaseException) -> str:
+    """
+    按WebDriver异常类型对故障分类
+
+    Args:
+        exc (BaseException): 异常（会沿异常链查找根因）
+
+    Returns:
+        str: FailureKind中的故障类别
+    """
+    for error in iter_causes(exc):
+        if isinstance(error, (InvalidSessionIdException, NoSuchWindowException)):
+            return FailureKind.DRIVER_DEAD
+        if isinstance(error, (StaleElementReferenceException,
+                              ElementNotInteractableException,
+                              ElementClickInterceptedException)):
+            return FailureKind.STALE_ELEMENT
+        if isinstance(error, (ConnectionError, WebDriverException)) or \
+                error.__class__.__name__ in ('MaxRetryError', 'NewConnectionError'):
+            message = str(error).lower()
+            if any(marker in message for marker in _DEAD_DRIVER_MARKERS):
+                return FailureKind.DRIVER_DEAD
+    return FailureKind.UNKNOWN
+
+
+class RecoveryEngine:
+    """按故障类别执行恢复并重试的引擎"""
+
+    def __init__(self, classifier: Callable[[BaseException], str],
+                 actions: Optional[Dict[str, Callable[[BaseException], None]]] = None,
+                 policy: Optional[Dict[str, Dict[str, float]]] = None):
+        """
+        初始化恢复引擎
+
+        Args:
+            classifier (callable): 故障分类函数，接收异常返回FailureKind类别
+            actions (dict, optional): 故障类别 -> 恢复动作，动作在重试前执行
+            policy (dict, optional): 故障类别 -> {max_attempts, delay}，默认使用DEFAULT_POLICY并合并配置
+        """
+        self.classifier = classifier
+        self.actions = actions or {}
+        self.policy = {kind: dict(value) for kind, value in DEFAULT_POLICY.items()}
+        configured = config.ASSISTANT_CONFIG.get('recovery_policy', {})
+        for kind, value in list(configured.items()) + list((policy or {}).items()):
+            self.policy.setdefault(kind, {}).update(value)
+
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+
+    def _record(self, kind: str) -> None:
+        """记录一次恢复"""
+        with self._lock:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+
+    def run(self, operation: Callable[[], Any], name: str = 'operation',
+            deadline: Optional[Deadline] = None) -> Any:
+        """
+        执行操作，失败时按故障类别恢复后重试
+
+        Args:
+            operation (callable): 要执行的操作
+            name (str): 操作名称，用于日志
+            deadline (Deadline, optional): 截止时间，超过后不再恢复重试
+
+        Returns:
+            Any: 操作的返回值
+
+        Raises:
+            Exception: 故障无法恢复或超过该类故障的最大恢复次数时抛出最后一次的异常
+        """
+        attempts: Dict[str, int] = {}
+        while True:
+            try:
+                return operation()
+            except Exception as e:
+                if deadline is not None and (deadline.expired or
+                                             any(isinstance(c, DeadlineExceeded) for c in iter_causes(e))):
+                    logger.error(f"{name} 失败，已超过截止时间，不再重试: {str(e)}")
+                    raise
+                kind = self.classifier(e)
+                policy = self.policy.get(kind, self.policy[FailureKind.UNKNOWN])
+                used = attempts.get(kind, 0)
+                if used >= policy.get('max_attempts', 0):
+                    logger.error(f"{name} 失败 ({kind})，已达到最大恢复次数: {str(e)}")
+                    raise
+                attempts[kind] = used + 1
+                self._record(kind)
+
+                # 非廉价的故障按次数指数退避
+                delay = policy.get('delay', 0) * (2 ** used)
+                if deadline is not None:
+                    delay = deadline.cap(delay)
+                logger.warning(
+                    f"{name} 失败 ({kind})，第 {used + 1} 次恢复"
+                    f"{f'，{delay:.1f} 秒后重试' if delay else ''}: {str(e)}"
+                )
+                if delay:
+                    time.sleep(delay)
+
+                action = self.actions.get(kind)
+                if action:
+                    action(e)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量任务调度模块
+预测每个问题的回答耗时，按最长处理时间优先(LPT)分配给各工作线程，
+空闲的工作线程从负载最重的队列尾部窃取任务，缩短整体完工时间。
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.utils.logger import get_logger
+from src.utils.similarity import SimilarityIndex
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class DurationPredictor:
+    """
+    回答耗时预测器
+
+    以问题长度和关键词为特征，在耗时的对数上拟合岭回归；历史中有相似问题时，
+    再按相似度把相似问题的实际耗时混合进预测结果。
+    """
+
+    def __init__(self):
+        scheduling_config = config.SCHEDULING_CONFIG
+        self.long_keywords = scheduling_config.get('long_keywords', [])
+        self.short_keywords = scheduling_config.get('short_keywords', [])
+        self.default_seconds = scheduling_config.get('default_seconds', 20)
+        self.neighbors = scheduling_config.get('neighbors', 5)
+        self.min_similarity = scheduling_config.get('min_similarity', 0.3)
+        self.min_samples = scheduling_config.get('min_samples', 20)
+
+        # 没有足够历史时的默认系数：耗时随长度缓慢增长，长回答关键词增加、短回答关键词减少耗时
+        self.weights = np.array([math.log(self.default_seconds) - 0.3 * math.log(20), 0.3, 0.4, -0.3])
+        self.history_index: Optional[SimilarityIndex] = None
+        self.history_log_seconds = np.empty(0)
+
+    def features(self, questions: Sequence[str]) -> np.ndarray:
+        """
+        提取特征：[常数项, log(1+长度), 长回答关键词数, 短回答关键词数]
+
+        Args:
+            questions (list): 问题
+
+        Returns:
+            np.ndarray: 形状为(问题数, 4)的特征矩阵
+        """
+        rows = [
+            (1.0,
+             math.log1p(len(question)),
+             sum(1 for keyword in self.long_keywords if keyword in question),
+             sum(1 for keyword in self.short_keywords if keyword in question))
+            for question in questions
+        ]
+        return np.array(rows, dtype=np.float64).reshape(len(questions), 4)
+
+    def fit(self, questions: Sequence[str], seconds: Sequence[float]) -> 'DurationPredictor':
+        """
+        用历史问题及其实际耗时训练预测器
+
+        Args:
+            questions (list): 历史问题
+            seconds (list): 对应的回答耗时(秒)
+
+        Returns:
+            DurationPredictor: 自身
+        """
+        if not questions:
+            return self
+
+        targets = np.log(np.maximum(np.asarray(seconds, dtype=np.float64), 1.0))
+        if len(questions) >= self.min_samples:
+            x = self.features(questions)
+            regularization = np.eye(x.shape[1])
+            regularization[0, 0] = 0.0  # 不惩罚常数项
+            self.weights = np.linalg.solve(x.T @ x + regularization, x.T @ targets)
+
+        self.history_index = SimilarityIndex()
+        self.history_index.add(list(questions), [''] * len(questions))
+        self.history_log_seconds = targets
+        return self
+
+    @classmethod
+    def from_history(cls, file_path: Optional[str] = None) -> 'DurationPredictor':
+        """
+        从会话历史训练预测器，耗时取用户消息到助手回复的时间差
+
+        Args:
+            file_path (str, optional): 历史文件路径，默认使用配置中的历史文件
+
+        Returns:
+            DurationPredictor: 预测器
+        """
+        from src.models.message import Conversation
+
+        max_seconds = config.SCHEDULING_CONFIG.get('max_history_seconds', 600)
+        questions, seconds = [], []
+        for conversation in Conversation.load_all(file_path):
+            for question, answer in conversation.turns():
+                if answer.metadata.get('coalesced'):
+                    continue
+                elapsed = answer.timestamp - question.timestamp
+                if 0 < elapsed <= max_seconds:
+                    questions.append(question.content)
+                    seconds.append(elapsed)
+
+        logger.info(f"从会话历史中获取到 {len(questions)} 条带耗时的问答，用于预测回答耗时")
+        return cls().fit(questions, seconds)
+
+    def predict(self, questions: Sequence[str]) -> List[float]:
+        """
+        预测回答耗时
+
+        Args:
+            questions (list): 问题
+
+        Returns:
+            list: 每个问题的预测耗时(秒)
+        """
+        if not questions:
+            return []
+
+        log_seconds = self.features(questions) @ self.weights
+        if self.history_index is not None and len(self.history_index):
+            matches = self.history_index.search(questions, top_k=self.neighbors,
+                                                threshold=self.min_similarity)
+            for i, neighbors in enumerate(matches):
+                if not neighbors:
+                    continue
+                indices = np.array([index for index, _ in neighbors])
+                similarities = np.array([score for _, score in neighbors])
+                neighbor_estimate = np.average(self.history_log_seconds[indices], weights=similarities)
+                # 越相似越信任历史耗时
+                blend = similarities.max()
+                log_seconds[i] = blend * neighbor_estimate + (1 - blend) * log_seconds[i]
+
+        return np.exp(log_seconds).tolist()
+
+
+class WorkStealingScheduler:
+    """
+    LPT调度器
+
+    按预测耗时从长到短依次分配给加入该任务后预计完成最早的工作线程；
+    工作线程从自己队列的头部取最长的任务，队列空后从预测剩余负载最重的队列尾部窃取最短的任务。
+    """
+
+    def __init__(self, costs: Sequence[float], workers: int, speeds: Optional[Sequence[float]] = None):
+        """
+        初始化调度器
+
+        Args:
+            costs (list): 每个任务的预测耗时(秒)，任务以序号表示
+            workers (int): 工作线程数
+            speeds (list, optional): 每个工作线程的相对速度（如各账号观测到的吞吐量），默认都为1
+        """
+        self.costs = list(costs)
+        self.speeds = list(speeds) if speeds else [1.0] * workers
+        self._lock = threading.Lock()
+        self._queues: List[Deque[int]] = [deque() for _ in range(workers)]
+        self.steals = 0
+
+        # 稳定排序保证预测耗时相同时按输入顺序轮流分配
+        loads = [0.0] * workers
+        for task in sorted(range(len(self.costs)), key=lambda t: -self.costs[t]):
+            worker = min(range(workers), key=lambda w: loads[w] + self.costs[task] / self.speeds[w])
+            self._queues[worker].append(task)
+            loads[worker] += self.costs[task] / self.speeds[worker]
+        self._pending = list(loads)  # 每个队列剩余任务按该线程速度折算的预测耗时
+        self.predicted_makespan = max(loads) if loads else 0.0
+
+    def next_task(self, worker: int) -> Optional[int]:
+        """
+        获取工作线程的下一个任务
+
+        Args:
+            worker (int): 工作线程序号
+
+        Returns:
+            int or None: 任务序号，所有队列都为空时返回None
+        """
+        with self._lock:
+            own = self._queues[worker]
+            if own:
+                task = own.popleft()
+                self._pending[worker] -= self.costs[task] / self.speeds[worker]
+                return task
+
+            victim = max(range(len(self._queues)), key=lambda w: self._pending[w])
+            if not self._queues[victim]:
+                return None
+            task = self._queues[victim].pop()
+            self._pending[victim] -= self.costs[task] / self.speeds[victim]
+            self.steals += 1
+            return task
+
+
+def makespan_report(predicted_makespan: float, actual_makespan: float,
+                    predicted: Sequence[float], actual: Dict[int, float]) -> str:
+    """
+    生成预测与实际完工时间的对比说明
+
+    Args:
+        predicted_makespan (float): 调度时预测的完工时间(秒)
+        actual_makespan (float): 实际完工时间(秒)
+        predicted (list): 每个任务的预测耗时
+        actual (dict): 任务序号 -> 实际耗时
+
+    Returns:
+        str: 对比说明
+    """
+    report = f"预测完工时间 {predicted_makespan:.1f} 秒，实际完工时间 {actual_makespan:.1f} 秒"
+    if actual:
+        errors = [abs(predicted[task] - seconds) for task, seconds in actual.items()]
+        report += f"，单个任务耗时预测平均误差 {sum(errors) / len(errors):.1f} 秒"
+    return report
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+相似问题检索模块
+基于字符n-gram的TF-IDF余弦相似度检索历史问答，中文无需分词。
+n-gram通过哈希映射到固定维度，分词、加权和检索均使用NumPy向量化计算。
+"""
+
+import re
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.utils.logger import get_logger
+from src.utils.singleflight import normalize_question
+from src.utils.packing import is_packed_prompt
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+# n-gram滚动哈希的乘数
+_HASH_PRIME = np.uint64(1000003)
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def normalize_for_similarity(text: str) -> str:
+    """
+    规范化问题文本用于相似度计算，在normalize_question基础上去掉标点和空白
+
+    Args:
+        text (str): 问题文本
+
+    Returns:
+        str: 规范化后的文本
+    """
+    return _strip_punctuation(normalize_question(text))
+
+
+def _strip_punctuation(text: str) -> str:
+    """去掉标点、空白和下划线，保留批量规范化时使用的分隔符"""
+    return re.sub(r'[^\w\x00]+|_+', '', text)
+
+
+def normalize_batch(texts: Sequence[str]) -> List[str]:
+    """
+    批量规范化，拼接后一次性处理以减少逐条调用的开销
+
+    Args:
+        texts (list): 问题文本
+
+    Returns:
+        list: 规范化后的文本
+    """
+    joined = '\x00'.join(t.replace('\x00', '') for t in texts)
+    return _strip_punctuation(normalize_question(joined)).split('\x00')
+
+
+def hash_ngrams(texts: Sequence[str], ngram_range: Tuple[int, int],
+                n_features: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量提取字符n-gram并哈希到特征编号
+
+    所有文本拼接为一个码点数组一次性计算，不在Python层逐字符循环。
+
+    Args:
+        texts (list): 已规范化的文本
+        ngram_range (tuple): n-gram长度范围(最小, 最大)，闭区间
+        n_features (int): 特征维度
+
+    Returns:
+        tuple: (文本序号数组, 特征编号数组)，一一对应，每个n-gram出现一次对应一项
+    """
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    doc_of = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    starts = np.cumsum(lengths) - lengths
+    remaining = lengths[doc_of] - (np.arange(total, dtype=np.int64) - starts[doc_of])
+
+    docs, feats = [], []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        positions = np.nonzero(remaining >= n)[0]
+        if positions.size == 0:
+            continue
+        h = np.full(positions.size, n, dtype=np.uint64)
+        for offset in range(n):
+            h = h * _HASH_PRIME + codes[positions + offset]
+        h = (h * _HASH_MIX) >> np.uint64(32)
+        docs.append(doc_of[positions])
+        feats.append((h % np.uint64(n_features)).astype(np.int64))
+
+    if not docs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(docs), np.concatenate(feats)
+
+
+def term_frequencies(docs: np.ndarray, feats: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    统计每个(文本, 特征)的次数，返回次线性词频 1 + log(tf)，结果按特征、文本排序
+
+    Args:
+        docs (np.ndarray): 文本序号
+        feats (np.ndarray): 特征编号
+
+    Returns:
+        tuple: (文本序号, 特征编号, 词频)，每个(文本, 特征)只出现一次
+    """
+    keys, counts = np.unique((feats << 32) | docs, return_counts=True)
+    return keys & 0xFFFFFFFF, keys >> 32, 1.0 + np.log(counts)
+
+
+class _Segment:
+    """按特征排序的倒排索引段，权重已按建段时的IDF归一化"""
+
+    def __init__(self, docs: np.ndarray, feats: np.ndarray, tf: np.ndarray,
+                 idf: np.ndarray, n_features: int):
+        weights = tf * idf[feats]
+        doc_count = int(docs.max()) + 1 if docs.size else 0
+        norms = np.sqrt(np.bincount(docs, weights=weights * weights, minlength=doc_count))
+        norms[norms == 0] = 1.0
+        weights = weights / norms[docs]
+
+        # 三元组通常已按特征排序（合并时为两段有序序列），稳定排序接近线性时间
+        order = np.argsort(feats, kind='stable')
+        self.idf = idf
+        self.docs = docs[order].astype(np.int32)
+        self.weights = weights[order].astype(np.float32)
+        self.ptr = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(np.bincount(feats, minlength=n_features), out=self.ptr[1:])
+
+    def accumulate(self, scores: np.ndarray, feats: np.ndarray, tf: np.ndarray) -> None:
+        """
+        将查询与本段文本的余弦相似度累加到scores
+
+        Args:
+            scores (np.ndarray): 全部文本的得分数组，原地累加
+            feats (np.ndarray): 查询的特征编号（去重后）
+            tf (np.ndarray): 查询的词频
+        """
+        query = tf * self.idf[feats]
+        norm = math.sqrt(float(np.dot(query, query)))
+        if norm == 0:
+            return
+        query = query / norm
+
+        begins = self.ptr[feats]
+        lengths = self.ptr[feats + 1] - begins
+        total = int(lengths.sum())
+        if total == 0:
+            return
+        # 一次性取出所有查询特征的倒排列表
+        offsets = np.cumsum(lengths) - lengths
+        index = np.repeat(begins - offsets, lengths) + np.arange(total, dtype=np.int64)
+        scores += np.bincount(self.docs[index],
+                              weights=self.weights[index] * np.repeat(query, lengths),
+                              minlength=scores.size)[:scores.size]
+
+
+class SimilarityIndex:
+    """
+    历史问答的相似问题索引
+
+    新增的问答先进入增量段，增量段超过一定规模后与主段合并并重新计算IDF，
+    因此单次新增只需处理新文本本身。
+    """
+
+    def __init__(self, ngram_range: Optional[Tuple[int, int]] = None,
+                 n_features: Optional[int] = None):
+        """
+        初始化索引
+
+        Args:
+            ngram_range (tuple, optional): n-gram长度范围，默认使用配置
+            n_features (int, optional): 哈希特征维度，默认使用配置
+        """
+        similarity_config = config.SIMILARITY_CONFIG
+        self.ngram_range = tuple(ngram_range or similarity_config.get('ngram_range', (1, 3)))
+        self.n_features = n_features or similarity_config.get('n_features', 2 ** 20)
+        self.merge_min_docs = similarity_config.get('merge_min_docs', 1000)
+        self.merge_ratio = similarity_config.get('merge_ratio', 0.05)
+
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+
+        self._lock = threading.RLock()
+        self._df = np.zeros(self.n_features, dtype=np.int64)
+        # 主段和增量段的(文本, 特征, 词频)三元组
+        self._main_terms = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64))
+        self._delta_terms = (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64))
+        self._main_docs = 0
+        self._main: Optional[_Segment] = None
+        self._delta: Optional[_Segment] = None
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def _idf(self) -> np.ndarray:
+        """按当前文档频率计算平滑IDF"""
+        n_docs = len(self.questions)
+        return (np.log((n_docs + 1) / (self._df + 1)) + 1.0).astype(np.float32)
+
+    def _terms(self, texts: Sequence[str], offset: int = 0):
+        """规范化文本并计算(文本, 特征, 词频)三元组"""
+        normalized = normalize_batch(texts)
+        docs, feats = hash_ngrams(normalized, self.ngram_range, self.n_features)
+        docs, feats, tf = term_frequencies(docs, feats)
+        return docs + offset, feats, tf
+
+    def add(self, questions: Sequence[str], answers: Sequence[str]) -> None:
+        """
+        批量加入问答
+
+        Args:
+            questions (list): 问题
+            answers (list): 对应的回答
+        """
+        if not questions:
+            return
+        with self._lock:
+            docs, feats, tf = self._terms(questions, offset=len(self.questions))
+            self.questions.extend(questions)
+            self.answers.extend(answers)
+            self._df += np.bincount(feats, minlength=self.n_features)
+            self._delta_terms = tuple(np.concatenate([old, new])
+                                      for old, new in zip(self._delta_terms, (docs, feats, tf)))
+
+            delta_docs = len(self.questions) - self._main_docs
+            if delta_docs >= max(self.merge_min_docs, self.merge_ratio * self._main_docs):
+                self._merge()
+            else:
+                self._delta = _Segment(*self._delta_terms, self._idf(), self.n_features)
+
+    def _merge(self) -> None:
+        """将增量段合并进主段，并按最新的文档频率重新计算IDF"""
+        self._main_terms = tuple(np.concatenate([main, delta])
+                                 for main, delta in zip(self._main_terms, self._delta_terms))
+        self._delta_terms = tuple(array[:0] for array in self._delta_terms)
+        self._main_docs = len(self.questions)
+        self._main = _Segment(*self._main_terms, self._idf(), self.n_features)
+        self._delta = None
+
+    def search(self, queries: Sequence[str], top_k: Optional[int] = None,
+               threshold: float = 0.0) -> List[List[Tuple[int, float]]]:
+        """
+        批量检索最相似的历史问题
+
+        Args:
+            queries (list): 查询问题
+            top_k (int, optional): 每个查询返回的结果数，默认使用配置
+            threshold (float): 最低相似度
+
+        Returns:
+            list: 每个查询对应一个[(问题序号, 相似度), ...]列表，按相似度降序
+        """
+        top_k = top_k or config.SIMILARITY_CONFIG.get('top_k', 5)
+        with self._lock:
+            n_docs = len(self.questions)
+            results: List[List[Tuple[int, float]]] = [[] for _ in queries]
+            if n_docs == 0 or not queries:
+                return results
+
+            docs, feats, tf = self._terms(queries)
+            order = np.argsort(docs, kind='stable')
+            docs, feats, tf = docs[order], feats[order], tf[order]
+            bounds = np.searchsorted(docs, np.arange(len(queries) + 1))
+            segments = [segment for segment in (self._main, self._delta) if segment is not None]
+
+            for i in range(len(queries)):
+                begin, end = bounds[i], bounds[i + 1]
+                if begin == end:
+                    continue
+                scores = np.zeros(n_docs, dtype=np.float64)
+                for segment in segments:
+                    segment.accumulate(scores, feats[begin:end], tf[begin:end])
+
+                k = min(top_k, n_docs)
+                candidates = np.argpartition(-scores, k - 1)[:k]
+                candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+                results[i] = [(int(idx), float(scores[idx]))
+                              for idx in candidates if scores[idx] > 0 and scores[idx] >= threshold]
+            return results
+
+    def lookup(self, question: str, threshold: Optional[float] = None) -> Optional[Tuple[str, str, float]]:
+        """
+        查找可以直接复用回答的相似问题
+
+        Args:
+            question (str): 问题
+            threshold (float, optional): 复用所需的最低相似度，默认使用配置
+
+        Returns:
+            tuple or None: (历史问题, 历史回答, 相似度)，没有达到阈值的问题时返回None
+        """
+        if threshold is None:
+            threshold = config.SIMILARITY_CONFIG.get('threshold', 0.9)
+        matches = self.search([question], top_k=1, threshold=threshold)[0]
+        if not matches:
+            return None
+        index, score = matches[0]
+        return self.questions[index], self.answers[index], score
+
+    @classmethod
+    def from_history(cls, file_path: Optional[str] = None,
+                     assistant_type: Optional[str] = None) -> 'SimilarityIndex':
+        """
+        从会话历史文件构建索引
+
+        Args:
+            file_path (str, optional): 历史文件路径，默认使用配置中的历史文件
+            assistant_type (str, optional): 只收录该类型助手的对话；未记录助手类型的旧对话不收录
+
+        Returns:
+            SimilarityIndex: 索引
+        """
+        from src.models.message import Conversation
+
+        questions, answers = [], []
+        for conversation in Conversation.load_all(file_path):
+            if assistant_type is not None and conversation.metadata.get('assistant_type') != assistant_type:
+                continue
+            for question, answer in conversation.turns():
+                # 打包提示和合并复用的回答不是单个问题的原始问答
+                if is_packed_prompt(question.content) or answer.metadata.get('coalesced'):
+                    continue
+                questions.append(question.content)
+                answers.append(answer.content)
+
+        index = cls()
+        if questions:
+            index.add(questions, answers)
+            if index._delta is not None:
+                index._merge()
+        logger.info(f"已从会话历史构建{f' {assistant_type} 的' if assistant_type else ''}相似问题索引，共 {len(index)} 条问答")
+        return index
+
+
+# 助手类型 -> 相似问题索引，不同助手的回答互不复用
+_indexes: Dict[Optional[str], SimilarityIndex] = {}
+_index_lock = threading.Lock()
+
+
+def get_answer_index(assistant_type: Optional[str] = None) -> Optional[SimilarityIndex]:
+    """
+    获取进程内共享的相似问题索引，每种助手类型一个，首次调用时从会话历史构建
+
+    Args:
+        assistant_type (str, optional): 助手类型
+
+    Returns:
+        SimilarityIndex or None: 未启用相似问题复用时返回None
+    """
+    if not config.SIMILARITY_CONFIG.get('enabled', False):
+        return None
+    with _index_lock:
+        if assistant_type not in _indexes:
+            _indexes[assistant_type] = SimilarityIndex.from_history(assistant_type=assistant_type)
+        return _indexes[assistant_type]
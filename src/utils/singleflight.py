@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+请求合并模块
+相同的请求同时到达时只由第一个调用方(leader)真正执行，其余调用方等待并共享其结果
+"""
+
+import re
+import copy
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.utils.logger import get_logger
+from src.utils import metrics
+
+# 获取日志记录器
+logger = get_logger()
+
+
+def normalize_question(text: str) -> str:
+    """
+    规范化问题文本，用作合并请求的键
+
+    统一全角/半角字符、大小写，合并连续空白并去掉首尾空白。
+
+    Args:
+        text (str): 问题文本
+
+    Returns:
+        str: 规范化后的文本
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+class CoalescedCallError(Exception):
+    """leader执行失败，且其异常无法为follower单独复制时抛出"""
+    pass
+
+
+def _follower_error(error: BaseException) -> BaseException:
+    """
+    为follower复制leader的异常：类型和参数相同，但不与leader及其他follower共享同一个异常对象，
+    各线程的traceback不会互相覆盖；原异常通过__cause__保留
+
+    Args:
+        error (BaseException): leader的异常
+
+    Returns:
+        BaseException: 供follower抛出的新异常
+    """
+    try:
+        clone = copy.copy(error)
+    except Exception:
+        clone = None
+    if not isinstance(clone, BaseException) or clone is error:
+        clone = CoalescedCallError(f"合并的请求执行失败: {str(error)}")
+    return clone
+
+
+class _Call:
+    """一次正在执行的请求"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并同时进行的相同请求"""
+
+    def __init__(self, name: str):
+        """
+        初始化请求合并器
+
+        Args:
+            name (str): 名称，用作指标前缀
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+        metrics.register_gauge(f'{name}.in_flight', lambda: len(self._calls))
+        metrics.register_gauge(f'{name}.waiters', self.get_waiters)
+
+    def get_waiters(self) -> Dict[str, int]:
+        """
+        获取每个正在执行的键上等待的调用方数量
+
+        Returns:
+            dict: 键 -> 等待数量（不含leader）
+        """
+        with self._lock:
+            return {key: call.waiters for key, call in self._calls.items()}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        执行请求；若相同键的请求正在执行，则等待其结果
+
+        Args:
+            key (str): 请求键
+            fn (callable): 实际执行请求的函数
+            timeout (float, optional): 作为follower等待结果的最长时间(秒)
+
+        Returns:
+            tuple: (结果, 是否为等待其他调用方得到的结果)
+
+        Raises:
+            TimeoutError: 等待leader结果超时
+            Exception: leader执行失败时，leader抛出原异常，每个follower抛出其副本（__cause__为原异常）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not leader:
+            metrics.increment(f'{self.name}.coalesced')
+            logger.info(f"相同的问题正在处理中，等待其结果（当前等待 {call.waiters} 个）")
+            if not call.done.wait(timeout):
+                with self._lock:
+                    call.waiters -= 1
+                raise TimeoutError("等待相同问题的结果超时")
+            if call.error is not None:
+                raise _follower_error(call.error) from call.error
+            return call.result, True
+
+        metrics.increment(f'{self.name}.executed')
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+浏览器标签页管理模块
+多个AI助手共用一个浏览器时，每种助手固定使用一个标签页，切换助手只切换窗口句柄，
+不重新加载单页应用，各标签页的页面状态（如回复元素编号）得以保留。
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from src.utils.logger import get_logger
+from src.utils import metrics
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class BrowserTabs:
+    """
+    一个浏览器实例中各助手的标签页
+
+    WebDriver同一时间只能操作一个窗口，使用某个标签页的整个过程（切换、发送、等待回复）
+    需要在lock内完成，避免另一助手在中途切走窗口。
+    """
+
+    def __init__(self, driver):
+        """
+        初始化
+
+        Args:
+            driver (WebDriver): 浏览器实例
+        """
+        self.driver = driver
+        self.lock = threading.RLock()
+        self._handles: Dict[str, str] = {}  # 标签页键（助手类型） -> 窗口句柄
+
+    def activate(self, key: str) -> bool:
+        """
+        切换到key对应的标签页，不存在时占用尚未分配的当前窗口或新开一个标签页
+
+        Args:
+            key (str): 标签页键，通常为助手类型
+
+        Returns:
+            bool: 是否为新分配的标签页（调用方需要加载页面）
+        """
+        with self.lock:
+            handles = self.driver.window_handles
+            handle = self._handles.get(key)
+            if handle in handles:
+                if self.driver.current_window_handle != handle:
+                    self.driver.switch_to.window(handle)
+                    metrics.increment('tabs.switches')
+                return False
+
+            # 清理已被关闭的标签页
+            for stale in [k for k, h in self._handles.items() if h not in handles]:
+                del self._handles[stale]
+
+            current = self.driver.current_window_handle
+            if current in self._handles.values():
+                self.driver.switch_to.new_window('tab')
+                logger.info(f"为 {key} 新开标签页")
+            self._handles[key] = self.driver.current_window_handle
+            return True
+
+    @contextmanager
+    def use(self, key: str) -> Iterator[bool]:
+        """
+        独占浏览器并切换到key对应的标签页
+
+        Args:
+            key (str): 标签页键
+
+        Yields:
+            bool: 是否为新分配的标签页
+        """
+        with self.lock:
+            yield self.activate(key)
+
+    def release(self, key: str) -> None:
+        """
+        关闭key对应的标签页（浏览器中至少保留一个窗口）
+
+        Args:
+            key (str): 标签页键
+        """
+        with self.lock:
+            handle = self._handles.pop(key, None)
+            if handle is None:
+                return
+            try:
+                handles = self.driver.window_handles
+                if handle not in handles or len(handles) <= 1:
+                    return
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+                self.driver.switch_to.window(next(h for h in handles if h != handle))
+            except Exception as e:
+                logger.debug(f"关闭标签页失败: {e}")
+
+
+_registry: Dict[int, BrowserTabs] = {}
+_registry_lock = threading.Lock()
+
+
+def get_tabs(driver) -> Optional[BrowserTabs]:
+    """
+    获取浏览器实例的标签页管理器（同一实例共享一个管理器）
+
+    Args:
+        driver (WebDriver): 浏览器实例
+
+    Returns:
+        BrowserTabs or None: driver为None时返回None
+    """
+    if driver is None:
+        return None
+    with _registry_lock:
+        tabs = _registry.get(id(driver))
+        if tabs is None or tabs.driver is not driver:
+            tabs = _registry[id(driver)] = BrowserTabs(driver)
+        return tabs
+
+
+def forget_tabs(driver) -> None:
+    """
+    浏览器实例关闭或失效后移除其标签页管理器
+
+    Args:
+        driver (WebDriver): 浏览器实例
+    """
+    with _registry_lock:
+        tabs = _registry.get(id(driver))
+        if tabs is not None and tabs.driver is driver:
+            del _registry[id(driver)]
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+等待工具模块
+基于显式就绪条件的统一等待，替代固定时长的sleep，并记录每类等待的耗时
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException, WebDriverException
+
+from src.utils.logger import get_logger
+import config
+
+# 获取日志记录器
+logger = get_logger()
+
+
+class WaitTelemetry:
+    """等待耗时统计"""
+
+    def __init__(self):
+        """初始化统计"""
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, elapsed: float, timed_out: bool) -> None:
+        """
+        记录一次等待
+
+        Args:
+            name (str): 等待名称
+            elapsed (float): 耗时(秒)
+            timed_out (bool): 是否超时
+        """
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'count': 0, 'total': 0.0, 'max': 0.0, 'timeouts': 0
+            })
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            if timed_out:
+                stats['timeouts'] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        获取统计快照
+
+        Returns:
+            dict: 等待名称 -> {count, total, max, timeouts, avg}
+        """
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                item = dict(stats)
+                item['avg'] = item['total'] / item['count'] if item['count'] else 0.0
+                result[name] = item
+            return result
+
+    def reset(self) -> None:
+        """清空统计"""
+        with self._lock:
+            self._stats.clear()
+
+
+# 全局等待统计
+telemetry = WaitTelemetry()
+
+
+def get_wait_stats() -> Dict[str, Dict[str, float]]:
+    """
+    获取全局等待统计
+
+    Returns:
+        dict: 等待名称 -> 统计信息
+    """
+    return telemetry.snapshot()
+
+
+def wait_until(driver, condition: Callable[[Any], Any], timeout: Optional[float] = None,
+               name: str = 'wait', poll_frequency: Optional[float] = None,
+               raise_on_timeout: bool = True) -> Any:
+    """
+    等待条件成立，并记录耗时
+
+    Args:
+        driver (WebDriver): 浏览器实例
+        condition (callable): 就绪条件，接收driver，返回真值表示就绪
+        timeout (float, optional): 超时时间(秒)，默认使用配置中的implicit_wait
+        name (str): 等待名称，用于统计和日志
+        poll_frequency (float, optional): 轮询间隔(秒)，默认使用配置中的wait_poll_interval
+        raise_on_timeout (bool): 超时时是否抛出TimeoutException，为False时返回None
+
+    Returns:
+        Any: 条件返回的真值
+    """
+    if timeout is None:
+        timeout = config.WEBDRIVER_CONFIG.get('implicit_wait', 10)
+    if poll_frequency is None:
+        poll_frequency = config.WEBDRIVER_CONFIG.get('wait_poll_interval', 0.1)
+
+    start = time.perf_counter()
+    try:
+        result = WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(condition)
+    except TimeoutException:
+        elapsed = time.perf_counter() - start
+        telemetry.record(name, elapsed, timed_out=True)
+        logger.debug(f"等待 {name} 超时，耗时 {elapsed:.2f} 秒")
+        if raise_on_timeout:
+            raise
+        return None
+
+    elapsed = time.perf_counter() - start
+    telemetry.record(name, elapsed, timed_out=False)
+    logger.debug(f"等待 {name} 完成，耗时 {elapsed:.2f} 秒")
+    return result
+
+
+def document_ready() -> Callable[[Any], bool]:
+    """
+    页面加载完成条件
+
+    Returns:
+        callable: 条件函数
+    """
+    def _condition(driver):
+        return driver.execute_script("return document.readyState") == "complete"
+    return _condition
+
+
+def md_editor_present() -> Callable[[Any], Any]:
+    """
+    md-editor预览节点已出现且有内容的条件（用于判断欢迎消息已渲染）
+
+    Returns:
+        callable: 条件函数，就绪时返回元素列表
+    """
+    def _condition(driver):
+        elements = driver.execute_script("""
+            return Array.from(document.querySelectorAll('[id^="md-editor-v3_"][id$="-preview"]'))
+                .filter(el => el.offsetParent !== null && el.textContent.trim().length > 0);
+        """)
+        return elements or False
+    return _condition
+
+
+def input_filled(element, min_length: int = 1) -> Callable[[Any], bool]:
+    """
+    输入框已填写的条件（用于等待用户手动输入验证码）
+
+    Args:
+        element (WebElement): 输入框元素
+        min_length (int): 最少字符数
+
+    Returns:
+        callable: 条件函数
+    """
+    def _condition(driver):
+        try:
+            value = element.get_attribute('value') or ''
+        except StaleElementReferenceException:
+            # 输入框已失效，说明用户已自行提交了表单
+            return True
+        return len(value.strip()) >= min_length
+    return _condition
+
+
+def mark_document(driver) -> None:
+    """
+    在当前文档上设置导航标记，新文档中不存在该标记，据此观察导航事件
+
+    调用时driver应处于顶层文档（default_content）中。
+
+    Args:
+        driver (WebDriver): 浏览器实例
+    """
+    driver.execute_script("window.__buaaNavigationMarker = true;")
+
+
+def navigation_completed() -> Callable[[Any], Any]:
+    """
+    页面跳转完成条件
+
+    以mark_document设置的标记消失作为导航事件，新文档加载完成后返回当前URL，
+    避免反复轮询URL字符串。
+
+    Returns:
+        callable: 条件函数，就绪时返回新页面的URL
+    """
+    def _condition(driver):
+        try:
+            navigated = driver.execute_script(
+                "return !window.__buaaNavigationMarker && document.readyState === 'complete';"
+            )
+        except WebDriverException:
+            # 文档切换过程中脚本可能执行失败，视为尚未就绪
+            return False
+        if not navigated:
+            return False
+        return driver.current_url
+    return _condition
+
+
+def url_left(is_leaving_url: Callable[[str], bool]) -> Callable[[Any], Any]:
+    """
+    已离开指定站点的条件
+
+    Args:
+        is_leaving_url (callable): 判断URL是否仍属于要离开的站点
+
+    Returns:
+        callable: 条件函数，就绪时返回当前URL
+    """
+    def _condition(driver):
+        current_url = driver.current_url
+        if is_leaving_url(current_url):
+            return False
+        return current_url
+    return _condition
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+快速登录测试
+在本地启动CAS模拟服务和助手站点模拟服务，验证requests登录及其回退到浏览器表单的条件
+"""
+
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.auth import BUAAAuth
+
+USERNAME = 'zy2300000'
+PASSWORD = 'correct-password'
+
+LOGIN_PAGE = """<html><head><title>统一身份认证</title></head><body>
+<form method="post">
+<input type="hidden" name="execution" value="e1s1"/>
+<input type="hidden" name="_csrf" value="csrf-token"/>
+<div id="captchaParent" style="display: none;"></div>
+<button type="submit">登录</button>
+</form></body></html>"""
+
+# 登录表单改版：隐藏字段改名，旧的解析逻辑无法提取参数
+CHANGED_LOGIN_PAGE = """<html><head><title>统一身份认证</title></head><body>
+<form method="post"><input type="hidden" name="flowKey" value="abc"/><button>登录</button></form>
+</body></html>"""
+
+REJECTED_PAGE = """<html><head><title>统一身份认证</title></head><body>
+<p>认证信息无效</p><button>登录</button></body></html>"""
+
+
+class _CASHandler(BaseHTTPRequestHandler):
+    """统一认证模拟：GET返回登录页，POST校验用户名和密码后设置CASTGC并跳转到助手站点"""
+
+    login_page = LOGIN_PAGE
+    chat_url = ''
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body='', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._send(200, type(self).login_page)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        valid = (form.get('username') == [USERNAME] and form.get('password') == [PASSWORD]
+                 and form.get('execution') == ['e1s1'] and form.get('_csrf') == ['csrf-token'])
+        if not valid:
+            self._send(200, REJECTED_PAGE)
+            return
+        self._send(302, headers={'Location': type(self).chat_url, 'Set-Cookie': 'CASTGC=TGT-1; Path=/'})
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    """助手站点模拟：带有CASTGC时返回页面，否则跳转到统一认证"""
+
+    login_url = ''
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if 'CASTGC=TGT-1' in (self.headers.get('Cookie') or ''):
+            body = '<html><body>chat</body></html>'.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(302)
+            self.send_header('Location', type(self).login_url)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+
+def _serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FastLoginTest(unittest.TestCase):
+    """BUAAAuth.login 在本地CAS模拟服务上的行为"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cas = _serve(type('CASHandler', (_CASHandler,), {}))
+        cls.chat = _serve(type('ChatHandler', (_ChatHandler,), {}))
+        cls.login_url = f"http://127.0.0.1:{cls.cas.server_port}/login"
+        cls.chat_url = f"http://127.0.0.1:{cls.chat.server_port}/"
+        cls.cas.RequestHandlerClass.chat_url = cls.chat_url
+        cls.chat.RequestHandlerClass.login_url = cls.login_url
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cas.shutdown()
+        cls.chat.shutdown()
+
+    def setUp(self):
+        self.cas.RequestHandlerClass.login_page = LOGIN_PAGE
+
+    def _auth(self, password):
+        return BUAAAuth(USERNAME, password, login_url=self.login_url, redirect_url=self.chat_url)
+
+    def test_success(self):
+        auth = self._auth(PASSWORD)
+        with mock.patch.object(BUAAAuth, 'login_with_selenium') as selenium_login:
+            self.assertTrue(auth.login())
+        selenium_login.assert_not_called()
+        self.assertTrue(auth.is_authenticated)
+        self.assertEqual(auth.get_cookies().get('CASTGC'), 'TGT-1')
+
+    def test_wrong_password_skips_browser(self):
+        auth = self._auth('wrong-password')
+        with mock.patch.object(BUAAAuth, 'login_with_selenium') as selenium_login:
+            self.assertFalse(auth.login())
+        selenium_login.assert_not_called()
+        self.assertTrue(auth.credentials_rejected)
+        self.assertFalse(auth.is_authenticated)
+
+    def test_unknown_markup_falls_back_to_browser(self):
+        self.cas.RequestHandlerClass.login_page = CHANGED_LOGIN_PAGE
+        auth = self._auth(PASSWORD)
+        with mock.patch.object(BUAAAuth, 'login_with_selenium', return_value=True) as selenium_login:
+            self.assertTrue(auth.login())
+        selenium_login.assert_called_once()
+        self.assertFalse(auth.credentials_rejected)
+
+
+if __name__ == '__main__':
+    unittest.main()